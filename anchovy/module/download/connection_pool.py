@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import httplib
+import socket
+import threading
+import time
+from urlparse import urlsplit
+
+# 1ホストあたりの同時接続数
+DEFAULT_HOST_CONCURRENCY = 2
+
+# 同一ホストへのリクエスト間隔(秒)
+DEFAULT_POLITENESS_DELAY = 1.0
+
+# リトライ回数と初回の待ち時間(秒) 失敗するたびに倍にする
+DEFAULT_RETRY = 3
+DEFAULT_BACKOFF = 1.0
+
+DEFAULT_TIMEOUT = 30
+
+# リトライ対象のステータス
+RETRY_STATUS = (500, 502, 503, 504)
+
+
+class HTTPResponse(object):
+    """
+    読み込み済みのレスポンス
+    """
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class HostConnectionPool(object):
+    """
+    1ホスト分のkeep-alive接続を保持する
+
+    同時接続数を concurrency に制限し、
+    リクエストの開始間隔を delay 秒以上空ける。
+    """
+    def __init__(self, scheme, netloc, concurrency=DEFAULT_HOST_CONCURRENCY,
+                 delay=DEFAULT_POLITENESS_DELAY, timeout=DEFAULT_TIMEOUT):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.delay = delay
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._next_request_at = 0
+
+    def request(self, path, headers=None):
+        """
+        リクエストを送信してレスポンスを読み込む
+        接続はレスポンスを読み終えたらプールに戻す
+        """
+        with self._semaphore:
+            self._wait_politeness()
+            conn = self._get_connection()
+            try:
+                conn.request('GET', path, headers=headers or {})
+                response = conn.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._release_connection(conn)
+            return HTTPResponse(response.status, dict(response.getheaders()), body)
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for conn in idle:
+            conn.close()
+
+    def _wait_politeness(self):
+        with self._lock:
+            now = time.time()
+            wait = self._next_request_at - now
+            self._next_request_at = max(now, self._next_request_at) + self.delay
+        if wait > 0:
+            time.sleep(wait)
+
+    def _get_connection(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.netloc, timeout=self.timeout)
+        return httplib.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def _release_connection(self, conn):
+        with self._lock:
+            self._idle.append(conn)
+
+
+class ConnectionPoolManager(object):
+    """
+    ホストごとの HostConnectionPool を管理する
+    失敗した場合はバックオフしながらリトライする
+
+    pool = ConnectionPoolManager(concurrency=2, delay=1.0)
+    response = pool.request("http://awabi.2ch.net/ogame/subject.txt")
+    """
+    def __init__(self, concurrency=DEFAULT_HOST_CONCURRENCY, delay=DEFAULT_POLITENESS_DELAY,
+                 retry=DEFAULT_RETRY, backoff=DEFAULT_BACKOFF, timeout=DEFAULT_TIMEOUT):
+        self.concurrency = concurrency
+        self.delay = delay
+        self.retry = retry
+        self.backoff = backoff
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def request(self, url_string, headers=None):
+        scheme, netloc, path, query, _fragment = urlsplit(url_string)
+        if query:
+            path += '?' + query
+        pool = self.get_pool(scheme, netloc)
+
+        wait = self.backoff
+        for count in xrange(self.retry + 1):
+            last = count == self.retry
+            try:
+                response = pool.request(path or '/', headers)
+            except (httplib.HTTPException, socket.error):
+                if last:
+                    raise
+            else:
+                if response.status not in RETRY_STATUS or last:
+                    return response
+            time.sleep(wait)
+            wait *= 2
+
+    def get_pool(self, scheme, netloc):
+        key = (scheme, netloc)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = HostConnectionPool(scheme, netloc, self.concurrency, self.delay, self.timeout)
+                self._pools[key] = pool
+            return pool
+
+    def close(self):
+        with self._lock:
+            pools = self._pools.values()
+            self._pools = {}
+        for pool in pools:
+            pool.close()
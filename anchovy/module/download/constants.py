@@ -9,3 +9,5 @@ FILE_OPEN_OPTION = 'ignore'
 
 
 
+# 差分ダウンロードの状態の保存期間
+DOWNLOAD_STATE_TIMEOUT = 60 * 60 * 24 * 7
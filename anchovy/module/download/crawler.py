@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import httplib
+import logging
+import socket
+from multiprocessing.pool import ThreadPool
+from module.download.connection_pool import ConnectionPoolManager
+from module.download.models.download import PooledDownload, DownloadError
+from module.ita import Ita
+from module.parser.sure import parse_subject
+
+_logger = logging.getLogger('crawler')
+
+# 集計対象とするスレの書き込み数
+DEFAULT_MIN_POST_COUNT = 100
+
+# 全体のワーカースレッド数
+DEFAULT_WORKERS = 8
+
+# ダウンロード失敗として扱う例外
+DOWNLOAD_ERRORS = (DownloadError, httplib.HTTPException, socket.error)
+
+
+class CrawlResult(object):
+    """
+    1板分のクロール結果
+    """
+    def __init__(self, ita):
+        self.ita = ita
+        self.sure_list = []
+
+        # dat → Download  (on_dat を指定した場合は保持しない)
+        self.dat_dict = {}
+        self.dat_failed_count = 0
+
+        # subject.txt の取得に失敗した場合の例外
+        self.error = None
+
+
+class BoardCrawler(object):
+    """
+    全板の subject.txt と、書き込み数の多いスレの .dat をまとめてダウンロードする
+
+    ホストごとに keep-alive 接続を使い回し、同時接続数とリクエスト間隔を制限する。
+    板が別ホストに分かれていれば並列に取得されるので、
+    処理時間は板の数ではなくホストごとの取得数で決まる。
+
+    crawler = BoardCrawler(min_post_count=100)
+    for result in crawler.crawl():
+        ...
+    """
+    def __init__(self, min_post_count=DEFAULT_MIN_POST_COUNT, workers=DEFAULT_WORKERS,
+                 pool=None, on_dat=None):
+        self.min_post_count = min_post_count
+        self.workers = workers
+        if pool is None:
+            pool = ConnectionPoolManager()
+        self.pool = pool
+
+        # .dat を取得するたびに on_dat(ita, sure, download) を呼ぶ
+        self.on_dat = on_dat
+
+    def crawl(self, ita_list=None):
+        """
+        クロールを実行し、板ごとの CrawlResult のリストを返す
+        Ita の sure_number, failed_count を更新する
+        """
+        if ita_list is None:
+            ita_list = Ita.get_all()
+
+        thread_pool = ThreadPool(self.workers)
+        try:
+            results = thread_pool.map(self._crawl_subject, ita_list)
+
+            jobs = [(result, sure) for result in results for sure in result.sure_list]
+            for result, sure, download in thread_pool.imap_unordered(self._crawl_dat, jobs):
+                if download is None:
+                    result.dat_failed_count += 1
+                elif self.on_dat:
+                    self.on_dat(result.ita, sure, download)
+                else:
+                    result.dat_dict[sure.dat] = download
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+
+        # DBの更新はメインスレッドで行う
+        for result in results:
+            self._update_ita(result)
+        return results
+
+    def close(self):
+        self.pool.close()
+
+    def _crawl_subject(self, ita):
+        result = CrawlResult(ita)
+        try:
+            download = PooledDownload(ita.url, self.pool)
+        except DOWNLOAD_ERRORS, e:
+            _logger.warning('subject download failed. ita:%s %s', ita.pk, e)
+            result.error = e
+            return result
+
+        subject_list = parse_subject(download.lines, ita.url)
+        result.sure_list = [subject_list[i] for i in subject_list.filter_post_count(self.min_post_count)]
+        return result
+
+    def _crawl_dat(self, job):
+        result, sure = job
+        try:
+            download = PooledDownload(sure.dat_url, self.pool)
+        except DOWNLOAD_ERRORS, e:
+            _logger.warning('dat download failed. %s %s', sure.dat_url, e)
+            download = None
+        return result, sure, download
+
+    def _update_ita(self, result):
+        ita = result.ita
+        if result.error:
+            ita.failed_count += 1
+        else:
+            ita.sure_number = len(result.sure_list)
+            ita.failed_count = 0
+        ita.save()
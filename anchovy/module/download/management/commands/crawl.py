@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+全板クロール
+"""
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from module.download.connection_pool import ConnectionPoolManager
+from module.download.crawler import BoardCrawler
+
+
+class Command(BaseCommand):
+    """
+    登録されている全板の subject.txt と .dat をダウンロードする
+    python manage.py crawl --min_post_count=100 --workers=8 --concurrency=2 --delay=1.0
+    """
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--min_post_count', action='store', dest='min_post_count', type='int', default=100,
+            help=u'この書き込み数より多いスレの.datを取得する',
+            ),
+        make_option(
+            '--workers', action='store', dest='workers', type='int', default=8,
+            help=u'ワーカースレッド数',
+            ),
+        make_option(
+            '--concurrency', action='store', dest='concurrency', type='int', default=2,
+            help=u'1ホストあたりの同時接続数',
+            ),
+        make_option(
+            '--delay', action='store', dest='delay', type='float', default=1.0,
+            help=u'同一ホストへのリクエスト間隔(秒)',
+            ),
+        )
+
+    def handle(self, *args, **options):
+        pool = ConnectionPoolManager(concurrency=options['concurrency'], delay=options['delay'])
+        crawler = BoardCrawler(
+            min_post_count=options['min_post_count'],
+            workers=options['workers'],
+            pool=pool,
+            on_dat=self._on_dat,
+        )
+
+        start = time.time()
+        try:
+            results = crawler.crawl()
+        finally:
+            crawler.close()
+
+        for result in results:
+            if result.error:
+                print u"NG %s failed_count:%d" % (result.ita.url, result.ita.failed_count)
+            else:
+                print u"OK %s sure:%d dat_failed:%d" % (
+                    result.ita.url, len(result.sure_list), result.dat_failed_count)
+        print "elapsed: %.1f sec" % (time.time() - start)
+
+    def _on_dat(self, ita, sure, download):
+        print u"%s %s lines:%d" % (ita.url, sure.dat, len(download.lines))
@@ -52,9 +52,9 @@ class Command(BaseCommand):
                 print sure.title
                 sure_list.append(sure)
 
-                # MeCab
-                mecab_wrapper = MeCabWrapper(sure.title)
-                keyword_list += mecab_wrapper.word_list
+        # MeCab
+        for title, word_list in MeCabWrapper.parse_many(sure.title for sure in sure_list):
+            keyword_list += word_list
 
 
         # スレタイ一覧からキーワードを抽出
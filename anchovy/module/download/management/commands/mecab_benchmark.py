@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+MeCabのベンチマーク
+"""
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+import MeCab
+from module.download.models.download import Download
+from module.mecab.mecab_wrapper import MeCabWrapper
+from module.parser.sure import Sure
+
+
+SAMPLE_TITLES = [
+    u"【新生FF14】βテスター専用スレ　Part144",
+    u"太郎はこの本を二郎を見た女性に渡した。",
+    u"【PS3/PS4】ファイナルファンタジー14 新生エオルゼア 質問スレ Part12",
+    u"今日の晩ご飯を報告するスレ",
+]
+
+
+class Command(BaseCommand):
+    """
+    スレタイの形態素解析を1秒に何件処理できるか計測する
+    python manage.py mecab_benchmark --url="http://awabi.2ch.net/ogame/subject.txt"
+    """
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--url', action='store', dest='url', default=None,
+            help=u'subject.txtのurl 未指定の場合はサンプルのタイトルを使う',
+            ),
+        make_option(
+            '--count', action='store', dest='count', type='int', default=1000,
+            help=u'解析するタイトル数',
+            ),
+        )
+
+    def handle(self, *args, **options):
+        titles = self._get_titles(options.get('url'))
+        count = options.get('count')
+        titles = (titles * (count / len(titles) + 1))[:count]
+
+        print "titles:%d" % len(titles)
+        self._show("before (Tagger per title)", self._run_before, titles)
+        self._show("after (TaggerPool)", self._run_after, titles)
+        self._show("after (parse_many)", self._run_parse_many, titles)
+
+    def _get_titles(self, url_string):
+        if not url_string:
+            return SAMPLE_TITLES
+
+        titles = []
+        for l in Download(url_string).lines:
+            try:
+                titles.append(Sure(l, url_string).title)
+            except (TypeError, IndexError):
+                continue
+        return titles or SAMPLE_TITLES
+
+    def _show(self, label, func, titles):
+        start = time.time()
+        func(titles)
+        elapsed = time.time() - start
+        print "%s: %.3f sec %.1f titles/sec" % (label, elapsed, len(titles) / elapsed)
+
+    def _run_before(self, titles):
+        """
+        変更前の処理 タイトルごとにTaggerを生成する
+        """
+        for title in titles:
+            t = MeCab.Tagger(" ")
+            sentence = title.encode('utf-8')
+            m = t.parseToNode(sentence)
+            word_list = []
+            while m:
+                if m.surface and MeCabWrapper._check_subjects_feature(m):
+                    word_list.append(m.surface)
+                m = m.next
+
+    def _run_after(self, titles):
+        for title in titles:
+            MeCabWrapper(title)
+
+    def _run_parse_many(self, titles):
+        for title, word_list in MeCabWrapper.parse_many(titles):
+            pass
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+subject.txt パースのベンチマーク
+"""
+import re
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from module.download.models.download import Download
+from module.mecab.ng_word import NGBase
+from module.parser.sure import Sure, parse_subject
+
+
+class Command(BaseCommand):
+    """
+    subject.txt のパースにかかる時間を計測する
+    python manage.py sure_benchmark --url="http://awabi.2ch.net/ogame/subject.txt"
+    """
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--url', action='store', dest='url', default=None,
+            help=u'subject.txtのurl 未指定の場合は生成した行を使う',
+            ),
+        make_option(
+            '--lines', action='store', dest='lines', type='int', default=1000,
+            help=u'生成する行数 (subject.txtの1板分)',
+            ),
+        make_option(
+            '--repeat', action='store', dest='repeat', type='int', default=20,
+            help=u'繰り返し回数',
+            ),
+        )
+
+    def handle(self, *args, **options):
+        url_string = options.get('url') or 'http://example.com/test/subject.txt'
+        if options.get('url'):
+            lines = Download(url_string).lines
+        else:
+            lines = self._make_lines(options['lines'])
+        repeat = options['repeat']
+
+        print "lines:%d repeat:%d" % (len(lines), repeat)
+        self._show("before (regex)", self._run_before, lines, url_string, repeat)
+        self._show("after (Sure)", self._run_after, lines, url_string, repeat)
+        self._show("after (parse_subject)", self._run_parse_subject, lines, url_string, repeat)
+
+    def _make_lines(self, count):
+        return [
+            u"%d.dat<>【新生FF14】βテスター専用スレ　Part%d (%d)" % (1362274743 + i, i, (i * 37) % 1001)
+            for i in xrange(count)
+        ]
+
+    def _show(self, label, func, lines, url_string, repeat):
+        start = time.time()
+        for _ in xrange(repeat):
+            func(lines, url_string)
+        elapsed = time.time() - start
+        print "%s: %.3f sec %.1f lines/sec" % (label, elapsed, len(lines) * repeat / elapsed)
+
+    def _run_before(self, lines, url_string):
+        """
+        変更前の処理
+        """
+        for l in lines:
+            split_result = re.split('<>', l)
+            try:
+                re.sub(r'\.dat', '', split_result[0])
+                title = re.sub(r'\(\d+\)', '', split_result[1])
+            except IndexError:
+                continue
+            if NGBase.check(title):
+                continue
+            try:
+                post_count = re.sub(title, '', split_result[1])
+                int(re.search(r'\d+', post_count).group(0))
+            except:
+                pass
+
+    def _run_after(self, lines, url_string):
+        for l in lines:
+            try:
+                Sure(l, url_string)
+            except (TypeError, IndexError):
+                continue
+
+    def _run_parse_subject(self, lines, url_string):
+        parse_subject(lines, url_string)
@@ -1,7 +1,9 @@
 # -*- coding:utf-8 -*-
 import urllib
+import urllib2
 import re
-from module.download.constants import FILE_CHARACTER_CODE, FILE_OPEN_OPTION
+from StringIO import StringIO
+from module.download.constants import FILE_CHARACTER_CODE, FILE_OPEN_OPTION, DOWNLOAD_STATE_TIMEOUT
 
 
 class Download(object):
@@ -25,3 +27,194 @@ class Download(object):
 
     def _download(self, url_string):
         return urllib.urlopen(url_string)
+
+
+class DownloadError(Exception):
+    """
+    ダウンロードに失敗した
+    """
+    def __init__(self, url_string, status):
+        super(DownloadError, self).__init__('%s status:%s' % (url_string, status))
+        self.url = url_string
+        self.status = status
+
+
+class PooledDownload(Download):
+    """
+    ConnectionPoolManager の keep-alive 接続を使ってダウンロードする
+    """
+    def __init__(self, url_string, pool):
+        self.pool = pool
+        super(PooledDownload, self).__init__(url_string)
+
+    def _download(self, url_string):
+        response = self.pool.request(url_string)
+        if response.status != 200:
+            raise DownloadError(url_string, response.status)
+        return StringIO(response.body)
+
+
+class DownloadState(object):
+    """
+    URLごとの前回ダウンロード時の情報
+    """
+    def __init__(self, etag=None, last_modified=None, size=0, count=0):
+        self.etag = etag
+        self.last_modified = last_modified
+
+        # 取得済みのバイト数 (改行まで読めた分)
+        self.size = size
+
+        # 取得済みの行数
+        self.count = count
+
+
+class MemoryStateStore(object):
+    """
+    DownloadState をプロセス内に保持する
+    """
+    def __init__(self):
+        self._states = {}
+
+    def get(self, url_string):
+        return self._states.get(url_string)
+
+    def set(self, url_string, state):
+        self._states[url_string] = state
+
+    def delete(self, url_string):
+        self._states.pop(url_string, None)
+
+
+class CacheStateStore(object):
+    """
+    DownloadState を django cache に保持する
+    """
+    KEY_FORMAT = 'DOWNLOAD_STATE/%s'
+
+    def __init__(self, timeout=DOWNLOAD_STATE_TIMEOUT):
+        from django.core.cache import cache
+        self._cache = cache
+        self._timeout = timeout
+
+    def get(self, url_string):
+        return self._cache.get(self._key(url_string))
+
+    def set(self, url_string, state):
+        self._cache.set(self._key(url_string), state, self._timeout)
+
+    def delete(self, url_string):
+        self._cache.delete(self._key(url_string))
+
+    def _key(self, url_string):
+        return self.KEY_FORMAT % url_string
+
+
+class StreamDownload(object):
+    """
+    差分ダウンロード
+
+    前回のETag, Last-Modified, 取得済みバイト数をURLごとに保存しておき、
+    If-None-Match, If-Modified-Since, Range: bytes=N- を付けてリクエストする。
+    2ch の .dat は追記のみなので、新しい書き込みの分だけ取得できる。
+
+    あぼーん等で前回取得分が変わっていた場合は全体を取得し直す。
+    取得し直した場合は is_full が True になる。
+
+    lines() はデコードした行を1行ずつ返す
+    start_number は今回取得した最初の行が何行目か (1から)
+    for l in StreamDownload(url).lines():
+        ...
+    """
+
+    def __init__(self, url_string, state_store=None):
+        self.url = url_string
+        if state_store is None:
+            state_store = CacheStateStore()
+        self.state_store = state_store
+
+        # 変更がなかった (304) 場合True
+        self.not_modified = False
+
+        # 全体を取得した場合True
+        self.is_full = False
+
+        # 今回取得した最初の行の行番号
+        self.start_number = None
+
+    def lines(self):
+        """
+        新しく追加された行をデコードして返す
+        """
+        state = self.state_store.get(self.url)
+        if state is None or getattr(state, 'count', None) is None:
+            # 行数を持たない古い状態は使わない
+            state = DownloadState()
+        response = self._open(state, use_range=state.size > 0)
+        if response is None:
+            self.not_modified = True
+            return
+
+        try:
+            if state.size > 0 and response.code == 206:
+                # 1バイト手前から取得しているので、改行で始まっていなければ前回取得分が変わっている
+                if response.read(1) != '\n':
+                    response.close()
+                    state = DownloadState()
+                    response = self._open(state, use_range=False)
+            elif state.size > 0:
+                # Rangeが無視された
+                state = DownloadState()
+
+            self.is_full = state.size == 0
+            self.start_number = state.count + 1
+            self._update_state(state, response)
+
+            for raw in response:
+                if not raw.endswith('\n'):
+                    # 書き込み途中の行は次回取得する
+                    break
+                state.size += len(raw)
+                state.count += 1
+
+                # デコード 改行コードの削除
+                yield raw.decode(FILE_CHARACTER_CODE, FILE_OPEN_OPTION).rstrip(u'\r\n')
+        finally:
+            response.close()
+            self.state_store.set(self.url, state)
+
+    def reset(self):
+        """
+        保存している状態を削除し、次回は全体を取得する
+        """
+        self.state_store.delete(self.url)
+
+    def _open(self, state, use_range):
+        request = urllib2.Request(self.url)
+        if use_range:
+            if state.etag:
+                request.add_header('If-None-Match', state.etag)
+            if state.last_modified:
+                request.add_header('If-Modified-Since', state.last_modified)
+            request.add_header('Range', 'bytes=%d-' % (state.size - 1))
+
+        try:
+            return self._urlopen(request)
+        except urllib2.HTTPError, e:
+            if e.code == 304:
+                return None
+            if e.code == 416 and use_range:
+                # 前回より小さくなっている
+                return self._urlopen(urllib2.Request(self.url))
+            raise
+
+    def _urlopen(self, request):
+        return urllib2.urlopen(request)
+
+    def _update_state(self, state, response):
+        etag = response.info().getheader('ETag')
+        last_modified = response.info().getheader('Last-Modified')
+        if etag:
+            state.etag = etag
+        if last_modified:
+            state.last_modified = last_modified
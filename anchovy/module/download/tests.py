@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from module.download.models.download import StreamDownload, MemoryStateStore
+
+
+class DatHandler(BaseHTTPRequestHandler):
+    """
+    .dat を返すスタンドインサーバー
+    Range, If-None-Match に対応する
+    """
+    def do_GET(self):
+        body = self.server.body
+        etag = '"%d"' % len(body)
+        self.server.requests.append(dict(self.headers))
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        range_header = self.headers.get('Range')
+        if range_header:
+            start = int(range_header[len('bytes='):].rstrip('-'))
+            if start >= len(body):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+            body = body[start:]
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestStreamDownload(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), DatHandler)
+        self.server.body = ''
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/test/dat/1.dat' % self.server.server_port
+        self.store = MemoryStateStore()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _lines(self):
+        download = StreamDownload(self.url, self.store)
+        return download, list(download.lines())
+
+    def test_append(self):
+        """
+        追記された行だけ取得する
+        """
+        self.server.body = u'a<>\nb<>\n'.encode('shift-jis')
+        download, lines = self._lines()
+        self.assertEqual(lines, [u'a<>', u'b<>'])
+        self.assertTrue(download.is_full)
+
+        self.server.body += u'あ<>\n'.encode('shift-jis')
+        download, lines = self._lines()
+        self.assertEqual(lines, [u'あ<>'])
+        self.assertFalse(download.is_full)
+        self.assertEqual(download.start_number, 3)
+        self.assertEqual(self.server.requests[-1]['range'], 'bytes=7-')
+
+    def test_not_modified(self):
+        self.server.body = 'a<>\n'
+        self._lines()
+        download, lines = self._lines()
+        self.assertEqual(lines, [])
+        self.assertTrue(download.not_modified)
+
+    def test_partial_line(self):
+        """
+        改行で終わっていない行は次回取得する
+        """
+        self.server.body = 'a<>\nb'
+        download, lines = self._lines()
+        self.assertEqual(lines, [u'a<>'])
+
+        self.server.body += '<>\n'
+        download, lines = self._lines()
+        self.assertEqual(lines, [u'b<>'])
+
+    def test_rewritten(self):
+        """
+        前回取得分が変わっていたら全体を取得し直す
+        """
+        self.server.body = 'a<>\nb<>\n'
+        self._lines()
+
+        self.server.body = 'cc<>\nd<>\ne<>\n'
+        download, lines = self._lines()
+        self.assertEqual(lines, [u'cc<>', u'd<>', u'e<>'])
+        self.assertTrue(download.is_full)
+        self.assertEqual(download.start_number, 1)
+
+    def test_shrunk(self):
+        self.server.body = 'a<>\nb<>\n'
+        self._lines()
+
+        self.server.body = 'c<>\n'
+        download, lines = self._lines()
+        self.assertEqual(lines, [u'c<>'])
+        self.assertTrue(download.is_full)
@@ -11,7 +11,8 @@ class Ita(CachedMasterModel, EnableFlagMixin, NameFieldMixin):
     # 格納されているスレ数
     sure_number = models.IntegerField(default=0)
 
-    # Faild_count DL失敗したときの連続失敗数をカウントする
+    # DL失敗したときの連続失敗数をカウントする
+    failed_count = models.IntegerField(default=0)
 
     class Meta(object):
         app_label = 'ita'
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache as django_cache
+
+# プロセス内に保持する単語数の上限
+FEATURE_CACHE_SIZE = getattr(settings, 'MECAB_FEATURE_CACHE_SIZE', 100000)
+
+# 共有キャッシュ(django cache)の保存期間
+FEATURE_CACHE_TIMEOUT = getattr(settings, 'MECAB_FEATURE_CACHE_TIMEOUT', 60 * 60 * 24 * 7)
+
+# 未書き込みのfeatureがこの数になったら flush() する
+FEATURE_CACHE_FLUSH_SIZE = getattr(settings, 'MECAB_FEATURE_CACHE_FLUSH_SIZE', 1000)
+
+FEATURE_CACHE_KEY_PREFIX = 'MECAB_FEATURE/'
+
+
+class FeatureCache(object):
+    """
+    単語 → MeCabのfeature のキャッシュ
+
+    スレタイ解析時に得られたfeatureを保持しておき、
+    キーワードの品詞判定でMeCabを再度実行しないようにする。
+
+    プロセス内はサイズ上限付きのLRU、
+    プロセス間・実行間はdjango cacheで共有する。
+    django cache への書き込みは flush() でまとめて行う。
+    未書き込みが FEATURE_CACHE_FLUSH_SIZE 件になった場合は set() の中で flush() する。
+    django cache に無かった単語は覚えておき、再度問い合わせない。
+    """
+    _lock = threading.Lock()
+    _features = OrderedDict()
+    _dirty = {}
+    _missing = set()
+
+    @classmethod
+    def get(cls, word):
+        """
+        featureを取得 無ければNone
+        """
+        with cls._lock:
+            feature = cls._features.pop(word, None)
+            if feature is not None:
+                cls._features[word] = feature
+                return feature
+            if word in cls._missing:
+                return None
+
+        feature = django_cache.get(cls._cache_key(word))
+        if feature is not None:
+            cls._store(word, feature)
+        else:
+            cls._add_missing([word])
+        return feature
+
+    @classmethod
+    def set(cls, word, feature):
+        """
+        featureを保存
+        既に保存済みの単語は上書きしない
+        """
+        with cls._lock:
+            if word in cls._features:
+                return
+            cls._dirty[word] = feature
+            cls._missing.discard(word)
+            need_flush = len(cls._dirty) >= FEATURE_CACHE_FLUSH_SIZE
+        cls._store(word, feature)
+        if need_flush:
+            cls.flush()
+
+    @classmethod
+    def load(cls, words):
+        """
+        プロセス内に無い単語のfeatureを django cache からまとめて読み込む
+        """
+        with cls._lock:
+            missing = [word for word in words
+                       if word not in cls._features and word not in cls._missing]
+        if not missing:
+            return
+
+        keys = dict((cls._cache_key(word), word) for word in missing)
+        found = django_cache.get_many(keys.keys())
+        for key, feature in found.items():
+            cls._store(keys[key], feature)
+        cls._add_missing([word for key, word in keys.items() if key not in found])
+
+    @classmethod
+    def flush(cls):
+        """
+        新しく得られたfeatureを django cache にまとめて書き込む
+        """
+        with cls._lock:
+            dirty = cls._dirty
+            cls._dirty = {}
+        if not dirty:
+            return
+
+        data = dict((cls._cache_key(word), feature) for word, feature in dirty.items())
+        django_cache.set_many(data, FEATURE_CACHE_TIMEOUT)
+
+    @classmethod
+    def clear(cls):
+        """
+        プロセス内のキャッシュを破棄する
+        """
+        with cls._lock:
+            cls._features.clear()
+            cls._dirty = {}
+            cls._missing = set()
+
+    @classmethod
+    def _store(cls, word, feature):
+        with cls._lock:
+            cls._features.pop(word, None)
+            cls._features[word] = feature
+            while len(cls._features) > FEATURE_CACHE_SIZE:
+                cls._features.popitem(last=False)
+
+    @classmethod
+    def _add_missing(cls, words):
+        with cls._lock:
+            if len(cls._missing) + len(words) > FEATURE_CACHE_SIZE:
+                cls._missing = set()
+            cls._missing.update(words)
+
+    @classmethod
+    def _cache_key(cls, word):
+        if isinstance(word, unicode):
+            word = word.encode('utf-8')
+        # memcachedのキーに使えない文字があるのでハッシュ化
+        return FEATURE_CACHE_KEY_PREFIX + hashlib.md5(word).hexdigest()
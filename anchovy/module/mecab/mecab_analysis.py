@@ -5,7 +5,9 @@ import MeCab
 
 # 特徴語認定するためのしきい値
 # センテンス結合数と出現数
+from module.mecab.feature_cache import FeatureCache
 from module.mecab.mecab_wrapper import MeCabWrapper
+from module.mecab.phrase_counter import NgramPhraseCounter, TextPhraseCounter, MULTI_SENTENCE_MIN, MULTI_SENTENCE_MAX
 
 SENTENCE_LIMIT_MAP = {
     1:20,
@@ -39,9 +41,13 @@ SENTENCE_LIMIT_MAP = {
 class MeCabAnalysis(object):
     """
     MeCabの解析結果を取りまとめる
+
+    compatible=True の場合は、複数センテンスの出現数を
+    キーワードを連結したテキスト中の部分一致で数える (従来の挙動)
     """
-    def __init__(self, keyword_list):
+    def __init__(self, keyword_list, compatible=False):
         print "==========start mecab analysis=========="
+        self.compatible = compatible
         self.word_count_dict = {}
         self.key_word_dict = {}
         self.unique_word_list = []
@@ -70,9 +76,15 @@ class MeCabAnalysis(object):
         # キーワードリストの生成
         self._analysis_keyword()
 
+        # 品詞判定に使うfeatureをまとめて読み込んでおく
+        FeatureCache.load(self.key_word_dict.keys())
+
         # 複数センテンスからなる重複ワードを解析
         self._analysis_multi_word_sentence(keyword_list)
 
+        # 新しく得られたfeatureを次回の実行のために保存
+        FeatureCache.flush()
+
         # 重複を排除してユニークワードを生成
         self._make_unique_word()
 
@@ -102,22 +114,21 @@ class MeCabAnalysis(object):
         """
         複数センテンスからなる重複ワードを解析
         """
-        # 調査対象のtextを生成
-        target_text = ""
-        for keyword in keyword_list:
-            target_text += keyword
+        # 調査対象のn-gramを数え上げる
+        if self.compatible:
+            counter = TextPhraseCounter(keyword_list)
+        else:
+            counter = NgramPhraseCounter(keyword_list)
 
         # 頻出単語
         for dict_key in self.key_word_dict:
             keyword = self.key_word_dict.get(dict_key)
             if keyword and self._check_keyword_type(dict_key):
-                multi_sentence = self._anal(dict_key, keyword_list, target_text)
+                multi_sentence = self._anal(dict_key, counter)
 
-                # 調査対象のtextから該当のセンテンスを削除
                 if multi_sentence:
                     # 特徴後に設定
                     self.unique_word_list_multi.append(multi_sentence)
-                    target_text = target_text.replace(multi_sentence, "")
 
     def _check_keyword_type(self, word):
         """
@@ -145,45 +156,31 @@ class MeCabAnalysis(object):
 
         return True
 
-    def _anal(self, keyword, keyword_list, target_text):
+    def _anal(self, keyword, counter):
         """
-        print する
+        keywordの出現位置から始まる複数センテンスのうち、
+        しきい値以上出現する最長のものを返す
         """
-        # print "+++++++++++start _anal!! SEARCH WORD:%s+++++++++++" % keyword
-
-        index = 0
-        # self._anal_show(count, keyword_list)
-
         # keywordの出現するindexを調べる
-        for _keyword in keyword_list:
-            if keyword == _keyword:
-                break
-            index += 1
-
-        # キーワードの出現数を調べる
-        return self._anal_show(index, keyword_list, target_text)
-
-    def _anal_show(self, index, keyword_list, target_text):
-        for sentence_count in reversed(xrange(2, 11)):
-            multi_sentence = self._get_multi_sentence(keyword_list, index, sentence_count)
-            if multi_sentence:
-                # text中の出現数をカウントする
-                text_count = target_text.count(multi_sentence)
-
-                # しきい値以上の特徴後を抽出
-                if self._check_unique_word(sentence_count, text_count):
-                    print sentence_count, multi_sentence, text_count
-                    return multi_sentence
-
-        try:
-            # print keyword_list[count], keyword_list[count+1]
-            # print keyword_list[count], keyword_list[count+1], keyword_list[count+2]
-            # print keyword_list[count], keyword_list[count+1], keyword_list[count+2], keyword_list[count+3]
-            # print keyword_list[count], keyword_list[count+1], keyword_list[count+2], keyword_list[count+3], keyword_list[count+4]
-            # print keyword_list[count], keyword_list[count+1], keyword_list[count+2], keyword_list[count+3], keyword_list[count+4], keyword_list[count+5]
-            pass
-        except IndexError:
-            pass
+        index = counter.first_index(keyword)
+        if index is None:
+            return None
+
+        for sentence_count in reversed(xrange(MULTI_SENTENCE_MIN, MULTI_SENTENCE_MAX + 1)):
+            # 出現数をカウントする
+            text_count = counter.count(index, sentence_count)
+            if text_count is None:
+                continue
+
+            # しきい値以上の特徴後を抽出
+            if self._check_unique_word(sentence_count, text_count):
+                multi_sentence = counter.phrase(index, sentence_count)
+                print sentence_count, multi_sentence, text_count
+
+                # 調査対象から該当のセンテンスを削除
+                counter.remove(index, sentence_count)
+                return multi_sentence
+        return None
 
     def _check_unique_word(self, sentence_count, text_count):
         """
@@ -192,15 +189,6 @@ class MeCabAnalysis(object):
         limit_count = SENTENCE_LIMIT_MAP.get(sentence_count)
         return limit_count <= text_count
 
-    def _get_multi_sentence(self, keyword_list, count, sentence_count):
-        multi_sentence = ""
-        for x in xrange(count, count + sentence_count):
-            try:
-                multi_sentence += keyword_list[x]
-            except IndexError:
-                return None
-        return multi_sentence
-
     def _make_unique_word(self):
         for single in self.unique_word_list_single:
             for multi in self.unique_word_list_multi:
@@ -2,6 +2,19 @@
 import MeCab
 import sys
 import string
+from module.mecab.feature_cache import FeatureCache
+from module.mecab.tagger_pool import TaggerPool
+
+# ノードの属性はSWIGの関数を直接呼んで取得する
+# Node.__getattr__ (_swig_getattr) を経由すると遅いため
+try:
+    _node_surface = MeCab._MeCab.Node_surface_get
+    _node_feature = MeCab._MeCab.Node_feature_get
+    _node_next = MeCab._MeCab.Node_next_get
+except AttributeError:
+    _node_surface = lambda node: node.surface
+    _node_feature = lambda node: node.feature
+    _node_next = lambda node: node.next
 
 
 class MeCabWrapper(object):
@@ -13,7 +26,8 @@ class MeCabWrapper(object):
         #print MeCab.VERSION
 
         # t = MeCab.Tagger (" ".join(sys.argv))
-        t = MeCab.Tagger (" ")
+        # Taggerは使い回す
+        t = TaggerPool.get()
 
         # encode utf8
         # http://shogo82148.github.io/blog/2012/12/15/mecab-python/
@@ -74,13 +88,46 @@ class MeCabWrapper(object):
 
         self.word_list.append(node.surface)
 
+        # 品詞判定で使うのでfeatureを覚えておく
+        FeatureCache.set(word, node.feature)
+
+    @classmethod
+    def parse_many(cls, titles):
+        """
+        複数のタイトルをまとめて形態素解析する
+        (title, word_list) を順に返す
+        word_list は MeCabWrapper(title).word_list と同じ
+
+        Tagger, Lattice は1つだけ使い回す
+        """
+        tagger = TaggerPool.get()
+        lattice = TaggerPool.get_lattice()
+        for title in titles:
+            word_list = []
+            lattice.set_sentence(title.encode('utf-8'))
+            if tagger.parse(lattice):
+                m = lattice.bos_node()
+                while m:
+                    surface = _node_surface(m)
+                    if surface:
+                        feature = _node_feature(m)
+                        if cls._check_feature(feature):
+                            word_list.append(surface)
+                            FeatureCache.set(surface, feature)
+                    m = _node_next(m)
+            yield title, word_list
+
     @classmethod
     def _check_subjects_feature(cls, node):
         """
         スレタイから、特定品詞を除外する
         記号とか
         """
-        if "記号" in node.feature:
+        return cls._check_feature(node.feature)
+
+    @classmethod
+    def _check_feature(cls, feature):
+        if "記号" in feature:
             return False
 
         # if "非自立" in node.feature:
@@ -94,12 +141,22 @@ class MeCabWrapper(object):
 
     @classmethod
     def get_feature(cls, sentence):
-        t = MeCab.Tagger (" ")
+        """
+        先頭の単語のfeatureを取得
+        解析済みの単語はMeCabを実行せずにキャッシュから返す
+        """
+        feature = FeatureCache.get(sentence)
+        if feature is not None:
+            return feature
+
+        t = TaggerPool.get()
         m = t.parseToNode(sentence)
         while m:
             if m.surface:
                 # print m.surface, "\t", m.feature
-                return m.feature
+                feature = m.feature
+                FeatureCache.set(sentence, feature)
+                return feature
             m = m.next
         return None
 
@@ -19,27 +19,75 @@ REMOVE_WORD = [
 
 
 class NGBase(object):
+    """
+    WORD_LIST のいずれかを含むかを調べる
+
+    WORD_LIST は1つの正規表現にまとめてコンパイルしておき、
+    textを1回走査するだけで判定・除外する。
+    WORD_LIST の内容が変わった場合はコンパイルし直す。
+    """
     WORD_LIST = NG_WORD
 
+    # クラスごとのコンパイル済みパターン
+    # cls: (コンパイル時の WORD_LIST のタプル, pattern)
+    _compiled = {}
+
     @classmethod
     def check(cls, text):
         """
         マッチしたらTrue
         """
-        for _ng in cls.WORD_LIST:
-            m = re.search(_ng, text)
-            if m:
-                return True
-        return False
+        return cls.match(text) is not None
+
+    @classmethod
+    def match(cls, text):
+        """
+        最初にマッチしたワードを返す
+        マッチしなければNone
+        """
+        pattern = cls._get_pattern()
+        if pattern is None:
+            return None
+        m = pattern.search(text)
+        if m:
+            return m.group(0)
+        return None
 
     @classmethod
     def remove(cls, text):
         """
         textからNGワードを除外して返却
         """
-        for _ng_word in cls.WORD_LIST:
-            text = re.sub(r'%s' % _ng_word, '', text)
-        return text
+        pattern = cls._get_pattern()
+        if pattern is None:
+            return text
+        return pattern.sub(u'', text)
+
+    @classmethod
+    def set_words(cls, word_list):
+        """
+        WORD_LIST を差し替える
+        DBから読み込んだワードを設定する場合に使う
+        """
+        cls.WORD_LIST = list(word_list)
+        cls._compiled.pop(cls, None)
+
+    @classmethod
+    def _get_pattern(cls):
+        # 要素の書き換えにも気づけるよう、内容で比較する
+        word_list = tuple(cls.WORD_LIST)
+        compiled = cls._compiled.get(cls)
+        if compiled and compiled[0] == word_list:
+            return compiled[1]
+
+        words = sorted(set(word for word in word_list if word), key=len, reverse=True)
+        if words:
+            # 長いワードを優先してマッチさせる
+            pattern = re.compile(u'|'.join(re.escape(word) for word in words), re.UNICODE)
+        else:
+            pattern = None
+        cls._compiled[cls] = (word_list, pattern)
+        return pattern
 
 class NGWord(NGBase):
     WORD_LIST = NG_WORD
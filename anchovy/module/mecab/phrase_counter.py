@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+
+# 結合するセンテンス数の範囲
+MULTI_SENTENCE_MIN = 2
+MULTI_SENTENCE_MAX = 10
+
+
+class NgramPhraseCounter(object):
+    """
+    キーワードリストの n-gram (n = 2..10) を1回の走査で数え上げる
+
+    n-gram ごとに出現位置を辞書に保持しておくので、
+    出現数の取得はその n-gram の出現数に比例する時間で済む。
+    特徴語として採用したフレーズは remove() で出現箇所を使用済みにし、
+    以降のカウントから除外する。
+
+    単語の区切りに揃えて数えるので、単語をまたいだ部分一致は数えない。
+    """
+
+    def __init__(self, keyword_list, min_n=MULTI_SENTENCE_MIN, max_n=MULTI_SENTENCE_MAX):
+        self.keyword_list = list(keyword_list)
+        self._first_index = {}
+        self._positions = defaultdict(list)
+        self._consumed = bytearray(len(self.keyword_list))
+
+        words = self.keyword_list
+        size = len(words)
+        for i in xrange(size):
+            self._first_index.setdefault(words[i], i)
+            for n in xrange(min_n, min(max_n, size - i) + 1):
+                self._positions[tuple(words[i:i + n])].append(i)
+
+    def first_index(self, keyword):
+        """
+        keywordが最初に出現するindex 無ければNone
+        """
+        return self._first_index.get(keyword)
+
+    def phrase(self, index, n):
+        """
+        indexから n 単語を結合したフレーズ 足りなければNone
+        """
+        if index + n > len(self.keyword_list):
+            return None
+        return "".join(self.keyword_list[index:index + n])
+
+    def count(self, index, n):
+        """
+        indexから n 単語のフレーズの出現数 フレーズが作れなければNone
+        重なり合う出現は数えない (str.count と同じ)
+        """
+        if index + n > len(self.keyword_list):
+            return None
+        return len(self._live_positions(index, n))
+
+    def remove(self, index, n):
+        """
+        indexから n 単語のフレーズの出現箇所を使用済みにする
+        """
+        for p in self._live_positions(index, n):
+            self._consumed[p:p + n] = '\x01' * n
+
+    def _live_positions(self, index, n):
+        positions = self._positions.get(tuple(self.keyword_list[index:index + n]), [])
+        live = []
+        end = 0
+        for p in positions:
+            if p < end:
+                continue
+            if self._consumed.find('\x01', p, p + n) >= 0:
+                continue
+            live.append(p)
+            end = p + n
+        return live
+
+
+class TextPhraseCounter(object):
+    """
+    互換モード
+    キーワードを連結したテキスト中の部分一致で出現数を数える (従来の挙動)
+    remove() でテキストからフレーズを削除する
+    """
+
+    def __init__(self, keyword_list):
+        self.keyword_list = list(keyword_list)
+        self.target_text = "".join(self.keyword_list)
+        self._first_index = {}
+        for i, keyword in enumerate(self.keyword_list):
+            self._first_index.setdefault(keyword, i)
+
+    def first_index(self, keyword):
+        return self._first_index.get(keyword)
+
+    def phrase(self, index, n):
+        if index + n > len(self.keyword_list):
+            return None
+        return "".join(self.keyword_list[index:index + n])
+
+    def count(self, index, n):
+        multi_sentence = self.phrase(index, n)
+        if not multi_sentence:
+            return None
+        return self.target_text.count(multi_sentence)
+
+    def remove(self, index, n):
+        self.target_text = self.target_text.replace(self.phrase(index, n), "")
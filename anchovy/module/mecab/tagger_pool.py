@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import MeCab
+
+# Tagger生成時のオプション
+TAGGER_OPTION = " "
+
+
+class TaggerPool(object):
+    """
+    MeCab.Taggerをスレッドごとに1つだけ生成して使い回す
+
+    Taggerの生成は辞書のロードを伴うため重い。
+    スレタイ1件ごとに生成するとCPUの大半をTagger生成に使ってしまうので、
+    一度生成したTaggerを保持しておく。
+
+    MeCab.Taggerはスレッドセーフではないため、スレッドローカルに保持する。
+    fork後は親プロセスのTaggerを使わずに生成し直す。
+    """
+    _local = threading.local()
+
+    @classmethod
+    def get(cls, option=TAGGER_OPTION):
+        """
+        暖機済みのTaggerを取得
+        """
+        taggers = cls._get_taggers()
+        tagger = taggers.get(option)
+        if tagger is None:
+            tagger = MeCab.Tagger(option)
+            taggers[option] = tagger
+        return tagger
+
+    @classmethod
+    def get_lattice(cls):
+        """
+        使い回し用のLatticeを取得
+        set_sentenceの度に中身はクリアされる
+        """
+        cls._get_taggers()
+        lattice = getattr(cls._local, 'lattice', None)
+        if lattice is None:
+            lattice = MeCab.Lattice()
+            cls._local.lattice = lattice
+        return lattice
+
+    @classmethod
+    def clear(cls):
+        """
+        このスレッドで保持しているTagger, Latticeを破棄する
+        """
+        cls._local.taggers = None
+        cls._local.lattice = None
+        cls._local.pid = None
+
+    @classmethod
+    def _get_taggers(cls):
+        pid = os.getpid()
+        taggers = getattr(cls._local, 'taggers', None)
+        if taggers is None or getattr(cls._local, 'pid', None) != pid:
+            taggers = {}
+            cls._local.taggers = taggers
+            cls._local.lattice = None
+            cls._local.pid = pid
+        return taggers
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import heapq
+from array import array
+from itertools import izip
+
+
+class ReplyGraph(object):
+    """
+    書き込み間のレス(アンカー)関係を保持する
+
+    レスはレス元・レス先の番号を array('I') に追記していくだけで、
+    書き込み番号ごとの被レス数は counts で常に最新に保つ。
+    被レス元の一覧は参照されたときに CSR (offsets, sources) を作り直す。
+
+    graph.add(10, 3)          # >>3 へのレス
+    graph.reply_count(3)      # 被レス数
+    graph.replies_to(3)       # 被レス元の番号
+    graph.top(10)             # 被レス数の多い書き込み [(被レス数, 番号), ...]
+    """
+
+    def __init__(self):
+        # レス元, レス先
+        self._sources = array('I')
+        self._targets = array('I')
+
+        # 書き込み番号 → 被レス数
+        self.counts = array('I')
+
+        # CSR
+        self._offsets = None
+        self._csr_sources = None
+
+    def __len__(self):
+        return len(self._sources)
+
+    def add(self, source, target):
+        """
+        source から target へのレスを追加
+        """
+        self._sources.append(source)
+        self._targets.append(target)
+        if target >= len(self.counts):
+            self.counts.extend([0] * (target + 1 - len(self.counts)))
+        self.counts[target] += 1
+        self._offsets = None
+
+    def reply_count(self, number):
+        if number < len(self.counts):
+            return self.counts[number]
+        return 0
+
+    def replies_to(self, number):
+        """
+        number へレスした書き込み番号 (追加順)
+        """
+        if not self.reply_count(number):
+            return array('I')
+        self._build()
+        return self._csr_sources[self._offsets[number]:self._offsets[number + 1]]
+
+    def top(self, n, min_count=1):
+        """
+        被レス数の多い順に n 件 [(被レス数, 番号), ...]
+        """
+        counts = self.counts
+        return heapq.nlargest(
+            n,
+            ((count, number) for number, count in enumerate(counts) if count >= min_count),
+        )
+
+    def _build(self):
+        if self._offsets is not None:
+            return
+
+        size = len(self.counts)
+        offsets = array('I', [0]) * (size + 1)
+        for number in xrange(size):
+            offsets[number + 1] = offsets[number] + self.counts[number]
+
+        positions = array('I', offsets)
+        csr_sources = array('I', [0]) * len(self._sources)
+        for source, target in izip(self._sources, self._targets):
+            csr_sources[positions[target]] = source
+            positions[target] += 1
+
+        self._offsets = offsets
+        self._csr_sources = csr_sources
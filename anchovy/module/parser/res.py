@@ -1,56 +1,94 @@
 # -*- coding: utf-8 -*-
 
-import urllib
 import re
-from urlparse import urljoin
+from module.parser.reply_graph import ReplyGraph
+
+# アンカー >>12 >>10-12 >>1,3
+ANCHOR_PATTERN = re.compile(r'&gt;&gt;(\d{1,4}(?!\d)(?:[-,]\d{1,4}(?!\d))*)')
+
+# 1つの範囲アンカーで展開する最大数 これより広い範囲は無視する
+ANCHOR_RANGE_MAX = 20
+
+# 集計対象のレス先の番号
+REPLY_NUMBER_MIN = 2
+REPLY_NUMBER_MAX = 980
+
+
+def parse_anchors(message):
+    """
+    メッセージ中の全アンカーのレス先番号を出現順に返す (重複なし)
+    """
+    numbers = []
+    for m in ANCHOR_PATTERN.finditer(message):
+        for part in m.group(1).split(','):
+            start, _sep, end = part.partition('-')
+            start = int(start)
+            end = int(end) if end else start
+            if end < start or end - start >= ANCHOR_RANGE_MAX:
+                continue
+            for number in xrange(start, end + 1):
+                if number not in numbers:
+                    numbers.append(number)
+    return numbers
 
 
 class Res(object):
     """
     既にその名前は使われています<>sage<>2013/06/29(土) 00:00:48.67 ID:uTg9hb2u<> 90000→10102コンボきたー <>
     """
+    __slots__ = ('number', 'dat_url', 'post_name', 'post_mail', 'post_id', 'message', 'replies', 'graph')
 
     def __init__(self, l, number, dat_url):
         # 投稿番号
         self.number = number
 
-        # この投稿に対するレス番号
-        self.ask = []
-
         self.dat_url = dat_url
 
-        # データの格納
-        split_result = re.split('<>', l)
-        if len(split_result) != 5:
-            self.post_name = None
-            self.post_mail = None
-            self.post_id = None
-            self.message = None
+        # この投稿に対するレスは graph で管理する
+        self.graph = None
 
+        # データの格納
+        split_result = l.split(u'<>')
         self.post_name = split_result[0]
         self.post_mail = split_result[1]
         self.post_id = split_result[2]
         self.message = split_result[3]
-        self.reply = self._get_reply()
-
-    def _get_reply(self):
-        if self.message:
-            m = re.search(r'>&gt;&gt;\d{1,3}', self.message)
-            if m:
-                reply = m.group(0)
-                reply = re.sub(r'>&gt;&gt;', '', reply)
-                try:
-                    return int(reply)
-                except ValueError:
-                    return None
+
+        # レス先の番号
+        self.replies = tuple(parse_anchors(self.message)) if self.message else ()
+
+    def __getstate__(self):
+        # graph は ItaParser が復元する
+        return dict((name, getattr(self, name)) for name in self.__slots__ if name != 'graph')
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.graph = None
+
+    @property
+    def reply(self):
+        """
+        最初のレス先の番号
+        """
+        if self.replies:
+            return self.replies[0]
         return None
 
-    def add_ask(self, number):
-        self.ask.append(number)
+    @property
+    def ask(self):
+        """
+        この投稿に対するレス番号
+        """
+        if self.graph is None:
+            return []
+        return [int(number) for number in self.graph.replies_to(self.number)]
 
     @property
     def ask_count(self):
-        return len(self.ask)
+        if self.graph is None:
+            return 0
+        return self.graph.reply_count(self.number)
 
     def show(self):
         print self.number
@@ -60,25 +98,83 @@ class Res(object):
         print self.ask_count
 
 
+class ParseDelta(object):
+    """
+    ItaParser.append で変化した書き込み
+    """
+    def __init__(self):
+        # 追加された書き込み番号
+        self.added = []
+
+        # 新しくレスが付いた既存の書き込み番号
+        self.replied = set()
+
+    @property
+    def changed(self):
+        """
+        追加またはレスが付いた書き込み番号 (番号順)
+        """
+        return sorted(set(self.added) | self.replied)
+
+
 class ItaParser(object):
-    def __init__(self, dat_download):
-        count = 1
+    """
+    .dat をパースして書き込みとレスの関係を保持する
+
+    append() で新しく取得した行だけを追加できる
+    parser = ItaParser(dat_url=url)
+    delta = parser.append(lines)
+    """
+    def __init__(self, dat_download=None, dat_url=None):
+        self.dat_url = dat_download.url if dat_download else dat_url
         self.res_dict = {}
+        self.graph = ReplyGraph()
+
+        # 次に追加する書き込みの番号
+        self.next_number = 1
+
+        if dat_download:
+            self.append(dat_download.lines)
+
+    def __getstate__(self):
+        return {
+            'dat_url': self.dat_url,
+            'res_dict': self.res_dict,
+            'graph': self.graph,
+            'next_number': self.next_number,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for r in self.res_dict.itervalues():
+            r.graph = self.graph
+
+    def append(self, lines, start_number=None):
+        """
+        lines を start_number 番からの書き込みとして追加し、ParseDelta を返す
+        start_number を省略した場合は続きの番号から
+        既に追加済みの番号の行は読み飛ばす
+        """
+        if start_number is None:
+            start_number = self.next_number
+        if start_number > self.next_number:
+            raise ValueError('missing res %d-%d' % (self.next_number, start_number - 1))
+
+        delta = ParseDelta()
+        count = start_number
+        for l in lines:
+            if count < self.next_number:
+                count += 1
+                continue
 
-        for l in dat_download.lines:
             try:
-                r = Res(l, count, dat_download.url)
+                r = Res(l, count, self.dat_url)
+                r.graph = self.graph
                 self.res_dict[r.number] = r
+                delta.added.append(r.number)
 
                 # 特定の書き込みにレスがあれば追加
-                self._add_ask(r)
-
-
-                # print r.number
-                # print r.post_name
-                # print r.post_mail
-                # print r.post_id
-                # print r.message
+                delta.replied.update(self._add_ask(r))
 
             except IndexError:
                 print "==========================================="
@@ -89,6 +185,8 @@ class ItaParser(object):
                 pass
             finally:
                 count += 1
+                self.next_number = max(self.next_number, count)
+        return delta
 
     def __iter__(self):
         return self
@@ -102,13 +200,18 @@ class ItaParser(object):
     def set(self, number, r):
         self.res_dict[number] = r
 
+    def top(self, n):
+        """
+        被レス数の多い書き込みを n 件返す
+        """
+        return [self.get(number) for _count, number in self.graph.top(n)]
+
     def _add_ask(self, r):
         """
         レスがあれば、対象の書き込みのaskを更新
+        更新した書き込み番号を返す
         """
-
-        if r and r.reply:
-            self._update_ask(r.reply, r.number)
+        return [reply for reply in r.replies if self._update_ask(reply, r.number)]
 
     def _update_ask(self, reply, number):
         """
@@ -116,8 +219,7 @@ class ItaParser(object):
         reply : 対象の書き込み番号
         number : レス元の書き込み番号
         """
-        if 2 <= reply <= 980:
-            r = self.get(reply)
-            if r:
-                r.add_ask(number)
-                self.set(reply, r)
+        if REPLY_NUMBER_MIN <= reply <= REPLY_NUMBER_MAX and reply < number and reply in self.res_dict:
+            self.graph.add(number, reply)
+            return True
+        return False
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from kvs.generic import KVS
+from module.download.models.download import StreamDownload
+from module.parser.res import ItaParser
+
+
+class ItaParserKVS(KVS):
+    """
+    ItaParser の状態 キーは dat_url
+    """
+    KVS_TYPE = 'OBJ'
+    KEY_NAME = 'ItaParser'
+    KEY_FORMAT = '%s'
+
+
+class ItaParserStore(object):
+    """
+    ItaParser の状態をKVSに保存する
+    ワーカーが再起動しても .dat を最初からパースし直さなくて済む
+
+    parser, delta = ItaParserStore.update(url)
+
+    パーサーの状態が消えていてダウンロードの状態だけ残っている場合は、
+    差分だけでは書き込み番号が分からないので全体を取得し直す。
+    """
+    @classmethod
+    def update(cls, dat_url, download=None):
+        """
+        差分ダウンロードした行をパーサーに追加して保存する
+        @return (ItaParser, ParseDelta) 変更が無ければ delta は None
+        """
+        if download is None:
+            download = StreamDownload(dat_url)
+        parser = cls.load(dat_url)
+        if parser is None:
+            download.reset()
+            parser = ItaParser(dat_url=dat_url)
+
+        lines = list(download.lines())
+        if download.not_modified:
+            return parser, None
+        if download.is_full:
+            parser = ItaParser(dat_url=dat_url)
+        try:
+            delta = parser.append(lines, start_number=download.start_number)
+        except ValueError:
+            # パーサーの状態が古い 次回は全体を取得し直す
+            download.reset()
+            cls.delete(dat_url)
+            raise
+        cls.save(parser)
+        return parser, delta
+
+    @classmethod
+    def load(cls, dat_url):
+        return ItaParserKVS(dat_url).get()
+
+    @classmethod
+    def save(cls, parser):
+        ItaParserKVS(parser.dat_url).set(parser)
+
+    @classmethod
+    def delete(cls, dat_url):
+        ItaParserKVS(dat_url).delete()
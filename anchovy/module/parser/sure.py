@@ -1,11 +1,37 @@
 # -*- coding: utf-8 -*-
 
-import urllib
-import re
+from array import array
 from urlparse import urljoin
 from module.mecab.ng_word import NGBase
 
 
+def parse_subject_line(l):
+    """
+    subject.txt の1行を (dat, title, post_count) に分解する
+
+    u'1362274743.dat<>【新生FF14】βテスター専用スレ　Part144 (259)'
+    ↓抽出
+
+    (u'1362274743', u'【新生FF14】βテスター専用スレ　Part144 ', 259)
+
+    区切りが無ければ IndexError
+    書き込み数が無ければ post_count は None
+    """
+    dat, sep, rest = l.partition(u'<>')
+    if not sep:
+        raise IndexError(l)
+
+    if dat.endswith(u'.dat'):
+        dat = dat[:-4]
+
+    # 末尾の (書き込み数) を取り出す
+    title, sep, count = rest.rpartition(u'(')
+    count = count.rstrip()
+    if sep and count.endswith(u')') and count[:-1].isdigit():
+        return dat, title, int(count[:-1])
+    return dat, rest, None
+
+
 class Sure(object):
     """
     subject ファイル
@@ -13,64 +39,77 @@ class Sure(object):
 
     dat ファイル
     http://news22.2ch.net/newsplus/dat/1185716060.dat
+
+    NGワードを含むタイトルは TypeError
     """
+    __slots__ = ('subject_url', 'dat', 'title', 'post_count')
 
     def __init__(self, l, subject_url):
         self.subject_url = subject_url
+        self.dat, self.title, self.post_count = parse_subject_line(l)
 
-        # データの格納
-        split_result = re.split('<>', l)
-        if len(split_result) != 2:
-            self.dat = None
-            self.title = None
-            self.post_count = None
-
-        self.dat = self.get_dat(split_result)
-        self.title = self.get_title(split_result)
-        self.post_count = self.get_post_count(split_result, self.title)
+        if NGBase.check(self.title):
+            raise TypeError
 
     @property
     def dat_url(self):
         _dat_path = 'dat/' + self.dat + '.dat'
         return urljoin(self.subject_url, _dat_path)
 
-    def get_dat(self, split_result):
-        """
-        u'1362274743.dat<>【新生FF14】βテスター専用スレ　Part144 (259)'
-        ↓抽出
 
-        1362274743
-        """
-        return re.sub(r'\.dat', '', split_result[0])
+class SubjectList(object):
+    """
+    subject.txt のパース結果を列ごとに保持する
 
-    def get_title(self, split_result):
+    Sureを1件ずつ生成しないので、件数が多くてもメモリを使わない
+    subject_list[i] で Sure を取得できる
+    """
+    def __init__(self, subject_url):
+        self.subject_url = subject_url
+        self.dats = []
+        self.titles = []
+        self.post_counts = array('i')
+
+    def __len__(self):
+        return len(self.dats)
+
+    def __getitem__(self, i):
+        sure = Sure.__new__(Sure)
+        sure.subject_url = self.subject_url
+        sure.dat = self.dats[i]
+        sure.title = self.titles[i]
+        sure.post_count = self.post_counts[i]
+        return sure
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def append(self, dat, title, post_count):
+        self.dats.append(dat)
+        self.titles.append(title)
+        self.post_counts.append(post_count)
+
+    def filter_post_count(self, min_post_count):
         """
-        u'1362274743.dat<>【新生FF14】βテスター専用スレ　Part144 (259)'
-        ↓抽出
-
-        【新生FF14】βテスター専用スレ　Part144
+        書き込み数が min_post_count より多いスレのindexのリスト
         """
-        title = re.sub(r'\(\d+\)', '', split_result[1])
-
-        if NGBase.check(title):
-            raise TypeError
-        return title
-
+        return [i for i, count in enumerate(self.post_counts) if count > min_post_count]
 
 
-    def get_post_count(self, split_result, title):
-        """
-        u'1362274743.dat<>【新生FF14】βテスター専用スレ　Part144 (259)'
-        ↓抽出
-
-        259
-        """
+def parse_subject(lines, subject_url):
+    """
+    subject.txt の行をまとめてパースして SubjectList を返す
+    パースできない行、NGワードを含む行、書き込み数の無い行は除外する
+    """
+    result = SubjectList(subject_url)
+    check = NGBase.check
+    for l in lines:
         try:
-            post_count = re.sub(title, '', split_result[1])
-            post_count = re.search(r'\d+', post_count).group(0)
-            post_count = int(post_count)
-        except:
-            return None
-
-        return post_count
-
+            dat, title, post_count = parse_subject_line(l)
+        except IndexError:
+            continue
+        if post_count is None or check(title):
+            continue
+        result.append(dat, title, post_count)
+    return result
@@ -0,0 +1,74 @@
+# -*- coding:utf-8 -*-
+
+"""
+
+method_cache のオーバーヘッド計測
+
+キャッシュにヒットしたときの1回あたりの時間(マイクロ秒)を表示する。
+共有キャッシュの通信時間を除くため、プロセス内の辞書をバックエンドにする。
+
+>>> from gtoolkit.cache.benchmark import method_cache_benchmark
+>>> method_cache_benchmark()
+
+"""
+
+import time
+
+from gtoolkit.cache.method_cache import method_cache, _generate_cache_key
+
+
+class _DictBackend(object):
+    def __init__(self):
+        self._data = {}
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def set(self, key, value, timeout=None):
+        self._data[key] = value
+
+    def add(self, key, value, timeout=None):
+        if key in self._data:
+            return False
+        self._data[key] = value
+        return True
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+
+_backend = _DictBackend()
+
+
+class _Model(object):
+    pk = 1
+
+
+class _Master(object):
+
+    @classmethod
+    def raw(cls, pk, name):
+        return pk
+
+    @classmethod
+    @method_cache(cache_backend=_backend)
+    def cached(cls, pk, name):
+        return pk
+
+
+def method_cache_benchmark(count=100000):
+    cases = (
+        ('raw call', lambda: _Master.raw(1, 'abc')),
+        ('legacy key (int, str)', lambda: _generate_cache_key(_Master, _Master.cached, False, (1, 'abc'), {})),
+        ('key builder (int, str)', lambda: _Master.cached._key_builder(_Master, (1, 'abc'), {})),
+        ('key builder (model)', lambda: _Master.cached._key_builder(_Master, (_Model(), u'abc'), {})),
+        ('cached hit (int, str)', lambda: _Master.cached(1, 'abc')),
+        ('cached hit (kwargs)', lambda: _Master.cached(pk=1, name='abc')),
+    )
+    for name, func in cases:
+        func()
+        start = time.time()
+        for _i in xrange(count):
+            func()
+        elapsed = time.time() - start
+        print '%-24s %8.3f us/call' % (name, elapsed * 1000000 / count)
@@ -0,0 +1,76 @@
+# -*- coding:utf-8 -*-
+
+"""
+
+プロセス内のキャッシュ (LRU + TTL)
+
+エントリ数の上限を超えると最も古く参照されたものから捨てる。
+値はコピーせずにそのまま返すので、取り出したオブジェクトを書き換えないこと。
+
+cache = LocalCache(max_size=1000, timeout=60)
+cache.set('key', value, version=3)
+cache.get('key', version=3)   # バージョンが違う・期限切れなら MISS を返す
+
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# get で値が無かったときに返す
+MISS = object()
+
+
+class LocalCache(object):
+    def __init__(self, max_size=1000, timeout=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._pid = os.getpid()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, version=None):
+        """
+        値を返す 無い・期限切れ・バージョン違いなら MISS
+        """
+        with self._lock:
+            self._check_pid()
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return MISS
+            entry_version, expires, value = entry
+            if entry_version != version or (expires is not None and expires < time.time()):
+                return MISS
+            # 最近使ったものを末尾へ
+            self._data[key] = entry
+            return value
+
+    def set(self, key, value, version=None, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        expires = time.time() + timeout if timeout else None
+        with self._lock:
+            self._check_pid()
+            self._data.pop(key, None)
+            self._data[key] = (version, expires, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _check_pid(self):
+        # fork した子プロセスでは親の内容を引き継がない
+        pid = os.getpid()
+        if pid != self._pid:
+            self._data.clear()
+            self._pid = pid
@@ -14,12 +14,26 @@
 
 
 引数は, キャッシュキーに使用する引数の数.
-kwargs を使用する関数のメモ化は行えない.
+先頭から引数の数までの引数は, 位置引数で渡してもキーワード引数で渡しても同じキーになる.
+関数が **kwargs で受け取るキーワード引数もキーに含める.
 
 MemoizePerRequestMiddleware.process_request
 が実行される前に関数を実行された場合,
 キャッシュが利用せずにラップした関数を通常実行する.
 
+リクエスト以外 (管理コマンドなど) では memoize_scope() を使用する.
+キャッシュは settings.REQUEST_MEMOIZE_MAX_SIZE (既定値 10000) 件を超えると古いものから捨てる.
+
+.. code-block:: python
+
+    from gtoolkit.cache.memoize import memoize_scope
+
+    with memoize_scope():
+        ham(1)
+        ham(1) # キャッシュを使う
+
+関数ごとのヒット数は get_request_memoize_stats() で取得できる.
+
 クラスメソッドのメモ化に使用する場合は, 次の通り.
 
 .. code-block:: python
@@ -32,8 +46,12 @@ MemoizePerRequestMiddleware.process_request
 """
 from gtoolkit.cache.memoize.function import (
     request_memoize,
-    clear_cache as clear_request_memoize_cache,)
+    clear_cache as clear_request_memoize_cache,
+    get_stats as get_request_memoize_stats,
+    reset_stats as reset_request_memoize_stats,)
 
 from gtoolkit.cache.memoize.query import (
     MemoizedQuerySet,
     clear_cache as clear_request_memoize_cache_query,)
+
+from gtoolkit.cache.memoize.scope import memoize_scope
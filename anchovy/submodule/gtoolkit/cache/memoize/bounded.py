@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+メモ化用の上限付きキャッシュ
+上限を超えると最も古く参照されたものから捨てる
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+
+# get で値が無かったときに返す
+MISS = object()
+
+DEFAULT_MAX_SIZE = 10000
+
+
+def get_max_size():
+    return getattr(settings, 'REQUEST_MEMOIZE_MAX_SIZE', DEFAULT_MAX_SIZE)
+
+
+class BoundedCache(object):
+    def __init__(self, max_size=None):
+        self.max_size = max_size if max_size is not None else get_max_size()
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=MISS):
+        value = self._data.pop(key, MISS)
+        if value is MISS:
+            return default
+        # 最近使ったものを末尾へ
+        self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
@@ -7,45 +7,134 @@ try:
 except ImportError:
     from django.utils._threading_local import local
 
+from gtoolkit.cache.memoize.bounded import BoundedCache, MISS
+
 _thread_locals = local()
 _logger = logging.getLogger('memoize')
 
-def _generate_cache_key(func, args, num_args):
+# 引数を省略した場合のキー
+_NO_DEFAULT = '<no default>'
+
+
+class MemoizeStats(object):
+    """
+    関数ごとのヒット数
+    """
+    __slots__ = ('hits', 'misses', 'through')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.through = 0 # キャッシュが無く, そのまま実行した
+
+    def as_dict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'through': self.through,
+        }
+
+# '関数名' → MemoizeStats
+_stats = {}
+
+
+def get_stats():
+    """
+    関数ごとのヒット数を返す
+    """
+    return dict((name, stats.as_dict()) for name, stats in _stats.items())
+
+
+def reset_stats():
+    _stats.clear()
+
+
+class _KeyBuilder(object):
+    """
+    キャッシュのキーを作る
+    先頭 num_args 個の引数は, 位置引数でもキーワード引数でも省略しても同じキーになる.
+    関数が **kwargs で受け取るキーワード引数もキーに含める.
+    """
+    def __init__(self, func, num_args):
+        code = func.func_code
+        arg_names = code.co_varnames[:code.co_argcount]
+        defaults = func.func_defaults or ()
+        default_map = dict(zip(arg_names[len(arg_names) - len(defaults):], defaults))
+
+        self.name = func.__module__ + '.' + func.__name__
+        self.num_args = num_args
+        # (引数名, 省略時の値)
+        self._key_args = tuple((name, default_map.get(name, _NO_DEFAULT))
+                               for name in arg_names[:num_args])
+        self._arg_names = frozenset(arg_names)
+        self._key_arg_names = frozenset(arg_names[:num_args])
+
+    def __call__(self, args, kwargs):
+        keys = [repr(v) for v in args[:self.num_args]]
+        for name, default in self._key_args[len(keys):]:
+            keys.append(repr(kwargs.get(name, default)))
+        if kwargs:
+            for name in sorted(kwargs):
+                if name in self._key_arg_names:
+                    continue
+                if name not in self._arg_names:
+                    keys.append('%s=%r' % (name, kwargs[name]))
+        keys.insert(0, self.name)
+        return ':'.join(keys)
+
+
+def _generate_cache_key(func, args, num_args, kwargs=None):
     """
     キャッシュのキーを返す.
     """
-    keys = [repr(v) for v in args[:num_args]]
-    keys.insert(0, func.__module__ + '.' + func.__name__)
-    return ':'.join(keys)
+    return _KeyBuilder(func, num_args)(args, kwargs or {})
+
 
 def request_memoize(num_args):
     """
     リクエスト単位でメモ化するデコレータ
     """
-    logging.getLogger('ggacha')
-
     def deco(func):
+        key_builder = _KeyBuilder(func, num_args)
+        stats = _stats.setdefault(key_builder.name, MemoizeStats())
+
         @wraps(func)
-        def wrapper(*args):
+        def wrapper(*args, **kwargs):
             cache = getattr(_thread_locals, 'cache', None)
             if cache is None:
-                return func(*args)
+                stats.through += 1
+                return func(*args, **kwargs)
 
-            key = _generate_cache_key(func, args, num_args)
-            if key in cache:
+            key = key_builder(args, kwargs)
+            result = cache.get(key, MISS)
+            if result is not MISS:
+                stats.hits += 1
                 _logger.debug('HIT: %s', key)
-                return cache[key]
+                return result
 
+            stats.misses += 1
             _logger.debug('THROUGH: %s', key)
-            result = func(*args)
+            result = func(*args, **kwargs)
             cache[key] = result
             return result
+        wrapper.memoize_stats = stats
         return wrapper
     return deco
 
+
 def clear_cache():
     """
     キャッシュを初期化する
     """
     _logger.debug('clear cache')
-    _thread_locals.cache = {}
+    _thread_locals.cache = BoundedCache()
+
+
+def swap_cache(cache):
+    """
+    キャッシュを差し替えて, 元のキャッシュを返す
+    None を渡すとメモ化しなくなる
+    """
+    old = getattr(_thread_locals, 'cache', None)
+    _thread_locals.cache = cache
+    return old
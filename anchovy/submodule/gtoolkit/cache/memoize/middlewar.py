@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
-from gtoolkit.cache.memoize.function import clear_cache as f_clear
-from gtoolkit.cache.memoize.query import clear_cache as q_clear
+from gtoolkit.cache.memoize.function import clear_cache as f_clear, swap_cache as f_swap
+from gtoolkit.cache.memoize.query import clear_cache as q_clear, swap_cache as q_swap
 
 class MemoizePerRequestMiddleware(object):
     """
@@ -10,3 +10,9 @@ class MemoizePerRequestMiddleware(object):
     def process_request(self, request):
         f_clear()
         q_clear()
+
+    def process_response(self, request, response):
+        # 次のリクエストまでキャッシュを持ち越さない
+        f_swap(None)
+        q_swap(None)
+        return response
@@ -12,6 +12,8 @@ except ImportError:
 
 from django.db.models.query import QuerySet
 
+from gtoolkit.cache.memoize.bounded import BoundedCache, MISS
+
 _thread_locals = local()
 _logger = logging.getLogger('memoize_query')
 
@@ -61,8 +63,9 @@ class MemoizedQuerySetMixin(object):
 
         cache_key = self._cache_key(k)
 
-        result = cache.get(cache_key)
-        if result:
+        # 0 件の count() や空のリストもキャッシュする
+        result = cache.get(cache_key, MISS)
+        if result is not MISS:
             _logger.debug('HIT: %s %s', self.query, k)
             return result
 
@@ -99,4 +102,14 @@ def clear_cache():
     キャッシュを初期化する
     """
     _logger.debug('clear query cache')
-    _thread_locals.query_cache = {}
+    _thread_locals.query_cache = BoundedCache()
+
+
+def swap_cache(cache):
+    """
+    キャッシュを差し替えて, 元のキャッシュを返す
+    None を渡すとメモ化しなくなる
+    """
+    old = getattr(_thread_locals, 'query_cache', None)
+    _thread_locals.query_cache = cache
+    return old
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+リクエスト以外 (管理コマンド, バッチ) でメモ化する範囲を指定する
+
+.. code-block:: python
+
+    from gtoolkit.cache.memoize import memoize_scope
+
+    for player_id in player_ids:
+        with memoize_scope():
+            process(player_id)
+
+ブロックの中では関数と QuerySet をメモ化し, 抜けるとキャッシュを捨てて元の状態に戻す.
+入れ子にした場合は内側のブロックで新しいキャッシュを使う.
+"""
+from contextlib import contextmanager
+
+from gtoolkit.cache.memoize import function, query
+from gtoolkit.cache.memoize.bounded import BoundedCache
+
+
+@contextmanager
+def memoize_scope(max_size=None):
+    """
+    :param int max_size: キャッシュの最大数. 省略時は settings.REQUEST_MEMOIZE_MAX_SIZE
+    """
+    old_function_cache = function.swap_cache(BoundedCache(max_size))
+    old_query_cache = query.swap_cache(BoundedCache(max_size))
+    try:
+        yield
+    finally:
+        function.swap_cache(old_function_cache)
+        query.swap_cache(old_query_cache)
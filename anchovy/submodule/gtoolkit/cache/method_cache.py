@@ -8,28 +8,205 @@
 
 import hashlib
 import base64
+import threading
+import time
+import types
 from functools import wraps
 
+from django.conf import settings
 from django.core.cache import cache as django_cache
 from django.utils.encoding import smart_str
 
-def _execute(method, obj, args, kwargs, cache_timeout=None, cache_backend=None, ignore_request=None):
+from gtoolkit.cache import stampede
+from gtoolkit.cache.local_cache import LocalCache, MISS
+
+#
+# プロセス内キャッシュ (L1)
+#
+# local_cache=True を指定したメソッドは、共有キャッシュの前にプロセス内のキャッシュを見る。
+# クラスごとのバージョン番号を共有キャッシュに置き、delete_method_cache で番号を上げると
+# 全プロセスのそのクラスのL1が無効になる。
+# L1 はキャッシュした値をそのまま返すので、戻り値を書き換えないこと。
+#
+# 設定例
+# METHOD_CACHE_LOCAL_CACHE = True            # local_cache を省略したときの値
+# METHOD_CACHE_LOCAL_CACHE_SIZE = 1000       # L1 のエントリ数の上限
+# METHOD_CACHE_LOCAL_CACHE_TIMEOUT = 60      # L1 に保持する最大秒数
+# METHOD_CACHE_VERSION_CHECK_INTERVAL = 5    # バージョン番号を共有キャッシュに確認する間隔(秒) 0なら毎回
+# METHOD_CACHE_VERSION_TIMEOUT = 2592000     # バージョン番号の有効期限(秒)
+#
+# 他のプロセスで delete_method_cache した後も、最大 METHOD_CACHE_VERSION_CHECK_INTERVAL 秒は
+# そのプロセスのL1の古い値が返る。
+#
+
+VERSION_KEY_FORMAT = 'MCV/%s'
+
+DEFAULT_VERSION_CHECK_INTERVAL = 5
+
+# バージョン番号は消えないよう長めに保存する (memcached で相対指定できる最長の30日)
+DEFAULT_VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+# キャッシュキーの最大長
+KEY_LENGTH_LIMIT = 250
+
+_local_cache = None
+_local_cache_lock = threading.Lock()
+
+# クラス名 → (バージョン番号, 次に確認する時刻)
+_local_versions = {}
+
+
+class MethodCacheStats(object):
+    """
+    メソッドごとのヒット数
+    """
+    __slots__ = ('local_hits', 'hits', 'stale_hits', 'misses')
+
+    def __init__(self):
+        self.local_hits = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def as_dict(self):
+        return {
+            'local_hits': self.local_hits,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+        }
+
+# 'クラス名.メソッド名' → MethodCacheStats
+_stats = {}
+
+
+def get_method_cache_stats():
+    """
+    メソッドごとのヒット数を返す
+    {'クラス名.メソッド名': {'local_hits': L1ヒット, 'hits': 共有キャッシュヒット,
+                            'stale_hits': 期限切れの値を返した, 'misses': 実行}}
+    """
+    return dict((name, stats.as_dict()) for name, stats in _stats.items())
+
+
+def reset_method_cache_stats():
+    _stats.clear()
+
+
+def _get_stats(o_name, f_name):
+    name = o_name + '.' + f_name
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats.setdefault(name, MethodCacheStats())
+    return stats
+
+
+def _get_local_cache():
+    global _local_cache
+    if _local_cache is None:
+        with _local_cache_lock:
+            if _local_cache is None:
+                _local_cache = LocalCache(
+                    max_size=getattr(settings, 'METHOD_CACHE_LOCAL_CACHE_SIZE', 1000),
+                    timeout=getattr(settings, 'METHOD_CACHE_LOCAL_CACHE_TIMEOUT', 60))
+    return _local_cache
+
+
+def _get_version(o_name, cache_backend):
+    """
+    クラスのバージョン番号を返す
+    """
+    interval = _get_version_check_interval()
+    if interval:
+        cached = _local_versions.get(o_name)
+        if cached and cached[1] > time.time():
+            return cached[0]
+
+    key = VERSION_KEY_FORMAT % o_name
+    version = cache_backend.get(key)
+    if version is None:
+        # 番号が無い(消えた)場合も、以前の番号と重ならないよう時刻から始める
+        cache_backend.add(key, _new_version(), _get_version_timeout())
+        version = cache_backend.get(key)
+    if interval:
+        _local_versions[o_name] = (version, time.time() + interval)
+    return version
+
+
+def _bump_version(o_name, cache_backend):
+    """
+    クラスのバージョン番号を上げて、全プロセスのL1を無効にする
+    """
+    key = VERSION_KEY_FORMAT % o_name
+    try:
+        version = cache_backend.incr(key)
+    except ValueError:
+        # 番号が消えていた場合、他のプロセスが持っている番号と重ならないよう時刻から始める
+        version = _new_version()
+        cache_backend.set(key, version, _get_version_timeout())
+
+    interval = _get_version_check_interval()
+    if interval:
+        _local_versions[o_name] = (version, time.time() + interval)
+
+
+def _new_version():
+    return int(time.time() * 1000)
+
+
+def _get_version_check_interval():
+    return getattr(settings, 'METHOD_CACHE_VERSION_CHECK_INTERVAL', DEFAULT_VERSION_CHECK_INTERVAL)
+
+
+def _get_version_timeout():
+    return getattr(settings, 'METHOD_CACHE_VERSION_TIMEOUT', DEFAULT_VERSION_TIMEOUT)
+
+
+def _get_class_name(obj):
+    cls = obj if hasattr(obj, '__name__') else obj.__class__
+    return cls.__module__ + '.' + cls.__name__
+
+
+def _execute(method, obj, args, kwargs, cache_timeout=None, cache_backend=None, ignore_request=None,
+             local_cache=False, soft_timeout=None, lock=False, cache_none=False, key_builder=None):
     """
     メソッドを実行する
     実行結果がキャッシュされていれば、実行せずにそれを返す
     """
-    cache_key = _generate_cache_key(obj, method, ignore_request, args, kwargs)
+    if key_builder is None:
+        cache_key = _generate_cache_key(obj, method, ignore_request, args, kwargs)
+        o_name = _get_class_name(obj)
+        stats = _get_stats(o_name, method.func_name)
+    else:
+        o_name, prefix, stats = key_builder.get_class_info(obj)
+        cache_key = key_builder.build(prefix, args, kwargs)
     if cache_backend is None:
         cache_backend = django_cache
-    
-    result = cache_backend.get(cache_key, None)
-    if result is None:
+
+    if local_cache:
+        # バージョン番号は共有キャッシュを見る前に取る
+        # (見ている間に番号が上がっても、次回の確認で捨てられる)
+        version = _get_version(o_name, cache_backend)
+        result = _get_local_cache().get(cache_key, version)
+        if result is not MISS:
+            stats.local_hits += 1
+            return result
+
+    def compute():
         #メソッド実施!
-        result = method(obj, *args, **kwargs)
-        if cache_timeout is None:
-            cache_backend.set(cache_key, result)
-        else:
-            cache_backend.set(cache_key, result, cache_timeout)
+        return method(obj, *args, **kwargs)
+    result, status = stampede.get_or_compute(cache_backend, cache_key, compute,
+                                             timeout=cache_timeout, soft_timeout=soft_timeout,
+                                             lock=lock, cache_none=cache_none)
+    if status == stampede.HIT:
+        stats.hits += 1
+    elif status == stampede.STALE:
+        stats.stale_hits += 1
+    else:
+        stats.misses += 1
+
+    if local_cache:
+        _get_local_cache().set(cache_key, result, version)
     return result
 
 
@@ -45,10 +222,7 @@ def _generate_cache_key(obj, method, ignore_request=False, args=[], kwargs={}):
         (list) args: 引数リスト
         (dict) kw: キーワード引数のディクショナリ
     """
-    KEY_LENGTH_LIMIT = 250
-
-    cls = obj if hasattr(obj, '__name__') else obj.__class__
-    o_name = cls.__module__ + '.' + cls.__name__
+    o_name = _get_class_name(obj)
 
     if hasattr(method, '_original_method'):
         method = method._original_method
@@ -81,6 +255,68 @@ def _generate_cache_key(obj, method, ignore_request=False, args=[], kwargs={}):
         return approach_2[:KEY_LENGTH_LIMIT]
 
 
+class _KeyBuilder(object):
+    """
+    メソッドごとのキャッシュキー作成
+    引数名の取り出しなどはデコレート時に1度だけ行う
+    _generate_cache_key と同じキーを返す
+    """
+    def __init__(self, method, ignore_request=False):
+        if hasattr(method, '_original_method'):
+            method = method._original_method
+        self.f_name = method.func_name
+        self.ignore_request = bool(ignore_request)
+        arg_names = method.func_code.co_varnames[1:method.func_code.co_argcount]
+        # (引数の位置, 引数名, キーに付ける "'引数名':")
+        self._args = tuple((i, arg_name, repr(arg_name) + ":")
+                           for i, arg_name in enumerate(arg_names)
+                           if not (ignore_request and arg_name == 'request'))
+        # クラス → (クラス名, キーの前半, MethodCacheStats)
+        self._classes = {}
+
+    def __call__(self, obj, args, kwargs):
+        return self.build(self.get_class_info(obj)[1], args, kwargs)
+
+    def get_class_info(self, obj):
+        cls = obj if hasattr(obj, '__name__') else obj.__class__
+        info = self._classes.get(cls)
+        if info is None:
+            o_name = cls.__module__ + '.' + cls.__name__
+            info = (o_name, "MC/%s/%s/" % (o_name, self.f_name), _get_stats(o_name, self.f_name))
+            if isinstance(cls, (type, types.ClassType)):
+                self._classes[cls] = info
+        return info
+
+    def build(self, prefix, args, kwargs):
+        if not isinstance(args, (tuple, list,)):
+            args = [args,]
+        args_len = len(args)
+        parts = []
+        for i, arg_name, label in self._args:
+            if args_len > i:
+                arg_value = args[i]
+            elif arg_name in kwargs:
+                arg_value = kwargs[arg_name]
+            else:
+                arg_value = ''
+            # 主キーによく使う int, str は変換を省略
+            value_type = type(arg_value)
+            if value_type is int or value_type is long:
+                parts.append(label + str(arg_value))
+            elif value_type is str:
+                parts.append(label + arg_value)
+            else:
+                parts.append(label + _get_arg_value_unique_name(arg_value))
+        args_str = ','.join(parts)
+
+        key = (prefix + args_str).replace(' ', '')
+        if len(key) < KEY_LENGTH_LIMIT:
+            return key
+        # キーが長すぎたので一部ハッシュ化
+        hashed_key_part = base64.b64encode(hashlib.md5(args_str).digest())
+        return (prefix + '*' + hashed_key_part)[:KEY_LENGTH_LIMIT]
+
+
 def _get_arg_value_unique_name(arg_value):
     """
     arg_value を、他のと区別できるような文字列を作る
@@ -103,6 +339,14 @@ def method_cache(*args, **kwargs):
     
     デコレータの一番下に書くこと推奨。(そうしないと対象メソッドの引数名が正しくとれない。多分。)
 
+    @method_cache(local_cache=True) とすると、共有キャッシュの前にプロセス内のキャッシュを使う。
+    (更新がほとんど無いマスターデータ向け 戻り値を書き換えないこと)
+
+    キャッシュ切れ時の同時再計算対策 (gtoolkit.cache.stampede 参照)
+    @method_cache(lock=True)                           再計算は1プロセスだけ
+    @method_cache(cache_timeout=600, soft_timeout=60)  60秒を過ぎたら古い値を返しつつ1プロセスが再計算
+    @method_cache(cache_none=True)                     None の結果もキャッシュする
+
     Django Model 使用時, QuerySet を戻り値とすると,
     QuerySet をキャッシュするため, キャッシュから取り出した QuerySet が
     SQL Query を発行してしまい, キャッシュする意味がない.
@@ -129,30 +373,42 @@ def method_cache(*args, **kwargs):
     cache_timeout = kwargs.pop('cache_timeout', None)
     cache_backend = kwargs.pop('cache_backend', None)
     ignore_request = kwargs.pop('ignore_request', None)
-    assert not kwargs, "Keyword argument accepted is cache_backend or cache_timeout"
-    if any((cache_timeout, cache_backend, ignore_request)):
-        params = {}
-        if cache_timeout is not None:
-            params['cache_timeout'] = cache_timeout
-        if cache_backend is not None:
-            params['cache_backend'] = cache_backend
-        if ignore_request is not None:
-            params['ignore_request'] = ignore_request
-        def _internal_params(method):
-            @wraps(method)
-            def decorate(obj, *args, **kwargs):
-                return _execute(method, obj, args, kwargs, **params)
-            decorate._original_method = method #デコレートされててもメソッド引数が参照できるように
-            return decorate
-        return _internal_params
-    else:
-        method = args[0]
+    local_cache = kwargs.pop('local_cache', None)
+    soft_timeout = kwargs.pop('soft_timeout', None)
+    lock = kwargs.pop('lock', None)
+    cache_none = kwargs.pop('cache_none', None)
+    assert not kwargs, "Keyword argument accepted is cache_backend, cache_timeout, ignore_request, local_cache, soft_timeout, lock or cache_none"
+    params = {}
+    if cache_timeout is not None:
+        params['cache_timeout'] = cache_timeout
+    if cache_backend is not None:
+        params['cache_backend'] = cache_backend
+    if ignore_request is not None:
+        params['ignore_request'] = ignore_request
+    if local_cache is None:
+        local_cache = getattr(settings, 'METHOD_CACHE_LOCAL_CACHE', False)
+    if local_cache:
+        params['local_cache'] = True
+    if soft_timeout:
+        params['soft_timeout'] = soft_timeout
+    if stampede.use_lock(lock):
+        params['lock'] = True
+    if cache_none:
+        params['cache_none'] = True
+
+    def _internal_params(method):
+        key_builder = _KeyBuilder(method, ignore_request)
         @wraps(method)
         def decorate(obj, *args, **kwargs):
-            return _execute(method, obj, args, kwargs)
+            return _execute(method, obj, args, kwargs, key_builder=key_builder, **params)
         decorate._original_method = method #デコレートされててもメソッド引数が参照できるように
+        decorate._key_builder = key_builder
         return decorate
 
+    if len(args) == 1 and callable(args[0]):
+        return _internal_params(args[0])
+    return _internal_params
+
 
 
 def delete_method_cache(obj, method, args=[], kwargs={}, cache_backend=None, ignore_request=False):
@@ -161,12 +417,20 @@ def delete_method_cache(obj, method, args=[], kwargs={}, cache_backend=None, ign
     各モデルの save() なんかに仕込む。
     パラメータは、名前なし引数でも名前付き引数でもらっても大丈夫
     """
-    cache_key = _generate_cache_key(obj, method, ignore_request, args=args, kwargs=kwargs)
+    key_builder = getattr(method, '_key_builder', None)
+    if key_builder is not None and key_builder.ignore_request == bool(ignore_request):
+        cache_key = key_builder(obj, args, kwargs)
+    else:
+        cache_key = _generate_cache_key(obj, method, ignore_request, args=args, kwargs=kwargs)
     if cache_backend is None:
         cache_backend = django_cache
     cache_backend.set(cache_key, None)
     cache_backend.delete(cache_key)
 
+    # 共有キャッシュを消してからバージョンを上げる
+    _get_local_cache().delete(cache_key)
+    _bump_version(_get_class_name(obj), cache_backend)
+
 
 # 
 # サンプル
@@ -7,6 +7,7 @@ class CachedMasterModel(models.Model):
     """
     キャッシュ機能を持つ Model
     更新が少ないマスターデータの管理に使用する
+    settings.METHOD_CACHE_LOCAL_CACHE = True で get, get_all がプロセス内キャッシュも使う
     """
     class Meta:
         abstract = True
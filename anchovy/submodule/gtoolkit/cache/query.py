@@ -95,8 +95,44 @@ manage_cache() を使用する.
         print sandwiches.get(id=1)
 
 
+キャッシュ切れ時に同じ SQL Query が一斉に発行されないように,
+manage_cache() には次の指定ができる. (gtoolkit.cache.stampede 参照)
+
+.. code-block:: python
+
+    # 再計算は1プロセスだけが行い, 他は結果を待つ
+    Egg.objects.filter(spam=1).manage_cache('sand', lock=True)
+
+    # 60秒を過ぎたら古い結果を返しつつ, 1プロセスが再計算する
+    Egg.objects.filter(spam=1).manage_cache('sand', soft_timeout=60)
+
+0 件の count() や空のリストなどの結果もキャッシュされる.
+
 キャッシュされた値は, delete_cache() で削除できる.
 
+--------------
+世代による削除
+--------------
+
+settings.CACHED_QUERYSET_INVALIDATION = 'generation' とすると,
+キャッシュ管理キーにはキーの一覧の代わりに世代番号(整数)を保存し,
+キャッシュのキーに世代番号を含める.
+delete_cache() は世代番号を上げるだけなので, 紐づくキャッシュの数によらず1回の通信で済み,
+保存時の gets/cas も行わない. (古い世代のキャッシュは期限切れで消える)
+
+世代による削除は add/incr しか使わないので, Memcached 以外のキャッシュでも使える.
+settings.CACHED_QUERYSET_BACKEND = 'redis' とすると Redis に保存する.
+(gtoolkit.cache.redis_backend 参照 この場合は常に世代による削除になる)
+
+.. code-block:: python
+
+    CACHED_QUERYSET_INVALIDATION = 'generation'  # keys(従来) / generation
+    CACHED_QUERYSET_BACKEND = 'redis'            # 省略時は Django の cache
+    CACHED_QUERYSET_TIMEOUT = 3600               # 有効期限(秒) 省略時はバックエンドの既定値
+    CACHED_QUERYSET_GENERATION_TIMEOUT = 2592000 # 世代番号の有効期限(秒) 省略時は30日
+
+manage_cache() の generation 引数で QuerySet ごとに指定することもできる.
+
 .. code-block:: python
 
     def create_or_update_or_delete_egg():
@@ -121,43 +157,129 @@ CachedQuerySet の delete() と update() は,
         Egg.objects.filter(spam=1).manage_cache('sand').delete()
 """
 import logging
+import threading
+import time
 from hashlib import sha256
 
+from django.conf import settings
 from django.core.cache import cache
 from django.db.models.query import QuerySet
 
+from gtoolkit.cache import stampede
+
 _logger = logging.getLogger('cached_query')
 
+INVALIDATION_KEYS = 'keys'
+INVALIDATION_GENERATION = 'generation'
+
+# 世代番号はキャッシュより長く残す (memcached で相対指定できる最長の30日)
+DEFAULT_GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+_redis_backend = None
+_redis_backend_lock = threading.Lock()
+
+
+def _use_redis_backend():
+    return getattr(settings, 'CACHED_QUERYSET_BACKEND', None) == 'redis'
+
+
+def _get_cache_backend():
+    """
+    キャッシュの保存先
+    """
+    global _redis_backend
+    if not _use_redis_backend():
+        return cache
+    if _redis_backend is None:
+        with _redis_backend_lock:
+            if _redis_backend is None:
+                from gtoolkit.cache.redis_backend import RedisCacheBackend
+                _redis_backend = RedisCacheBackend(
+                    getattr(settings, 'CACHED_QUERYSET_REDIS_NAME', 'default'),
+                    getattr(settings, 'CACHED_QUERYSET_TIMEOUT', None))
+    return _redis_backend
+
+def _get_generation_timeout():
+    return getattr(settings, 'CACHED_QUERYSET_GENERATION_TIMEOUT', DEFAULT_GENERATION_TIMEOUT)
+
+
 class _ManageCacheMixin(object):
     _manage_cache_key = None
     _try_cas_count = 100
+    _cache_soft_timeout = None
+    _cache_lock = False
+    _cache_generation = False
 
-    def manage_cache(self, key=''):
+    def manage_cache(self, key='', soft_timeout=None, lock=None, generation=None):
         """
         キャッシュ管理を開始する.
 
         :param str key: キャッシュ管理キー. delete_cache の引数にも使用する.
+        :param int soft_timeout: この秒数を過ぎた結果は, 再計算中に古い結果を返す.
+        :param bool lock: 再計算を1プロセスに限定する. 省略時は settings.CACHE_STAMPEDE_LOCK
+        :param bool generation: 世代による削除を行う. 省略時は settings.CACHED_QUERYSET_INVALIDATION
         """
-        for attr in ['add', 'gets', 'cas']:
-            if not hasattr(cache._cache, attr):
-                return self
-
+        if generation is None:
+            generation = _use_redis_backend() or \
+                getattr(settings, 'CACHED_QUERYSET_INVALIDATION', INVALIDATION_KEYS) == INVALIDATION_GENERATION
+
+        if not generation:
+            for attr in ['add', 'gets', 'cas']:
+                if not hasattr(cache._cache, attr):
+                    return self
+
+        self._cache_soft_timeout = soft_timeout
+        self._cache_lock = stampede.use_lock(lock)
+        self._cache_generation = generation
         self._manage_cache_key = self._make_manage_cache_key(key)
-        cache._cache.add(self._manage_cache_key, [])
+        if not generation:
+            cache._cache.add(self._manage_cache_key, [])
 
         return self
 
     def _make_manage_cache_key(self, key):
-        return "CachedQuerySet:{}.{}:{}".format(self.model.__module__,
-                                                self.model.__name__,
-                                                key)
+        # 世代番号はキーの一覧とは別のキーに保存する
+        prefix = "CachedQuerySetGen" if self._cache_generation else "CachedQuerySet"
+        return "{}:{}.{}:{}".format(prefix,
+                                    self.model.__module__,
+                                    self.model.__name__,
+                                    key)
+
+    def _copy_manage_cache(self, clone):
+        clone._manage_cache_key = self._manage_cache_key
+        clone._cache_soft_timeout = self._cache_soft_timeout
+        clone._cache_lock = self._cache_lock
+        clone._cache_generation = self._cache_generation
+        return clone
 
     @property
     def _can_manage_cache(self):
         return self._manage_cache_key is not None
 
+    @property
+    def _cache_backend(self):
+        if self._cache_generation:
+            return _get_cache_backend()
+        return cache
+
+    def _get_generation(self):
+        backend = self._cache_backend
+        generation = backend.get(self._manage_cache_key)
+        if generation is None:
+            # 消えていた場合は, 以前の世代と重ならないよう時刻から始める
+            backend.add(self._manage_cache_key, int(time.time() * 1000), _get_generation_timeout())
+            generation = backend.get(self._manage_cache_key)
+        return generation
+
+    def _next_generation(self):
+        backend = self._cache_backend
+        try:
+            backend.incr(self._manage_cache_key)
+        except ValueError:
+            backend.set(self._manage_cache_key, int(time.time() * 1000), _get_generation_timeout())
+
     def _store_cache_key(self, cache_key):
-        if not self._can_manage_cache:
+        if not self._can_manage_cache or self._cache_generation:
             return True
 
         for n in xrange(self._try_cas_count):
@@ -182,6 +304,15 @@ class _ManageCacheMixin(object):
         return []
 
 
+class _NotStored(Exception):
+    """
+    キャッシュ管理キーに登録できなかったので結果を保存しない
+    """
+    def __init__(self, result):
+        Exception.__init__(self)
+        self.result = result
+
+
 class CachedQuerySet(_ManageCacheMixin, QuerySet):
     def __getitem__(self, k):
         def f():
@@ -215,8 +346,7 @@ class CachedQuerySet(_ManageCacheMixin, QuerySet):
 
     def filter(self, *args, **kwargs):
         clone = super(CachedQuerySet, self).filter(*args, **kwargs)
-        clone._manage_cache_key = self._manage_cache_key
-        return clone
+        return self._copy_manage_cache(clone)
 
     def _eval_on_cached(self, k, f):
         if not self._can_manage_cache:
@@ -229,31 +359,45 @@ class CachedQuerySet(_ManageCacheMixin, QuerySet):
 
         cache_key = self._cache_key(k)
 
-        result = cache.get(cache_key)
-        if result:
-            _logger.debug('HIT(%s): %s %s',
-                          self._manage_cache_key, self.query, k)
-            return result
+        def compute():
+            if not self._store_cache_key(cache_key):
+                _logger.debug('CAS ERROR(%s): %s %s',
+                              self._manage_cache_key, self.query, k)
+                raise _NotStored(f())
 
-        if not self._store_cache_key(cache_key):
-            _logger.debug('CAS ERROR(%s): %s %s',
+            _logger.debug('THROUGH(%s): %s %s',
                           self._manage_cache_key, self.query, k)
             return f()
 
-        _logger.debug('THROUGH(%s): %s %s',
-                      self._manage_cache_key, self.query, k)
-        result = f()
-        cache.set(cache_key, result)
+        try:
+            result, status = stampede.get_or_compute(self._cache_backend, cache_key, compute,
+                                                     timeout=getattr(settings, 'CACHED_QUERYSET_TIMEOUT', None),
+                                                     soft_timeout=self._cache_soft_timeout,
+                                                     lock=self._cache_lock, cache_none=True)
+        except _NotStored, e:
+            return e.result
+
+        if status != stampede.MISS:
+            _logger.debug('%s(%s): %s %s', status.upper(),
+                          self._manage_cache_key, self.query, k)
         return result
 
     def _cache_key(self, k):
-        return sha256(str(self.query) + str(k)).hexdigest()
+        # 結果は CacheEntry に包んで保存するので、包まずに保存していた頃のキーとは分ける
+        cache_key = sha256(str(self.query) + str(k)).hexdigest() + ':e'
+        if self._cache_generation:
+            cache_key += ':%d' % self._get_generation()
+        return cache_key
 
     def delete_cache(self):
         if not self._can_manage_cache:
             return
 
         _logger.debug('DELETE(%s)', self._manage_cache_key)
+        if self._cache_generation:
+            self._next_generation()
+            return
+
         for cache_key in self._cache_keys_for_delete():
             cache.delete(cache_key)
 
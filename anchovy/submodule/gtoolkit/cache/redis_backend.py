@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+CachedQuerySet 用の Redis バックエンド.
+
+Django の cache と同じ get/set/add/delete/incr を持つ.
+値は pickle して保存するが, incr できるように整数はそのまま保存する.
+
+.. code-block:: python
+
+    CACHED_QUERYSET_BACKEND = 'redis'
+    CACHED_QUERYSET_REDIS_NAME = 'default'  # settings.REDIS_DATABASES のキー名
+    CACHED_QUERYSET_TIMEOUT = 3600          # 有効期限(秒)
+"""
+import cPickle as pickle
+import re
+
+import redis
+from gredis import get_pool
+
+_int_pattern = re.compile(r'^-?\d+$')
+
+_INCR_IF_EXISTS = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrby', KEYS[1], ARGV[1])
+end
+return false
+"""
+
+
+class RedisCacheBackend(object):
+    def __init__(self, name='default', default_timeout=None, client=None):
+        if client is None:
+            client = redis.StrictRedis(connection_pool=get_pool(name))
+        self._client = client
+        self.default_timeout = default_timeout
+
+    def get(self, key, default=None):
+        value = self._client.get(key)
+        if value is None:
+            return default
+        if _int_pattern.match(value):
+            return int(value)
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=None):
+        self._client.set(key, self._dumps(value), ex=self._timeout(timeout))
+
+    def add(self, key, value, timeout=None):
+        return bool(self._client.set(key, self._dumps(value), ex=self._timeout(timeout), nx=True))
+
+    def delete(self, key):
+        self._client.delete(key)
+
+    def incr(self, key, delta=1):
+        # Django の cache と同じく, キーが無ければ ValueError
+        value = self._client.eval(_INCR_IF_EXISTS, 1, key, delta)
+        if value is None:
+            raise ValueError("Key '%s' not found" % key)
+        return value
+
+    def _timeout(self, timeout):
+        timeout = timeout if timeout is not None else self.default_timeout
+        return int(timeout) if timeout else None
+
+    def _dumps(self, value):
+        if isinstance(value, (int, long)) and not isinstance(value, bool):
+            return str(value)
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,133 @@
+# -*- coding:utf-8 -*-
+
+"""
+
+キャッシュ切れ時の同時再計算(スタンピード)対策
+
+lock=True
+    キャッシュが無いとき、cache.add で取ったロックを持つ1プロセスだけが再計算する。
+    他のプロセスは値が入るかロックが外れるまで待ち、待ちきれなければ自分で計算する。
+
+soft_timeout=秒
+    値と一緒に期限を保存し、期限を過ぎた値は1プロセスが再計算している間そのまま返す。
+    (stale-while-revalidate) キャッシュ自体の期限 (timeout) は soft_timeout より長くすること。
+
+cache_none=True
+    None の結果もキャッシュする。
+
+soft_timeout か cache_none を指定した場合は CacheEntry に包んで保存する。
+包んでいない値もそのまま読めるので、途中から指定しても既存のキャッシュは使える。
+
+設定例
+CACHE_STAMPEDE_LOCK = True          # lock を省略したときの値
+CACHE_STAMPEDE_LOCK_TIMEOUT = 10    # ロックの期限(秒) 再計算にかかる時間より長くする
+CACHE_STAMPEDE_LOCK_WAIT = 3        # ロックが取れなかったときに待つ最大秒数
+
+"""
+
+import time
+
+from django.conf import settings
+
+LOCK_KEY_SUFFIX = '/lock'
+
+# ロック待ちの確認間隔(秒)
+LOCK_POLL_INTERVAL = 0.05
+
+# get_or_compute が返す状態
+HIT = 'hit'
+STALE = 'stale'
+MISS = 'miss'
+
+
+class CacheEntry(object):
+    """
+    キャッシュに保存する値
+    soft_expires を過ぎたら再計算する (None なら期限無し)
+    """
+    def __init__(self, value, soft_expires=None):
+        self.value = value
+        self.soft_expires = soft_expires
+
+
+def use_lock(lock=None):
+    if lock is None:
+        return getattr(settings, 'CACHE_STAMPEDE_LOCK', False)
+    return lock
+
+
+def get_or_compute(backend, cache_key, compute, timeout=None, soft_timeout=None,
+                   lock=False, cache_none=False):
+    """
+    キャッシュの値を返す 無ければ compute() の結果を保存して返す
+    (値, HIT|STALE|MISS) を返す
+    """
+    raw = backend.get(cache_key)
+    if isinstance(raw, CacheEntry):
+        if raw.soft_expires is None or raw.soft_expires > time.time():
+            return raw.value, HIT
+        # 期限切れ ロックが取れたプロセスだけ再計算し、他は古い値を返す
+        if not _acquire(backend, cache_key):
+            return raw.value, STALE
+        try:
+            return _compute_and_store(backend, cache_key, compute, timeout, soft_timeout, cache_none), MISS
+        finally:
+            _release(backend, cache_key)
+    if raw is not None:
+        return raw, HIT
+
+    if not lock:
+        return _compute_and_store(backend, cache_key, compute, timeout, soft_timeout, cache_none), MISS
+
+    if _acquire(backend, cache_key):
+        try:
+            return _compute_and_store(backend, cache_key, compute, timeout, soft_timeout, cache_none), MISS
+        finally:
+            _release(backend, cache_key)
+
+    # 他のプロセスが計算中
+    raw = _wait(backend, cache_key)
+    if isinstance(raw, CacheEntry):
+        return raw.value, HIT
+    if raw is not None:
+        return raw, HIT
+    return _compute_and_store(backend, cache_key, compute, timeout, soft_timeout, cache_none), MISS
+
+
+def _compute_and_store(backend, cache_key, compute, timeout, soft_timeout, cache_none):
+    result = compute()
+    if soft_timeout or cache_none:
+        soft_expires = time.time() + soft_timeout if soft_timeout else None
+        value = CacheEntry(result, soft_expires)
+    else:
+        value = result
+    if timeout is None:
+        backend.set(cache_key, value)
+    else:
+        backend.set(cache_key, value, timeout)
+    return result
+
+
+def _acquire(backend, cache_key):
+    lock_timeout = getattr(settings, 'CACHE_STAMPEDE_LOCK_TIMEOUT', 10)
+    return backend.add(cache_key + LOCK_KEY_SUFFIX, 1, lock_timeout)
+
+
+def _release(backend, cache_key):
+    backend.delete(cache_key + LOCK_KEY_SUFFIX)
+
+
+def _wait(backend, cache_key):
+    """
+    値が入るか、ロックが外れるまで待つ
+    """
+    lock_key = cache_key + LOCK_KEY_SUFFIX
+    deadline = time.time() + getattr(settings, 'CACHE_STAMPEDE_LOCK_WAIT', 3)
+    while time.time() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        raw = backend.get(cache_key)
+        if raw is not None:
+            return raw
+        if backend.get(lock_key) is None:
+            break
+    return None
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import redis
+from django.core.cache import cache
+
+from gtoolkit.cache.query import CachedQuerySet
+from gtoolkit.tests.redis_tools import is_redis_running
+
+_can_import_backend = False
+try:
+    from gtoolkit.cache.redis_backend import RedisCacheBackend
+    _can_import_backend = True
+except ImportError, e:
+    pass
+
+
+class Egg(object):
+    pass
+
+
+class _Query(object):
+    select_for_update = False
+
+    def __str__(self):
+        return 'SELECT * FROM egg'
+
+
+def _make_queryset():
+    qs = CachedQuerySet.__new__(CachedQuerySet)
+    qs.model = Egg
+    qs.query = _Query()
+    return qs.manage_cache('test', generation=True)
+
+
+class TestGeneration(unittest.TestCase):
+
+    def setUp(self):
+        self.qs = _make_queryset()
+        cache.delete(self.qs._manage_cache_key)
+        self.calls = []
+
+    def _eval(self):
+        def f():
+            self.calls.append(1)
+            return len(self.calls)
+        return self.qs._eval_on_cached('iter', f)
+
+    def test_first_generation(self):
+        generation = self.qs._get_generation()
+        self.assertEqual(cache.get(self.qs._manage_cache_key), generation)
+        self.assertEqual(self.qs._get_generation(), generation)
+
+    def test_delete_cache(self):
+        self.assertEqual(self._eval(), 1)
+        self.assertEqual(self._eval(), 1)
+
+        generation = self.qs._get_generation()
+        _make_queryset().delete_cache()
+        self.assertEqual(self.qs._get_generation(), generation + 1)
+        self.assertEqual(self._eval(), 2)
+        self.assertEqual(len(self.calls), 2)
+
+
+@unittest.skipUnless(_can_import_backend, 'gredis can not import.')
+@unittest.skipUnless(is_redis_running(), 'Redis Server is not running on localhost')
+class TestRedisCacheBackend(unittest.TestCase):
+    KEY = 'test_cached_query.backend'
+
+    def setUp(self):
+        self.backend = RedisCacheBackend(client=redis.StrictRedis())
+        self.backend.delete(self.KEY)
+
+    def tearDown(self):
+        self.backend.delete(self.KEY)
+
+    def test_int(self):
+        self.backend.set(self.KEY, 10)
+        self.assertEqual(self.backend.get(self.KEY), 10)
+        self.assertEqual(self.backend.incr(self.KEY), 11)
+
+    def test_pickle(self):
+        value = {'spam': [1, u'ham']}
+        self.backend.set(self.KEY, value)
+        self.assertEqual(self.backend.get(self.KEY), value)
+        self.assertFalse(self.backend.add(self.KEY, 1))
+
+    def test_incr_missing(self):
+        self.assertRaises(ValueError, self.backend.incr, self.KEY)
+        self.assertTrue(self.backend.get(self.KEY) is None)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from gtoolkit.cache.memoize import (request_memoize, memoize_scope,
+                                    get_request_memoize_stats)
+from gtoolkit.cache.memoize.bounded import BoundedCache, MISS
+
+calls = []
+
+@request_memoize(2)
+def spam(egg, ham=1, **kwargs):
+    calls.append((egg, ham, kwargs))
+    return []
+
+
+class TestRequestMemoize(unittest.TestCase):
+
+    def setUp(self):
+        del calls[:]
+
+    def test_no_scope(self):
+        spam(1)
+        spam(1)
+        self.assertEqual(len(calls), 2)
+
+    def test_kwargs(self):
+        with memoize_scope():
+            spam(1)
+            spam(1, 1)
+            spam(egg=1, ham=1)
+            self.assertEqual(len(calls), 1)
+
+            spam(1, 2)
+            spam(1, extra=3)
+            spam(1, extra=3)
+            self.assertEqual(len(calls), 3)
+
+    def test_falsy_result(self):
+        with memoize_scope():
+            self.assertEqual(spam(5), [])
+            self.assertEqual(spam(5), [])
+        self.assertEqual(len(calls), 1)
+
+        stats = get_request_memoize_stats()['%s.spam' % __name__]
+        self.assertTrue(stats['hits'] >= 1)
+
+    def test_nested_scope(self):
+        with memoize_scope():
+            spam(1)
+            with memoize_scope():
+                spam(1)
+            spam(1)
+        self.assertEqual(len(calls), 2)
+
+    def test_max_size(self):
+        with memoize_scope(max_size=1):
+            spam(1)
+            spam(2)
+            spam(1)
+        self.assertEqual(len(calls), 3)
+
+
+class TestBoundedCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = BoundedCache(max_size=2)
+        cache['a'] = 1
+        cache['b'] = 0
+        cache.get('a')
+        cache['c'] = 3
+        self.assertEqual(cache.get('a'), 1)
+        self.assertTrue(cache.get('b') is MISS)
+        self.assertEqual(len(cache), 2)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from django.core.cache import cache
+
+from gtoolkit.cache import stampede
+from gtoolkit.cache.local_cache import LocalCache, MISS
+from gtoolkit.cache.method_cache import (method_cache, delete_method_cache,
+                                         get_method_cache_stats, _get_local_cache,
+                                         _generate_cache_key, _KeyBuilder)
+
+
+class Master(object):
+    called = 0
+
+    @classmethod
+    @method_cache(local_cache=True)
+    def get_all(cls):
+        cls.called += 1
+        return [cls.called]
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = LocalCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertTrue(cache.get('b') is MISS)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_version(self):
+        cache = LocalCache()
+        cache.set('a', 1, version=1)
+        self.assertEqual(cache.get('a', version=1), 1)
+        self.assertTrue(cache.get('a', version=2) is MISS)
+
+    def test_timeout(self):
+        cache = LocalCache(timeout=-1)
+        cache.set('a', 1)
+        self.assertTrue(cache.get('a') is MISS)
+
+
+class TestMethodCacheLocal(unittest.TestCase):
+
+    def setUp(self):
+        delete_method_cache(Master, Master.get_all)
+        _get_local_cache().clear()
+        Master.called = 0
+
+    def test_local_hit(self):
+        self.assertEqual(Master.get_all(), [1])
+        self.assertEqual(Master.get_all(), [1])
+        self.assertEqual(Master.called, 1)
+
+        stats = get_method_cache_stats()['%s.Master.get_all' % __name__]
+        self.assertTrue(stats['local_hits'] >= 1)
+
+    def test_delete_bumps_version(self):
+        self.assertEqual(Master.get_all(), [1])
+        delete_method_cache(Master, Master.get_all)
+        self.assertEqual(Master.get_all(), [2])
+        self.assertEqual(Master.called, 2)
+
+
+class TestStampede(unittest.TestCase):
+    KEY = 'test_method_cache.stampede'
+
+    def setUp(self):
+        cache.delete(self.KEY)
+        cache.delete(self.KEY + stampede.LOCK_KEY_SUFFIX)
+
+    def test_cache_none(self):
+        calls = []
+        def compute():
+            calls.append(1)
+            return None
+        for _ in range(2):
+            result, _status = stampede.get_or_compute(cache, self.KEY, compute, cache_none=True)
+            self.assertTrue(result is None)
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_while_revalidate(self):
+        cache.set(self.KEY, stampede.CacheEntry('old', soft_expires=0))
+
+        # 他のプロセスが再計算中なら古い値を返す
+        cache.add(self.KEY + stampede.LOCK_KEY_SUFFIX, 1)
+        result, status = stampede.get_or_compute(cache, self.KEY, lambda: 'new', soft_timeout=60)
+        self.assertEqual((result, status), ('old', stampede.STALE))
+
+        cache.delete(self.KEY + stampede.LOCK_KEY_SUFFIX)
+        result, status = stampede.get_or_compute(cache, self.KEY, lambda: 'new', soft_timeout=60)
+        self.assertEqual((result, status), ('new', stampede.MISS))
+        result, status = stampede.get_or_compute(cache, self.KEY, lambda: 'newer', soft_timeout=60)
+        self.assertEqual((result, status), ('new', stampede.HIT))
+
+    def test_lock_released(self):
+        def compute():
+            raise ValueError
+        self.assertRaises(ValueError, stampede.get_or_compute, cache, self.KEY, compute, lock=True)
+        self.assertTrue(cache.get(self.KEY + stampede.LOCK_KEY_SUFFIX) is None)
+
+    def test_legacy_value(self):
+        cache.set(self.KEY, 'raw')
+        result, status = stampede.get_or_compute(cache, self.KEY, lambda: 'new', cache_none=True)
+        self.assertEqual((result, status), ('raw', stampede.HIT))
+
+
+class TestKeyBuilder(unittest.TestCase):
+
+    class Model(object):
+        pk = 10
+
+    @classmethod
+    @method_cache
+    def method(cls, request, pk, name='', value=None):
+        return pk
+
+    def test_same_as_generate_cache_key(self):
+        cases = [
+            ((None, 1, 'abc'), {}),
+            ((None, 1L), {'name': u'あいう', 'value': [1, 2]}),
+            ((None, self.Model()), {'value': 'a b c'}),
+            ((), {'pk': 3}),
+            ((None, 'x' * 300), {}),
+            (5, {}),
+        ]
+        for ignore_request in (False, True):
+            builder = _KeyBuilder(self.method, ignore_request)
+            for args, kwargs in cases:
+                self.assertEqual(builder(TestKeyBuilder, args, kwargs),
+                                 _generate_cache_key(TestKeyBuilder, self.method, ignore_request, args, kwargs))
@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-import hashlib
 import random
 
 from django.conf import settings
@@ -7,6 +6,12 @@ from django.db import models
 from django.db.models.query import QuerySet
 
 from for_update import ForUpdateObjectsMixin
+from iterator import PartitionIterator
+from router import get_router
+from scatter import PartitionScatter, imap_on_partitions
+
+# partition_in で1クエリの IN 句に入れるIDの最大数
+DEFAULT_IN_CHUNK_SIZE = 500
 
 class HorizontalPartitioningQuerySet(ForUpdateObjectsMixin,
                                      QuerySet):
@@ -27,7 +32,7 @@ class HorizontalPartitioningManager(ForUpdateObjectsMixin,
         Return the manager that "using" DB which contain information of user_id.
         user_idのユーザー情報が入っているDBをusingしたマネージャを返す
         """
-        database_name = get_horizontal_partitioning_database_name(user_id)
+        database_name = get_router().route(user_id)
         return self.using(database_name)
 
     def random_partition(self):
@@ -51,20 +56,48 @@ class HorizontalPartitioningManager(ForUpdateObjectsMixin,
         複数のDBを順番に検索し、結果を結合して返す
         @return (list)検索結果 クエリセットではない
         ※ in句を使った場合、そのパーティションにあきらかに存在しないデータに対しても検索を行なってしまう。
-        →改善の必要あり。in句でユーザーIDを指定する場合は、別のメソッドを用意すると良いかも。
-        """
-        d = {}  # DB名をキー、ユーザー一覧をvalueとしたリスト
-        for user_id in user_id_list:
-            database_name = get_horizontal_partitioning_database_name(user_id)
-            if not database_name in d:
-                d[database_name] = []
-            d[database_name].append(user_id)
+        in句でユーザーIDを指定する場合は partition_in を使うこと
+        """
+        d = group_by_database_name(user_id_list)
         res = []
         for database_name, user_id_list in d.iteritems():
             qs = self.using(database_name).filter(**kwargs)
             res += list(qs)
         return res
 
+    def partition_in(self, field, ids, chunk_size=None, parallel=False, **kwargs):
+        """
+        Search "field IN ids" on each partition with only its own ids.
+        ids をパーティションごとに振り分け、そのパーティションのIDだけを IN 句に入れて検索する
+        ID が多い場合は chunk_size 件ずつに分けてクエリを投げる
+        parallel=True ならパーティション(チャンク)を並列に検索する
+        @return 検索結果のジェネレータ (順序は不定)
+
+        >>> for friend in Player.objects.partition_in('player_id', friend_ids, status=1):
+        ...     pass
+        """
+        if chunk_size is None:
+            chunk_size = getattr(settings, 'HORIZONTAL_PARTITIONING_IN_CHUNK_SIZE', DEFAULT_IN_CHUNK_SIZE)
+        lookup = '%s__in' % field
+        tasks = []
+        for database_name, id_list in group_by_database_name(ids).iteritems():
+            for i in range(0, len(id_list), chunk_size):
+                tasks.append((database_name, id_list[i:i + chunk_size]))
+
+        def query(database_name, id_list):
+            params = dict(kwargs)
+            params[lookup] = id_list
+            return self.using(database_name).filter(**params)
+
+        if parallel:
+            for rows in imap_on_partitions(lambda db, id_list: list(query(db, id_list)), tasks):
+                for row in rows:
+                    yield row
+        else:
+            for database_name, id_list in tasks:
+                for row in query(database_name, id_list).iterator():
+                    yield row
+
     def all_partitions(self):
         """
         Return the managers of every partitions with generator.
@@ -76,6 +109,35 @@ class HorizontalPartitioningManager(ForUpdateObjectsMixin,
             database_name = settings.HORIZONTAL_PARTITIONING_DB_NAME_FORMAT % i
             yield self.using(database_name)
 
+    def iter_all_partitions(self, chunk_size=1000, order_by='pk', values_list=None,
+                            checkpoint=None, progress=None, **kwargs):
+        """
+        Iterate rows of every partition chunk by chunk.
+        For batch or analytics use.
+        全パーティションの行を chunk_size 件ずつ読みながら順番に返すイテレータ
+        values_list: フィールド名のリストを渡すとタプルを返す (order_by を含めること)
+        checkpoint: (shard_id, last_pk) の続きから読む
+        progress: チャンクを読むたびに progress(イテレータ) を呼ぶ
+        主にバッチや集計用。詳しくは iterator.py
+        """
+        return PartitionIterator(self, chunk_size, order_by, values_list,
+                                 checkpoint, progress, kwargs)
+
+    def all_database_names(self):
+        return [settings.HORIZONTAL_PARTITIONING_DB_NAME_FORMAT % i
+                for i in range(settings.HORIZONTAL_PARTITIONING_PARTITION_NUMBER)]
+
+    def scatter(self, database_names=None, timeout=None, on_error=None):
+        """
+        Return PartitionScatter that queries partitions in parallel.
+        複数パーティション(省略時は全パーティション)へ並列に問い合わせる PartitionScatter を返す
+        >>> Ranking.objects.scatter(timeout=2.0).top(100, '-score', stage=3)
+        詳しくは scatter.py
+        """
+        if database_names is None:
+            database_names = self.all_database_names()
+        return PartitionScatter(self, database_names, timeout, on_error)
+
     def all_partition_filter(self, **kwargs):
         """
         Return the results after searching every partitions.
@@ -131,7 +193,15 @@ class HorizontalPartitioningMixin(object):
         if hasattr(basekey, 'pk'):
             #リレーションしているモデル(Playerなど)だった
             basekey = basekey.pk
-        return get_horizontal_partitioning_database_name(basekey)
+        return get_router().route(basekey)
+
+
+def group_by_database_name(user_id_list):
+    """
+    user_id をDB名ごとにまとめる
+    @return {DB名: [user_id, ...]} 重複は除く
+    """
+    return get_router().route_many(user_id_list)
 
 
 def get_horizontal_partitioning_database_name(user_id):
@@ -158,9 +228,6 @@ def get_horizontal_partitioning_database_name(user_id):
     >>> get_horizontal_partitioning_database_name(12346)
     TypeError: must be string or buffer, not int
     """
-    user_id = str(user_id) if isinstance(user_id, (int, long)) else user_id
-    hex_hash = hashlib.sha1(user_id).hexdigest()
-    group_number = (int(hex_hash[-2:], 16) % settings.HORIZONTAL_PARTITIONING_PARTITION_NUMBER)
-    #▲ハッシュ文字列の下2桁を16進数にしてDB振り分け。256台まではこれで大丈夫。スライスした方がちょっとだけ早かった
-    #むしろ下1桁だけ見ればいい気もするが、ローカルで%4などで使うケースもあるのでこれで良い
-    return settings.HORIZONTAL_PARTITIONING_DB_NAME_FORMAT % group_number
+    # ハッシュの最後の1バイト(16進文字列の下2桁)でDB振り分け。256台まではこれで大丈夫。
+    # むしろ下1桁だけ見ればいい気もするが、ローカルで%4などで使うケースもあるのでこれで良い
+    return get_router().route(user_id)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of routing user_id to the partition DB name.
+user_id からDB名への振り分けの計測
+
+1回あたりの時間(マイクロ秒)を表示し、従来の計算方法と結果が同じことを確認する。
+
+>>> from horizontalpartitioning.benchmark import router_benchmark
+>>> router_benchmark()
+"""
+import hashlib
+import time
+
+from django.conf import settings
+
+from router import ShardRouter
+
+
+def _legacy_route(user_id):
+    user_id = str(user_id) if isinstance(user_id, (int, long)) else user_id
+    hex_hash = hashlib.sha1(user_id).hexdigest()
+    group_number = (int(hex_hash[-2:], 16) % settings.HORIZONTAL_PARTITIONING_PARTITION_NUMBER)
+    return settings.HORIZONTAL_PARTITIONING_DB_NAME_FORMAT % group_number
+
+
+def router_benchmark(count=100000, distinct=1000):
+    user_ids = [str(100000 + i) for i in xrange(distinct)]
+    partition_number = settings.HORIZONTAL_PARTITIONING_PARTITION_NUMBER
+    db_name_format = settings.HORIZONTAL_PARTITIONING_DB_NAME_FORMAT
+    uncached = ShardRouter(partition_number, db_name_format, max_size=0)
+    cached = ShardRouter(partition_number, db_name_format)
+
+    for user_id in user_ids + [int(user_id) for user_id in user_ids]:
+        assert _legacy_route(user_id) == uncached.route(user_id) == cached.route(user_id), user_id
+
+    cases = (
+        ('legacy hexdigest', _legacy_route),
+        ('digest byte', uncached._route),
+        ('digest byte + cache', cached.route),
+    )
+    for name, func in cases:
+        start = time.time()
+        for i in xrange(count):
+            func(user_ids[i % distinct])
+        elapsed = time.time() - start
+        print '%-24s %8.3f us/call' % (name, elapsed * 1000000 / count)
+
+    start = time.time()
+    for _i in xrange(count / distinct):
+        cached.route_many(user_ids)
+    elapsed = time.time() - start
+    print '%-24s %8.3f us/id' % ('route_many', elapsed * 1000000 / count)
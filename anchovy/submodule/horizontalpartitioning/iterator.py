@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Iterate rows of every partition with keyset pagination.
+全パーティションの行を、キーセットページング(order_by > 前回の最後の値)で少しずつ読む
+
+    it = Player.objects.iter_all_partitions(chunk_size=1000, status=1)
+    for player in it:
+        ...
+        save_checkpoint(it.checkpoint)     # (shard_id, last_pk)
+
+    # 途中から再開
+    it = Player.objects.iter_all_partitions(chunk_size=1000, checkpoint=load_checkpoint(), status=1)
+
+メモリには chunk_size 件しか載らない。
+order_by はパーティション内で一意で、昇順に並べられるフィールド(pk など)にすること。
+"""
+from django.conf import settings
+
+
+class PartitionIterator(object):
+    """
+    iter_all_partitions が返すイテレータ
+    進捗: shard_id, checkpoint, rows, chunks, shards_done
+    """
+    def __init__(self, manager, chunk_size=1000, order_by='pk', values_list=None,
+                 checkpoint=None, progress=None, filters=None):
+        if order_by.startswith('-'):
+            raise ValueError('order_by must be ascending (%s)' % order_by)
+        if values_list is not None and order_by not in values_list:
+            raise ValueError('values_list must contain order_by (%s)' % order_by)
+        self.manager = manager
+        self.chunk_size = chunk_size
+        self.order_by = order_by
+        self.values_list = values_list
+        self.progress = progress
+        self.filters = filters or {}
+        self.shard_id, self.last_pk = checkpoint or (0, None)
+        self.rows = 0
+        self.chunks = 0
+        self.shards_done = 0
+
+    @property
+    def checkpoint(self):
+        """
+        (shard_id, last_pk) 次はこの続きから読む
+        """
+        return self.shard_id, self.last_pk
+
+    def __iter__(self):
+        return self._iterate()
+
+    def _iterate(self):
+        partition_number = settings.HORIZONTAL_PARTITIONING_PARTITION_NUMBER
+        while self.shard_id < partition_number:
+            database_name = settings.HORIZONTAL_PARTITIONING_DB_NAME_FORMAT % self.shard_id
+            while True:
+                chunk = self._fetch(database_name)
+                self.chunks += 1
+                for row in chunk:
+                    self.last_pk = self._get_key(row)
+                    self.rows += 1
+                    yield row
+                if self.progress:
+                    self.progress(self)
+                if len(chunk) < self.chunk_size:
+                    break
+            self.shards_done += 1
+            self.shard_id += 1
+            self.last_pk = None
+
+    def _fetch(self, database_name):
+        qs = self.manager.using(database_name).filter(**self.filters)
+        if self.last_pk is not None:
+            qs = qs.filter(**{'%s__gt' % self.order_by: self.last_pk})
+        qs = qs.order_by(self.order_by)
+        if self.values_list is not None:
+            qs = qs.values_list(*self.values_list)
+        return list(qs[:self.chunk_size])
+
+    def _get_key(self, row):
+        if self.values_list is not None:
+            return row[self.values_list.index(self.order_by)]
+        return getattr(row, self.order_by)
@@ -39,3 +39,10 @@ class Logger(object):
 
     def error(self, message, *args, **kwargs):
         self._write(self._logger.error, message, *args, **kwargs)
+
+    def timing(self, message, elapsed, *args, **kwargs):
+        """
+        elapsed(秒) をミリ秒で info に出力する
+        """
+        self._write(self._logger.info, message + u': %.3fms',
+                    *(args + (elapsed * 1000,)), **kwargs)
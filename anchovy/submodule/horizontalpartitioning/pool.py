@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+scatter, 2PC などで使うスレッドプール.
+設定名ごとに1つのプールをプロセスで共有する. fork 後は作り直す.
+"""
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+
+# 設定名 → (pid, プール)
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_thread_pool(setting_name, default):
+    """
+    settings.<setting_name> (省略時は default) 個のスレッドを持つプールを返す
+    """
+    pid = os.getpid()
+    entry = _pools.get(setting_name)
+    if entry is None or entry[0] != pid:
+        with _pools_lock:
+            entry = _pools.get(setting_name)
+            if entry is None or entry[0] != pid:
+                entry = (pid, ThreadPool(get_thread_pool_size(setting_name, default)))
+                _pools[setting_name] = entry
+    return entry[1]
+
+
+def get_thread_pool_size(setting_name, default):
+    return getattr(settings, setting_name, default)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Route user_id to the partition DB name.
+user_id からDB名への振り分け
+
+get_horizontal_partitioning_database_name と同じ結果を返す。
+    sha1 の hexdigest の下2桁を16進数として読む = digest の最後の1バイト
+なので、16進文字列を作らずに ord(digest[-1]) を使う。
+settings はルーター作成時に1度だけ読み、user_id ごとの結果をキャッシュする。
+
+settings
+    HORIZONTAL_PARTITIONING_ROUTER_CACHE_SIZE = 10000  # キャッシュする user_id の数 0 ならキャッシュしない
+
+settings を変更した場合(テストなど)は reset_router() を呼ぶこと
+"""
+import hashlib
+import threading
+
+from django.conf import settings
+
+DEFAULT_CACHE_SIZE = 10000
+
+_sha1 = hashlib.sha1
+
+
+class ShardRouter(object):
+    """
+    キャッシュは件数が max_size を超えたら全て捨てる。
+    collections.OrderedDict による LRU は Python 2 では sha1 を計算し直すより遅いため。
+    """
+    def __init__(self, partition_number, db_name_format, max_size=DEFAULT_CACHE_SIZE):
+        self.partition_number = partition_number
+        self.db_names = [db_name_format % i for i in xrange(partition_number)]
+        self.max_size = max_size
+        self._cache = {}
+
+    def route(self, user_id):
+        """
+        user_id のDB名
+        """
+        db_name = self._cache.get(user_id)
+        if db_name is None:
+            db_name = self._route(user_id)
+            if self.max_size:
+                if len(self._cache) >= self.max_size:
+                    self._cache = {}
+                self._cache[user_id] = db_name
+        return db_name
+
+    def _route(self, user_id):
+        key = str(user_id) if isinstance(user_id, (int, long)) else user_id
+        return self.db_names[ord(_sha1(key).digest()[-1]) % self.partition_number]
+
+    def route_many(self, user_ids):
+        """
+        user_id をDB名ごとにまとめる
+        @return {DB名: [user_id, ...]} 順序は user_ids の順 重複は除く
+        """
+        route = self.route
+        d = {}
+        seen = set()
+        for user_id in user_ids:
+            if user_id in seen:
+                continue
+            seen.add(user_id)
+            db_name = route(user_id)
+            if db_name in d:
+                d[db_name].append(user_id)
+            else:
+                d[db_name] = [user_id]
+        return d
+
+    def clear(self):
+        self._cache = {}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ShardRouter(
+                    settings.HORIZONTAL_PARTITIONING_PARTITION_NUMBER,
+                    settings.HORIZONTAL_PARTITIONING_DB_NAME_FORMAT,
+                    getattr(settings, 'HORIZONTAL_PARTITIONING_ROUTER_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+    return _router
+
+
+def reset_router():
+    global _router
+    with _router_lock:
+        _router = None
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Run queries on several partitions in parallel (scatter-gather).
+複数のパーティションへの問い合わせを並列に実行し、結果をまとめる
+
+    scatter = Ranking.objects.scatter(timeout=2.0, on_error='partial')
+    scatter.top(100, '-score', stage=3)      # 各パーティションの上位100件から全体の上位100件
+    scatter.count(stage=3)
+    scatter.aggregate('score', 'max', stage=3)
+    scatter.failures                         # on_error='partial' で失敗したパーティション
+
+Each partition is queried on its own thread with its own connection,
+so uncommitted changes of the caller's transaction are not visible.
+パーティションごとに別スレッド・別接続で実行するので、
+呼び出し元のトランザクションで未コミットの変更は見えない。主に参照、集計用。
+all_partition_filter などは従来どおり順番に実行する。並列にしたい場合は scatter() を使う。
+
+Timed-out queries keep running on the shared pool. While they occupy every worker,
+new scatters fail at once instead of waiting for the timeout.
+タイムアウトしたクエリは終わるまでプールのスレッドを使い続ける。
+そのようなクエリでスレッドが埋まっている間は、待たずに全パーティション失敗(PartitionTimeout)とする。
+
+Called from a worker thread (nested scatter), partitions are queried one by one
+on that thread to avoid a deadlock. timeout is not applied.
+ワーカースレッドから呼ばれた場合(入れ子)は、デッドロックしないよう
+そのスレッドで順番に実行する。timeout は効かない。
+
+settings
+    HORIZONTAL_PARTITIONING_SCATTER_WORKERS = 8 # スレッドプールのスレッド数 (プロセスで共有)
+    HORIZONTAL_PARTITIONING_SCATTER_TIMEOUT = 5 # 全体のタイムアウト(秒) 省略時は無制限
+    HORIZONTAL_PARTITIONING_SCATTER_ON_ERROR = 'raise'  # raise / partial
+"""
+import logging
+import os
+import threading
+import time
+from multiprocessing import TimeoutError
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Max, Min, Sum
+
+from pool import get_thread_pool, get_thread_pool_size
+
+_logger = logging.getLogger('horizontalpartitioning.scatter')
+
+# 失敗したパーティションがあれば ScatterError
+ON_ERROR_RAISE = 'raise'
+# 失敗したパーティションを除いた結果を返す
+ON_ERROR_PARTIAL = 'partial'
+
+DEFAULT_WORKERS = 8
+
+WORKERS_SETTING = 'HORIZONTAL_PARTITIONING_SCATTER_WORKERS'
+
+# タイムアウトした後もまだ実行中のタスク数 (プロセスごと)
+_abandoned = 0
+_abandoned_pid = None
+_abandoned_lock = threading.Lock()
+
+# ワーカースレッドなら in_worker = True
+_local = threading.local()
+
+AGGREGATES = {
+    'sum': Sum,
+    'min': Min,
+    'max': Max,
+    'count': Count,
+}
+
+
+class ScatterError(Exception):
+    """
+    Some partitions failed.
+    failures: {DB名: 例外}
+    """
+    def __init__(self, failures):
+        Exception.__init__(self, 'failed partitions: %s' % ', '.join(sorted(failures)))
+        self.failures = failures
+
+
+class PartitionTimeout(Exception):
+    pass
+
+
+class _Task(object):
+    """
+    プールに投げたタスクの状態 タイムアウト後に終わったら _abandoned から除く
+    """
+    __slots__ = ('done', 'abandoned')
+
+    def __init__(self):
+        self.done = False
+        self.abandoned = False
+
+    def finish(self):
+        global _abandoned
+        with _abandoned_lock:
+            self.done = True
+            if self.abandoned:
+                _abandoned -= 1
+
+    def abandon(self):
+        global _abandoned
+        with _abandoned_lock:
+            if not self.done and not self.abandoned:
+                self.abandoned = True
+                _abandoned += 1
+
+
+def _get_pool():
+    """
+    パーティションへの問い合わせ用のスレッドプール
+    """
+    global _abandoned, _abandoned_pid
+    pid = os.getpid()
+    if _abandoned_pid != pid:
+        # fork 前のプールのタスクは数えない
+        with _abandoned_lock:
+            _abandoned = 0
+            _abandoned_pid = pid
+    return get_thread_pool(WORKERS_SETTING, DEFAULT_WORKERS)
+
+
+def is_saturated():
+    """
+    タイムアウトしたタスクでプールのスレッドが埋まっているか
+    """
+    return _abandoned >= get_thread_pool_size(WORKERS_SETTING, DEFAULT_WORKERS)
+
+
+def _in_worker():
+    return getattr(_local, 'in_worker', False)
+
+
+def run_on_partitions(func, db_names, timeout=None, on_error=None):
+    """
+    Call func(db_name) for each partition in parallel.
+    func(db_name) を並列に実行し、([(DB名, 結果), ...], {DB名: 例外}) を返す
+    結果は db_names の順
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'HORIZONTAL_PARTITIONING_SCATTER_TIMEOUT', None)
+    if on_error is None:
+        on_error = getattr(settings, 'HORIZONTAL_PARTITIONING_SCATTER_ON_ERROR', ON_ERROR_RAISE)
+
+    results = []
+    failures = {}
+    if not db_names:
+        return results, failures
+
+    if _in_worker():
+        for db_name in db_names:
+            try:
+                results.append((db_name, _run(func, db_name)))
+            except Exception, e:
+                failures[db_name] = e
+        return _check_failures(results, failures, on_error)
+
+    pool = _get_pool()
+    if is_saturated():
+        _logger.error('scatter pool is saturated with %d timed-out tasks', _abandoned)
+        failures = dict((db_name, PartitionTimeout(db_name)) for db_name in db_names)
+        return _check_failures(results, failures, on_error)
+
+    pending = []
+    for db_name in db_names:
+        task = _Task()
+        pending.append((db_name, task, pool.apply_async(_run, (func, db_name, task))))
+    deadline = time.time() + timeout if timeout else None
+    for db_name, task, async_result in pending:
+        # タイムアウトしたクエリは終わるまで待たない
+        try:
+            if deadline is None:
+                value = async_result.get()
+            else:
+                value = async_result.get(max(deadline - time.time(), 0))
+        except TimeoutError:
+            task.abandon()
+            failures[db_name] = PartitionTimeout(db_name)
+        except Exception, e:
+            failures[db_name] = e
+        else:
+            results.append((db_name, value))
+    return _check_failures(results, failures, on_error)
+
+
+def _check_failures(results, failures, on_error):
+    if failures:
+        if on_error == ON_ERROR_PARTIAL:
+            _logger.warning('partial result. failed partitions: %s', failures)
+        else:
+            raise ScatterError(failures)
+    return results, failures
+
+
+def imap_on_partitions(func, tasks):
+    """
+    Call func(db_name, arg) for each (db_name, arg) in tasks in parallel.
+    tasks の (DB名, 引数) ごとに func(DB名, 引数) を並列に実行し、終わった順に結果を返すジェネレータ
+    例外はそのまま送出する
+    途中で止めた場合、まだ始まっていないタスクは実行しない
+    """
+    if _in_worker():
+        for db_name, arg in tasks:
+            yield _run(lambda db_name: func(db_name, arg), db_name)
+        return
+
+    cancelled = threading.Event()
+    tasks = [(func, db_name, arg, cancelled) for db_name, arg in tasks]
+    if not tasks:
+        return
+    completed = False
+    try:
+        for value in _get_pool().imap_unordered(_run_task, tasks):
+            yield value
+        completed = True
+    finally:
+        if not completed:
+            # プールは共有しているので terminate() はせず、残りのタスクを取り消す
+            cancelled.set()
+
+
+def _run_task(task):
+    func, db_name, arg, cancelled = task
+    if cancelled.is_set():
+        return None
+    return _run(lambda db_name: func(db_name, arg), db_name)
+
+
+def _run(func, db_name, task=None):
+    _local.in_worker = True
+    try:
+        return func(db_name)
+    finally:
+        # ワーカースレッドの接続は使い回さない
+        connections[db_name].close()
+        if task is not None:
+            task.finish()
+
+
+def merge_concat(results):
+    res = []
+    for rows in results:
+        res += rows
+    return res
+
+
+def merge_sorted(results, order_by, limit=None):
+    """
+    Merge rows sorted by order_by on each partition.
+    パーティションごとに order_by で並んだ結果を、全体で order_by の順に並べる
+    """
+    rows = merge_concat(results)
+    # 安定ソートなので、後ろのキーから順に並べ替えれば複数キーで並ぶ
+    for field in reversed(order_by):
+        reverse = field.startswith('-')
+        rows.sort(key=attrgetter(field.lstrip('-').replace('__', '.')), reverse=reverse)
+    if limit is not None:
+        rows = rows[:limit]
+    return rows
+
+
+def merge_aggregate(results, func):
+    values = [value for value in results if value is not None]
+    if func in ('sum', 'count'):
+        return sum(values)
+    if not values:
+        return None
+    if func == 'min':
+        return min(values)
+    if func == 'max':
+        return max(values)
+    if func == 'avg':
+        total = sum(s for s, _c in values if s is not None)
+        count = sum(c for _s, c in values)
+        return float(total) / count if count else None
+    raise ValueError('Unknown aggregate (%s)' % func)
+
+
+class PartitionScatter(object):
+    """
+    Parallel queries on partitions of a manager.
+    マネージャの複数パーティションへの並列問い合わせ
+    """
+    def __init__(self, manager, db_names, timeout=None, on_error=None):
+        self.manager = manager
+        self.db_names = list(db_names)
+        self.timeout = timeout
+        self.on_error = on_error
+        # 直前の問い合わせで失敗したパーティション {DB名: 例外}
+        self.failures = {}
+
+    def map(self, query):
+        """
+        query(パーティションをusingしたマネージャ) の結果のリスト
+        """
+        manager = self.manager
+        def func(db_name):
+            return query(manager.using(db_name))
+        results, self.failures = run_on_partitions(func, self.db_names,
+                                                   self.timeout, self.on_error)
+        return [value for _db_name, value in results]
+
+    def filter(self, **kwargs):
+        return merge_concat(self.map(lambda m: list(m.filter(**kwargs))))
+
+    def count(self, **kwargs):
+        return merge_aggregate(self.map(lambda m: m.filter(**kwargs).count()), 'count')
+
+    def top(self, n, *order_by, **kwargs):
+        """
+        Top n rows ordered by order_by over all partitions.
+        各パーティションから上位 n 件だけを取り出し、全体の上位 n 件を返す
+        """
+        if not order_by:
+            raise ValueError('order_by is required')
+        results = self.map(lambda m: list(m.filter(**kwargs).order_by(*order_by)[:n]))
+        return merge_sorted(results, order_by, n)
+
+    def aggregate(self, field, func, **kwargs):
+        """
+        func: sum / min / max / count / avg
+        """
+        if func == 'avg':
+            def query(m):
+                r = m.filter(**kwargs).aggregate(s=Sum(field), c=Count(field))
+                return r['s'], r['c']
+        elif func in AGGREGATES:
+            aggregate_class = AGGREGATES[func]
+            def query(m):
+                return m.filter(**kwargs).aggregate(v=aggregate_class(field))['v']
+        else:
+            raise ValueError('Unknown aggregate (%s)' % func)
+        return merge_aggregate(self.map(query), func)
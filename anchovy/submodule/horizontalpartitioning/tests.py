@@ -37,6 +37,127 @@ class TestModel(unittest.TestCase):
             models.query.QuerySet))
         self.assertTrue(isinstance(HorizontalPartitioningMock.objects.all_partition_count(), (int, long,)))
 
+    def test_scatter(self):
+        """
+        並列問い合わせの結果が順番に問い合わせた結果と同じ
+        """
+        for i in range(5):
+            player_id = u'test_scatter%d' % i
+            HorizontalPartitioningMock.objects.partition(player_id).create(
+                player_id=player_id, value=u'scatter')
+        objects = HorizontalPartitioningMock.objects
+        self.assertEqual(objects.scatter().count(value=u'scatter'),
+                         objects.all_partition_count(value=u'scatter'))
+
+        rows = objects.all_partition_filter(value=u'scatter')
+        expected = sorted(rows, key=lambda r: r.pk, reverse=True)[:3]
+        top = objects.scatter().top(3, '-pk', value=u'scatter')
+        self.assertEqual([r.pk for r in top], [r.pk for r in expected])
+
+    def test_scatter_failure(self):
+        from scatter import ScatterError, ON_ERROR_PARTIAL
+        objects = HorizontalPartitioningMock.objects
+        db_names = objects.all_database_names()
+        def query(qs):
+            if qs.db == db_names[0]:
+                raise ValueError(qs.db)
+            return qs.count()
+
+        self.assertRaises(ScatterError, objects.scatter().map, query)
+
+        scatter = objects.scatter(on_error=ON_ERROR_PARTIAL)
+        self.assertEqual(len(scatter.map(query)), len(db_names) - 1)
+        self.assertEqual(scatter.failures.keys(), [db_names[0]])
+
+    def test_scatter_nested(self):
+        """
+        ワーカースレッドから呼んでもデッドロックしない
+        """
+        objects = HorizontalPartitioningMock.objects
+        counts = objects.scatter(timeout=10).map(lambda qs: objects.scatter().count())
+        self.assertEqual(counts, [objects.all_partition_count()] * len(counts))
+
+    def test_scatter_saturated(self):
+        """
+        タイムアウトしたタスクでプールが埋まっている間は待たずに失敗する
+        """
+        import threading
+        import time
+        import scatter
+        objects = HorizontalPartitioningMock.objects
+        db_names = objects.all_database_names()
+        release = threading.Event()
+        try:
+            workers = scatter.get_thread_pool_size(scatter.WORKERS_SETTING, scatter.DEFAULT_WORKERS)
+            hung = objects.scatter([db_names[0]] * workers, timeout=0.1,
+                                   on_error=scatter.ON_ERROR_PARTIAL)
+            hung.map(lambda qs: release.wait(10))
+            self.assertTrue(scatter.is_saturated())
+            self.assertRaises(scatter.ScatterError, objects.scatter(timeout=10).count)
+        finally:
+            release.set()
+            while scatter.is_saturated():
+                time.sleep(0.01)
+
+    def test_scatter_merge(self):
+        from scatter import merge_sorted, merge_aggregate
+        class Row(object):
+            def __init__(self, score, pk):
+                self.score = score
+                self.pk = pk
+        results = [[Row(3, 1), Row(1, 2)], [Row(3, 0), Row(2, 3)]]
+        rows = merge_sorted(results, ('-score', 'pk'), 3)
+        self.assertEqual([(r.score, r.pk) for r in rows], [(3, 0), (3, 1), (2, 3)])
+
+        self.assertEqual(merge_aggregate([1, None, 2], 'sum'), 3)
+        self.assertEqual(merge_aggregate([None, None], 'max'), None)
+        self.assertEqual(merge_aggregate([(10, 2), (None, 0), (5, 1)], 'avg'), 5.0)
+
+    def test_partition_in(self):
+        """
+        パーティションごとに自分のIDだけで検索する
+        """
+        player_ids = [u'test_in%d' % i for i in range(5)]
+        for player_id in player_ids:
+            HorizontalPartitioningMock.objects.partition(player_id).create(
+                player_id=player_id, value=u'in')
+        for parallel in (False, True):
+            res = HorizontalPartitioningMock.objects.partition_in(
+                'player_id', player_ids + player_ids[:2], chunk_size=2, parallel=parallel, value=u'in')
+            self.assertEqual(sorted(r.player_id for r in res), player_ids)
+
+    def test_iter_all_partitions(self):
+        for i in range(5):
+            player_id = u'test_iter%d' % i
+            HorizontalPartitioningMock.objects.partition(player_id).create(
+                player_id=player_id, value=u'iter')
+        expected = HorizontalPartitioningMock.objects.all_partition_count(value=u'iter')
+        it = HorizontalPartitioningMock.objects.iter_all_partitions(
+            chunk_size=2, values_list=['pk', 'player_id'], value=u'iter')
+        rows = list(it)
+        self.assertEqual(len(rows), expected)
+        self.assertEqual(it.rows, expected)
+        # 最後まで読んだチェックポイントからは何も返らない
+        rest = HorizontalPartitioningMock.objects.iter_all_partitions(
+            checkpoint=it.checkpoint, value=u'iter')
+        self.assertEqual(list(rest), [])
+
+    def test_router(self):
+        """
+        従来の hexdigest の下2桁による振り分けと同じ結果になる
+        """
+        import hashlib
+        from django.conf import settings
+        from router import get_router
+        router = get_router()
+        user_ids = [u'test%d' % i for i in range(100)]
+        for user_id in user_ids:
+            group_number = int(hashlib.sha1(user_id).hexdigest()[-2:], 16) % settings.HORIZONTAL_PARTITIONING_PARTITION_NUMBER
+            self.assertEqual(router.route(user_id),
+                             settings.HORIZONTAL_PARTITIONING_DB_NAME_FORMAT % group_number)
+        for db_name, ids in router.route_many(user_ids).iteritems():
+            self.assertTrue(all(router.route(user_id) == db_name for user_id in ids))
+
     def test_multipletransaction(self):
         from django.conf import settings
         from __init__ import get_horizontal_partitioning_database_name
@@ -50,4 +171,72 @@ class TestModel(unittest.TestCase):
         hpm.player_id = u'test02'
         hpm.value = u'The quick brown fox'
         hpm.save()
-        mt.commit()
\ No newline at end of file
+        mt.commit()
+
+    def _xa_user_ids(self):
+        """
+        別々のDBに振り分けられる user_id を2つ返す
+        """
+        from router import get_router
+        user_ids = get_router().route_many([u'test_xa%d' % i for i in range(100)])
+        if len(user_ids) < 2:
+            return None
+        return [ids[0] for ids in user_ids.values()[:2]]
+
+    def _xa_skip(self, user_ids):
+        from django.conf import settings
+        from router import get_router
+        if user_ids is None:
+            return True
+        for user_id in user_ids:
+            db_name = get_router().route(user_id)
+            if settings.DATABASES[db_name]['ENGINE'].endswith('.sqlite3'):
+                return True # skip because sqlite3
+        return False
+
+    def test_xa_parallel_commit(self):
+        from transaction import commit_on_success
+        user_ids = self._xa_user_ids()
+        if self._xa_skip(user_ids):
+            return
+        objects = HorizontalPartitioningMock.objects
+        with commit_on_success(user_ids=user_ids, parallel_commit=True, notify_lock=False):
+            for user_id in user_ids:
+                objects.partition(user_id).create(player_id=user_id, value=u'xa_commit')
+        for user_id in user_ids:
+            self.assertTrue(objects.partition(user_id).filter(
+                player_id=user_id, value=u'xa_commit').exists())
+
+    def test_xa_parallel_prepare_failure(self):
+        from transaction import commit_on_success, _XATransaction
+        from router import get_router
+        user_ids = self._xa_user_ids()
+        if self._xa_skip(user_ids):
+            return
+        db_names = [get_router().route(user_id) for user_id in user_ids]
+        objects = HorizontalPartitioningMock.objects
+
+        xa = commit_on_success(user_ids=user_ids, parallel_commit=True, notify_lock=False)
+        self.assertTrue(isinstance(xa, _XATransaction))
+        prepare = xa._prepare
+        def failing_prepare(db_name, con):
+            if db_name == db_names[0]:
+                raise ValueError(db_name)
+            prepare(db_name, con)
+        xa._prepare = failing_prepare
+        rolled_back = []
+        ensure_rollback = xa._ensure_rollback
+        def recording_rollback(db_name, con):
+            rolled_back.append(db_name)
+            ensure_rollback(db_name, con)
+        xa._ensure_rollback = recording_rollback
+
+        def run():
+            with xa:
+                for user_id in user_ids:
+                    objects.partition(user_id).create(player_id=user_id, value=u'xa_rollback')
+        self.assertRaises(ValueError, run)
+        self.assertEqual(sorted(rolled_back), sorted(db_names))
+        for user_id in user_ids:
+            self.assertFalse(objects.partition(user_id).filter(
+                player_id=user_id, value=u'xa_rollback').exists())
@@ -45,20 +45,32 @@ commit_on_success を入れ子にした場合,
 
 commit_on_success でトランザクション中の DB 名以外を
 savepoint で使用すると raise する. 
+
+parallel_commit=True (もしくは settings.XA_PARALLEL_COMMIT = True) にすると,
+2PC の各フェーズ (xa end / xa prepare / xa commit) を全 DB に並列に発行する.
+全 DB でフェーズが終わるまで次のフェーズには進まない.
+フェーズごと, DB ごとの所要時間は info ログに出力する (verbose=True の場合).
 """
+import sys
+import threading
+import time
 import uuid
 from functools import wraps
 
 from django.db import connections, transaction
 from django.conf import settings
 
-from __init__ import get_horizontal_partitioning_database_name
+from router import get_router
 import adhoc
 from .monitor import handle_dblock
 from .logger import Logger
+from .pool import get_thread_pool
 
 _logger = Logger('transaction')
 
+# 2PC のフェーズを並列に実行するスレッド数
+DEFAULT_XA_PARALLEL_WORKERS = 8
+
 
 class _WithIsDecoratorMixin(object):
     """
@@ -74,8 +86,8 @@ class _WithIsDecoratorMixin(object):
 
 class _UserIDtoDBNameMixin(object):
     def _user_ids_to_db_names(self, user_ids=None):
-        return [get_horizontal_partitioning_database_name(user_id)
-                for user_id in user_ids]
+        route = get_router().route
+        return [route(user_id) for user_id in user_ids]
 
     def _marge_db_names(self, a, b):
         # set を利用すると順序を保証できないため,
@@ -178,10 +190,11 @@ class _XATransaction(_WithIsDecoratorMixin, _CheckManagedMixin, _HasXidMixin):
             self._cur.close()
             return exc_type is None
 
-    def __init__(self, db_names, on_serializable, verbose):
+    def __init__(self, db_names, on_serializable, verbose, parallel=False):
         self._db_names = db_names
         self._on_serializable = on_serializable
         self._verbose = verbose
+        self._parallel = parallel
 
         self._can_start_transaction(self._db_names)
         for db_name in self._db_names:
@@ -246,6 +259,54 @@ class _XATransaction(_WithIsDecoratorMixin, _CheckManagedMixin, _HasXidMixin):
             else:
                 f(db_name)
 
+    def _exec_phase(self, phase, f):
+        """
+        2PC の1フェーズを全接続で実行する.
+        並列の場合も全接続の実行が終わるまで待ち(バリア), 失敗があれば最初の例外を raise する.
+        どこかの DB で失敗したら, まだ始まっていない DB では実行しない (順番に実行する場合と同じ).
+        """
+        start = time.time()
+        failed = threading.Event()
+        timed = self._timed(phase, f, failed)
+        try:
+            cons = self._get_connections()
+            if not self._parallel or len(cons) < 2:
+                for db_name, con in cons:
+                    timed(db_name, con)
+                return
+
+            # Django の connections はスレッドローカルなので, 接続はこのスレッドで取得して渡す
+            pool = get_thread_pool('XA_PARALLEL_COMMIT_WORKERS', DEFAULT_XA_PARALLEL_WORKERS)
+            results = [pool.apply_async(timed, (db_name, con))
+                       for db_name, con in cons]
+            exc_info = None
+            for result in results:
+                try:
+                    result.get()
+                except:
+                    if exc_info is None:
+                        exc_info = sys.exc_info()
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+        finally:
+            _logger.timing('xa %s', time.time() - start, phase,
+                           verbose=self._verbose)
+
+    def _timed(self, phase, f, failed):
+        def timed(db_name, con):
+            if failed.is_set():
+                return
+            start = time.time()
+            try:
+                f(db_name, con)
+            except:
+                failed.set()
+                raise
+            finally:
+                _logger.timing('xa %s %s', time.time() - start, phase, db_name,
+                               verbose=self._verbose)
+        return timed
+
     def rollback(self):
         self._exec_on_connections(self._ensure_rollback)
 
@@ -262,9 +323,9 @@ class _XATransaction(_WithIsDecoratorMixin, _CheckManagedMixin, _HasXidMixin):
  
     def commit(self):
         try:
-            self._exec_on_connections(self._end)
-            self._exec_on_connections(self._prepare)
-            self._exec_on_connections(self._commit)
+            self._exec_phase('end', self._end)
+            self._exec_phase('prepare', self._prepare)
+            self._exec_phase('commit', self._commit)
         except:
             _logger.except_error()
             self.rollback()
@@ -334,6 +395,7 @@ def commit_on_success(user_ids=None, db_names=None,
                       wait_timeout=None,
                       on_serializable=None,
                       notify_lock=None,
+                      parallel_commit=None,
                       verbose=False):
     """
     水平分割用の commit_on_success
@@ -352,6 +414,8 @@ def commit_on_success(user_ids=None, db_names=None,
 
     基本的に, commit_on_success を入れ子にしない事.
 
+    parallel_commit=True で, XA の 2PC の各フェーズを DB ごとに並列に実行する.
+
     使用方法は, 下記の通り.
 
     .. code-block:: python
@@ -385,6 +449,9 @@ def commit_on_success(user_ids=None, db_names=None,
     _logger.debug('commit_on_success: USE_NOTIFY_LOCK = %s',
                   notify_lock)
 
+    if parallel_commit is None:
+        parallel_commit = getattr(settings, 'XA_PARALLEL_COMMIT', False)
+
     db_names = _UserIDtoDBNameMixin().get_db_names(user_ids, db_names)
     _logger.info('commit_on_success: user_ids = %s, db_names = %s',
                  user_ids, db_names, verbose=verbose)
@@ -395,7 +462,8 @@ def commit_on_success(user_ids=None, db_names=None,
     if ensure_start:
         _force_clean_transaction(db_names, verbose)
 
-    commit_context = _commit_on_success(db_names, on_serializable, verbose)
+    commit_context = _commit_on_success(db_names, on_serializable, verbose,
+                                        parallel_commit)
     return handle_dblock(db_names, commit_context) \
         if notify_lock else commit_context
 
@@ -464,10 +532,10 @@ def _force_leave(db_name):
         _logger.error('force leave error: %s', db_name)
         _logger.except_error()
 
-def _commit_on_success(db_names, on_serializable, verbose):
+def _commit_on_success(db_names, on_serializable, verbose, parallel_commit=False):
     if 2 <= len(db_names):
         _logger.info('_commit_on_success: start xa transaction', verbose=verbose)
-        return _XATransaction(db_names, on_serializable, verbose)
+        return _XATransaction(db_names, on_serializable, verbose, parallel_commit)
 
     _logger.info('_commit_on_success: start transaction', verbose=verbose)
     return _single_commit_on_success(db_names[0])
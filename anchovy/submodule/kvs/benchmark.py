@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+#
+# Redis コネクションプールのベンチマーク
+#
+# スレッド数を増やしたときの ops/sec をプーリングモードごとに計測する
+# >>> from kvs.benchmark import pooling_benchmark
+# >>> pooling_benchmark({'HOST': 'localhost', 'PORT': 6379, 'DB': 0})
+#
+# シリアライザのベンチマーク
+#
+# シリアライザ・圧縮方式ごとにサイズとエンコード・デコード時間を計測する
+# >>> from kvs.benchmark import serializer_benchmark
+# >>> serializer_benchmark([kvs.get() for kvs in ...])
+#
+
+import threading
+import time
+
+from redis_client import (RedisClient, RedisConnection,
+                          POOLING_MODE_SEMAPHORE, POOLING_MODE_BLOCKING)
+from serializer import Codec, SerializerError
+
+KEY_FORMAT = 'kvs.benchmark::%d::%d'
+
+
+def pooling_benchmark(setting, thread_counts=(1, 2, 4, 8, 16), ops=2000, pool_size=16):
+    """
+    モードとスレッド数ごとに ops/sec を表示する
+    ops はスレッド1つあたりの set/get の回数
+    """
+    for mode in (POOLING_MODE_SEMAPHORE, POOLING_MODE_BLOCKING):
+        connection = RedisConnection(host=setting['HOST'],
+                                     port=int(setting.get('PORT', 6379)),
+                                     db=setting.get('DB', 0),
+                                     mode=mode,
+                                     pool_size=pool_size,
+                                     pool_timeout=10)
+        client = RedisClient(setting, connection=connection)
+        for thread_count in thread_counts:
+            elapsed = _run(client, thread_count, ops)
+            print '%-9s threads:%2d  %8.1f ops/sec' % (mode, thread_count, thread_count * ops * 2 / elapsed)
+        if mode == POOLING_MODE_BLOCKING:
+            print connection.con.stats.as_dict()
+
+
+def _run(client, thread_count, ops):
+    def worker(n):
+        for i in xrange(ops):
+            key = KEY_FORMAT % (n, i % 100)
+            client.set(key, i)
+            client.get(key)
+        for i in xrange(100):
+            client.delete(KEY_FORMAT % (n, i))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in xrange(thread_count)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.time() - start
+
+
+# (シリアライザ, 圧縮方式)  serializer が None は従来形式
+SERIALIZER_CASES = (
+    (None, None),
+    ('pickle', None),
+    ('pickle', 'zlib'),
+    ('pickle', 'lz4'),
+    ('msgpack', None),
+    ('msgpack', 'zlib'),
+    ('marshal', None),
+    ('marshal', 'zlib'),
+)
+
+
+def serializer_benchmark(payloads=None, repeat=100, threshold=1024):
+    """
+    シリアライザ・圧縮方式ごとに合計サイズとエンコード・デコード時間(ms/回)を表示する
+    payloads は実際にKVSに保存している値のリスト
+    """
+    if payloads is None:
+        payloads = [_sample_payload(n) for n in (10, 100, 1000)]
+
+    for serializer, compress in SERIALIZER_CASES:
+        name = '%s+%s' % (serializer or 'legacy', compress or '-')
+        try:
+            codec = Codec(serializer, compress, threshold)
+            encoded = [codec.encode(payload) for payload in payloads]
+        except (SerializerError, TypeError, ValueError), e:
+            # 使えないシリアライザ、シリアライズできない値
+            print '%-16s skip (%s)' % (name, e)
+            continue
+
+        start = time.time()
+        for _i in xrange(repeat):
+            for payload in payloads:
+                codec.encode(payload)
+        encode_time = time.time() - start
+
+        start = time.time()
+        for _i in xrange(repeat):
+            for s in encoded:
+                codec.decode(s)
+        decode_time = time.time() - start
+
+        print '%-16s size:%10d  encode:%8.3fms  decode:%8.3fms' % (
+            name, sum(len(s) for s in encoded),
+            encode_time * 1000 / repeat, decode_time * 1000 / repeat)
+
+
+def _sample_payload(size):
+    """
+    スレの書き込み一覧を模したデータ
+    """
+    return [{'number': i,
+             'name': u'名無しさん',
+             'date': '2012/01/01(日) 00:00:%02d.%02d' % (i % 60, i % 100),
+             'text': u'テスト本文 %d ' % i * 5}
+            for i in xrange(size)]
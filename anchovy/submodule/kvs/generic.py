@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from factory import create_kvs_class, get_kvs_class_name
+from serializer import get_codec
 
 # エラークラス
 class KVSError(Exception):
@@ -17,6 +18,8 @@ class KVS(object):
     KEY_NAME = None
     KEY_FORMAT = '%s'
     SET_NAME = None
+    SERIALIZER = None
+    COMPRESS = None
     def __init__(self, *args, **argv):
 
         # argv['kvsclass'] > self.KVS_CLASS > self.KVS_TYPE の優先度で使用するクラスを決める
@@ -29,6 +32,10 @@ class KVS(object):
             argv['keyformat'] = self.KEY_FORMAT
         if 'set_name' not in argv:
             argv['set_name'] = self.SET_NAME
+        if 'serializer' not in argv:
+            argv['serializer'] = self.SERIALIZER
+        if 'compress' not in argv:
+            argv['compress'] = self.COMPRESS
         self._kvs = self._kvsclass(*args, **argv)
 
     @property
@@ -78,6 +85,26 @@ class KVS(object):
         """
         self.kvs.delete(keyvalue=keyvalue)
 
+    def get_many(self, keyvalues):
+        """
+        複数の値をまとめて取得
+        {keyvalue: 値} を返す 存在しないキーは含まない
+        """
+        return self.kvs.get_many(keyvalues)
+
+    def set_many(self, mapping):
+        """
+        複数の値をまとめて設定
+        mapping: {keyvalue: 値}
+        """
+        self.kvs.set_many(mapping)
+
+    def delete_many(self, keyvalues):
+        """
+        複数の値をまとめて削除
+        """
+        self.kvs.delete_many(keyvalues)
+
     def close(self):
         """
         接続クローズ
@@ -288,3 +315,192 @@ class AttributeKVS(object):
             ret[k] = kvs
 
         return ret
+
+
+class HashAttributeKVS(AttributeKVS):
+    """
+    Redis Hash 版の属性KVSクラス
+    1つのkeyvalueの全属性を1つのハッシュ(キー 'KEY_GROUP::keyvalue')に保存する
+
+    最初の属性参照で HGETALL して以降はローカルの値を返す。
+    属性の設定・削除はローカルにためておき、flush() で HMSET/HDEL をまとめて送る。
+
+    with Player('123') as d:
+        d.aaa = 1
+        d.bbb += 3
+    """
+    KVS_CLASS = 'RedisHash'
+
+    def __init__(self, keyvalue, keygroup=None, keyformat=None, attributes=None, **argv):
+        self._attributes = None
+        super(HashAttributeKVS, self).__init__(keyvalue, keygroup=keygroup, keyformat=keyformat,
+                                               attributes=attributes, **argv)
+        self._codec = get_codec(argv.get('serializer'), argv.get('compress'), argv.get('compress_threshold'))
+        self._reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def __getattr__(self, name):
+        """
+        属性値取得
+        未ロードならハッシュ全体を読み込む
+        """
+        if name.startswith('_'):
+            # _から始まる属性名は従来通りの動作
+            return super(HashAttributeKVS, self).__getattr__(name)
+        self._check_attribute(name)
+
+        if name in self._dirty:
+            return self._dirty[name]
+        if name in self._deleted:
+            return None
+        if self._values is None or (self._partial and name not in self._values):
+            self.load()
+        return self._values.get(name)
+
+    def __setattr__(self, name, value):
+        """
+        属性値設定
+        flush() するまで保存しない
+        """
+        if name.startswith('_'):
+            # _から始まる属性名は従来通りの動作
+            super(AttributeKVS, self).__setattr__(name, value)
+        else:
+            self._check_attribute(name)
+            self._dirty[name] = value
+            self._deleted.discard(name)
+
+    def __delattr__(self, name):
+        """
+        属性値削除
+        flush() するまで削除しない
+        """
+        if name.startswith('_'):
+            # _から始まる属性名は従来通りの動作
+            super(AttributeKVS, self).__delattr__(name)
+        else:
+            self._check_attribute(name)
+            self._dirty.pop(name, None)
+            self._deleted.add(name)
+
+    def load(self, names=None):
+        """
+        属性値の読み込み
+        names を指定した場合は HMGET でその属性だけ、省略時は HGETALL で全属性を読み込む
+        """
+        kvs = self._get_hash_kvs()
+        if names is None:
+            self._values = dict((k, self._deserialize(v)) for k, v in kvs.getall().iteritems())
+            self._partial = False
+        else:
+            names = list(names)
+            for name in names:
+                self._check_attribute(name)
+            if self._values is None:
+                self._values = {}
+                self._partial = True
+            if names:
+                for name, value in zip(names, kvs.mget(names)):
+                    if value is None:
+                        self._values.pop(name, None)
+                    else:
+                        self._values[name] = self._deserialize(value)
+        return self
+
+    def flush(self):
+        """
+        変更した属性値を保存する
+        設定と削除は1回のパイプラインで送る
+        """
+        if not self._dirty and not self._deleted:
+            return
+
+        kvs = self._get_hash_kvs()
+        kvs._migrate()
+        mapping = dict((k, self._serialize(v)) for k, v in self._dirty.iteritems())
+        with kvs.instance.pipeline() as pipe:
+            if mapping:
+                pipe.hmset(kvs.key, mapping)
+            if self._deleted:
+                pipe.hdel(kvs.key, *self._deleted)
+            pipe.execute()
+
+        if self._values is not None:
+            self._values.update(self._dirty)
+            for name in self._deleted:
+                self._values.pop(name, None)
+        self._dirty = {}
+        self._deleted = set()
+
+    def discard(self):
+        """
+        flush() していない変更を破棄する
+        """
+        self._dirty = {}
+        self._deleted = set()
+
+    def init_values(self):
+        """
+        値の初期化
+        """
+        for k, v in self._initvalues.iteritems():
+            self.__setattr__(k, v)
+        self.flush()
+
+    def setkey(self, keyvalue):
+        """
+        キー名設定
+        ローカルの値と未保存の変更は破棄する
+        """
+        self._keyvalue = keyvalue
+        self._reset()
+
+    def deleteall(self):
+        """
+        ハッシュごと削除
+        """
+        kvs = self._get_hash_kvs()
+        kvs._migrate()
+        kvs.instance.delete(kvs.key)
+        self._reset()
+        self._values = {}
+
+    def kvsdict(self):
+        raise self.Error('Not supported (use todict)')
+
+    def todict(self):
+        """
+        属性値を辞書形式で返す (未保存の変更を含む)
+        """
+        if self._values is None or self._partial:
+            self.load()
+        ret = dict(self._values)
+        ret.update(self._dirty)
+        for name in self._deleted:
+            ret.pop(name, None)
+        return ret
+
+    def _reset(self):
+        self._values = None
+        self._partial = False
+        self._dirty = {}
+        self._deleted = set()
+
+    def _check_attribute(self, name):
+        if self._attributes and name not in self._attributes:
+            raise self.Error('Not defined attribute (%s)' % str(name))
+
+    def _get_hash_kvs(self):
+        return self._kvsclass(self._keyvalue, keyname=self._keygroup, keyformat=self._keyformat, **self._argv)
+
+    def _serialize(self, value):
+        return self._codec.encode(value)
+
+    def _deserialize(self, value):
+        return self._codec.decode(value)
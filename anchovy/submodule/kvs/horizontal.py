@@ -2,7 +2,10 @@
 
 from django.conf import settings
 
+import bisect
 import hashlib
+import struct
+import threading
 
 DEFAULT_DB_NAME_FORMAT = 'shard%d'
 KVS_SETTINGS_DEFAULT_DB_NAME_FORMAT = 'KVS_HORIZONTAL_PARTITIONING_DB_NAME_FORMAT'
@@ -37,6 +40,9 @@ def get_horizontal_partitioning_database_name(key_name):
     SELECT CONV(RIGHT(SHA1('USER-ID'),1), 16, 10); や
     SELECT MOD(CONV(RIGHT(SHA1('USER-ID'),2), 16, 10), 16); という感じで行う
 
+    settings.KVS_HORIZONTAL_PARTITIONING_ROUTER に 'ketama' か 'jump' を指定すると
+    コンシステントハッシュで振り分ける (get_router 参照)
+
     >>> from horizontalpartitioning import get_horizontal_partitioning_database_name
     >>> get_horizontal_partitioning_database_name('12346')
     'part2'
@@ -45,12 +51,234 @@ def get_horizontal_partitioning_database_name(key_name):
     >>> get_horizontal_partitioning_database_name(12346)
     TypeError: must be string or buffer, not int
     """
-    key_name = str(key_name) if isinstance(key_name, (int, long)) else key_name
-    hex_hash = hashlib.sha1(key_name).hexdigest()
-    group_number = (int(hex_hash[-2:], 16) % settings.KVS_HORIZONTAL_PARTITIONING_NUMBER)
-    #▲ハッシュ文字列の下2桁を16進数にしてDB振り分け。256台まではこれで大丈夫。スライスした方がちょっとだけ早かった
-    #むしろ下1桁だけ見ればいい気もするが、ローカルで%4などで使うケースもあるのでこれで良い
+    if getattr(settings, KVS_SETTINGS_ROUTER, ROUTER_MODULO) != ROUTER_MODULO:
+        return get_router().get_node(key_name)
+
+    group_number = _get_group_number(key_name, settings.KVS_HORIZONTAL_PARTITIONING_NUMBER)
     name_format = getattr(settings, KVS_SETTINGS_DEFAULT_DB_NAME_FORMAT) if hasattr(settings, KVS_SETTINGS_DEFAULT_DB_NAME_FORMAT) else DEFAULT_DB_NAME_FORMAT
     return name_format % group_number
 
 
+def _get_group_number(key_name, number):
+    key_name = str(key_name) if isinstance(key_name, (int, long)) else key_name
+    return ord(hashlib.sha1(key_name).digest()[-1]) % number
+    #▲ハッシュの最後の1バイト(16進文字列の下2桁)でDB振り分け。256台まではこれで大丈夫。
+    #むしろ下1桁だけ見ればいい気もするが、ローカルで%4などで使うケースもあるのでこれで良い
+
+
+#
+# シャードの振り分け方式
+#
+# 設定例
+# KVS_HORIZONTAL_PARTITIONING_ROUTER = 'ketama'    # modulo(従来方式) / ketama / jump
+# KVS_HORIZONTAL_PARTITIONING_NODES = {'shard0': 1, 'shard1': 1, 'shard2': 2}  # 接続名: 重み
+# KVS_HORIZONTAL_PARTITIONING_VNODES = 160         # ketama の重み1あたりの仮想ノード数
+#
+# NODES を省略した場合は KVS_HORIZONTAL_PARTITIONING_NUMBER 個の 'shard%d' を重み1で使う
+# jump の場合はノードの順序で振り分けが決まるので、NODES はリストで指定して末尾に追加していくこと
+#
+# 再配置中は変更前の振り分けを MIGRATING_FROM に書く (手順は reshard.py 参照)
+# KVS_HORIZONTAL_PARTITIONING_MIGRATING_FROM = {'router': 'modulo', 'number': 4}
+# KVS_HORIZONTAL_PARTITIONING_MIGRATING_FROM = {'router': 'ketama', 'nodes': [...], 'vnodes': 160}
+#
+
+ROUTER_MODULO = 'modulo'
+ROUTER_KETAMA = 'ketama'
+ROUTER_JUMP = 'jump'
+
+KVS_SETTINGS_ROUTER = 'KVS_HORIZONTAL_PARTITIONING_ROUTER'
+KVS_SETTINGS_NODES = 'KVS_HORIZONTAL_PARTITIONING_NODES'
+KVS_SETTINGS_VNODES = 'KVS_HORIZONTAL_PARTITIONING_VNODES'
+KVS_SETTINGS_MIGRATING_FROM = 'KVS_HORIZONTAL_PARTITIONING_MIGRATING_FROM'
+
+DEFAULT_VNODES = 160
+
+
+def _to_bytes(key_name):
+    if isinstance(key_name, (int, long)):
+        return str(key_name)
+    if isinstance(key_name, unicode):
+        return key_name.encode('utf-8')
+    return key_name
+
+
+def _normalize_nodes(nodes):
+    """
+    [(接続名, 重み), ...] に揃える
+    """
+    if isinstance(nodes, dict):
+        nodes = sorted(nodes.iteritems())
+    ret = []
+    for node in nodes:
+        if isinstance(node, (list, tuple)):
+            name, weight = node
+        else:
+            name, weight = node, 1
+        if weight <= 0:
+            raise ValueError('weight must be positive (%s)' % name)
+        ret.append((name, weight))
+    if not ret:
+        raise ValueError('nodes is empty')
+    return ret
+
+
+class ModuloRouter(object):
+    """
+    従来方式 (sha1 の下2桁 % シャード数)
+    移行元の振り分けを再現するために使う
+    """
+    def __init__(self, number, name_format=DEFAULT_DB_NAME_FORMAT):
+        self.number = number
+        self.name_format = name_format
+        self.nodes = [name_format % i for i in xrange(number)]
+
+    def get_node(self, key_name):
+        return self.name_format % _get_group_number(key_name, self.number)
+
+
+class KetamaRouter(object):
+    """
+    ketama 方式のコンシステントハッシュ
+    ノードごとに 重み * vnodes 個の点をリング上に置き、キーのハッシュ以上で最初の点のノードに振り分ける
+    ノードを追加・削除しても移動するキーはおよそ 1/ノード数 で済む
+    """
+    def __init__(self, nodes, vnodes=DEFAULT_VNODES):
+        self.nodes = []
+        ring = []
+        for name, weight in _normalize_nodes(nodes):
+            self.nodes.append(name)
+            count = int(vnodes * weight)
+            # md5 1回で4点
+            for i in xrange((count + 3) // 4):
+                digest = hashlib.md5('%s-%d' % (name, i)).digest()
+                for point in struct.unpack('<4I', digest)[:count - i * 4]:
+                    ring.append((point, name))
+        ring.sort()
+        self._points = [point for point, _name in ring]
+        self._names = [name for _point, name in ring]
+
+    def get_node(self, key_name):
+        point = struct.unpack_from('<I', hashlib.md5(_to_bytes(key_name)).digest())[0]
+        index = bisect.bisect(self._points, point)
+        if index == len(self._points):
+            index = 0
+        return self._names[index]
+
+
+def jump_hash(key, num_buckets):
+    """
+    Jump Consistent Hash (Lamping, Veach)
+    key は64bit整数
+    """
+    b, j = -1, 0
+    while j < num_buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xffffffffffffffff
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+class JumpRouter(object):
+    """
+    Jump Consistent Hash
+    重み n のノードは n 個のバケットを持つ
+    バケットは末尾にしか追加できないので、ノードは末尾に追加すること
+    """
+    def __init__(self, nodes):
+        self.nodes = []
+        self._buckets = []
+        for name, weight in _normalize_nodes(nodes):
+            self.nodes.append(name)
+            self._buckets.extend([name] * int(weight))
+
+    def get_node(self, key_name):
+        key = struct.unpack_from('>Q', hashlib.sha1(_to_bytes(key_name)).digest())[0]
+        return self._buckets[jump_hash(key, len(self._buckets))]
+
+
+def create_router(router_type=None, nodes=None, vnodes=None, number=None):
+    """
+    振り分けクラスを作る
+    引数が None の項目は settings の値を使う
+    """
+    if router_type is None:
+        router_type = getattr(settings, KVS_SETTINGS_ROUTER, ROUTER_MODULO)
+    if number is None:
+        number = settings.KVS_HORIZONTAL_PARTITIONING_NUMBER
+    if router_type == ROUTER_MODULO:
+        name_format = getattr(settings, KVS_SETTINGS_DEFAULT_DB_NAME_FORMAT, DEFAULT_DB_NAME_FORMAT)
+        return ModuloRouter(number, name_format)
+
+    if nodes is None:
+        nodes = getattr(settings, KVS_SETTINGS_NODES, None)
+    if nodes is None:
+        name_format = getattr(settings, KVS_SETTINGS_DEFAULT_DB_NAME_FORMAT, DEFAULT_DB_NAME_FORMAT)
+        nodes = [name_format % i for i in xrange(number)]
+
+    if router_type == ROUTER_KETAMA:
+        if vnodes is None:
+            vnodes = getattr(settings, KVS_SETTINGS_VNODES, DEFAULT_VNODES)
+        return KetamaRouter(nodes, vnodes)
+    if router_type == ROUTER_JUMP:
+        return JumpRouter(nodes)
+    raise ValueError('Unknown router (%s)' % router_type)
+
+
+_router = None
+_old_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """
+    settings から作った振り分けクラスを返す
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = create_router()
+    return _router
+
+
+def get_old_router():
+    """
+    再配置中なら変更前の振り分けクラスを返す 再配置中でなければ None
+    """
+    global _old_router
+    migrating_from = getattr(settings, KVS_SETTINGS_MIGRATING_FROM, None)
+    if not migrating_from:
+        return None
+    if _old_router is None:
+        with _router_lock:
+            if _old_router is None:
+                _old_router = create_router(migrating_from.get('router'),
+                                            migrating_from.get('nodes'),
+                                            migrating_from.get('vnodes'),
+                                            migrating_from.get('number'))
+    return _old_router
+
+
+def get_migration_source(key, connection_name):
+    """
+    再配置中に、key の移動前の接続名を返す
+    connection_name は移動後(現在の振り分け)の接続名
+    担当が変わらないキーや、再配置中でない場合は None
+    """
+    if not key or not is_enable_horizontal_partitioning():
+        return None
+    old_router = get_old_router()
+    if old_router is None:
+        return None
+    source = old_router.get_node(key)
+    return source if source != connection_name else None
+
+
+def reset_router():
+    """
+    settings を変更した場合に呼ぶ
+    """
+    global _router, _old_router
+    with _router_lock:
+        _router = None
+        _old_router = None
@@ -7,10 +7,10 @@
 from django.conf import settings
 from django.core.cache import cache
 
-import cPickle as pickle
-
 import client
-from horizontal import get_connection_name, is_enable_horizontal_partitioning
+from serializer import get_codec
+from horizontal import get_connection_name, get_migration_source, is_enable_horizontal_partitioning
+from reshard import migrate_key
 
 CAN_USE_MSGPACK = True
 try:
@@ -48,6 +48,9 @@ class KVSBase(object):
     KEY_NAME = None # デフォルトキー名
     KEY_FORMAT = '%s' # デフォルトキーフォーマット
     TIMEOUT = None # デフォルトタイムアウト
+    SERIALIZER = None # シリアライザ名 (Noneならsettings.KVS_SERIALIZER)
+    COMPRESS = None # 圧縮方式 (Noneならsettings.KVS_COMPRESS)
+    COMPRESS_THRESHOLD = None # 圧縮する最小バイト数 (Noneならsettings.KVS_COMPRESS_THRESHOLD)
     def __init__(self, keyvalue=None, keyname=None, keyformat=None, instance=None, timeout=None, **argv):
         self._keyprefix = DEFAULT_PREFIX
         if hasattr(settings, SETTINGS_NAME):
@@ -76,6 +79,9 @@ class KVSBase(object):
 
         self._instance = instance
         self._timeout = timeout if timeout else self.TIMEOUT
+        self._codec = get_codec(argv.get('serializer') or self.SERIALIZER,
+                                argv.get('compress') or self.COMPRESS,
+                                argv.get('compress_threshold') or self.COMPRESS_THRESHOLD)
 
     @property
     def keyformat(self):
@@ -170,6 +176,34 @@ class KVSBase(object):
         """
         raise NotImplementedError
 
+    def get_many(self, keyvalues):
+        """
+        複数の値をまとめて取得
+        {keyvalue: 値} を返す 存在しないキーは含まない
+        まとめて取得できるKVSではオーバーライドする
+        """
+        ret = {}
+        for keyvalue in keyvalues:
+            value = self.get(None, keyvalue=keyvalue)
+            if value is not None:
+                ret[keyvalue] = value
+        return ret
+
+    def set_many(self, mapping):
+        """
+        複数の値をまとめて設定
+        mapping: {keyvalue: 値}
+        """
+        for keyvalue, value in mapping.iteritems():
+            self.set(value, keyvalue=keyvalue)
+
+    def delete_many(self, keyvalues):
+        """
+        複数の値をまとめて削除
+        """
+        for keyvalue in keyvalues:
+            self.delete(keyvalue=keyvalue)
+
     """
     アクセッサ
     """
@@ -226,10 +260,10 @@ class TTObj(TTBase):
         self.instance.out(self._getkey(keyvalue))
 
     def _serialize(self, value):
-        return pickle.dumps(value)
+        return self._codec.encode(value)
 
     def _deserialize(self, value):
-        return pickle.loads(value)
+        return self._codec.decode(value)
 
 class TTObjMP(TTObj):
     """
@@ -289,6 +323,25 @@ class DjangoCache(KVSBase):
         cache.set(self._getkey(keyvalue), None, 1) # django.cacheのバグ対処
         ##cache.delete(self._getkey(keyvalue))
 
+    def get_many(self, keyvalues):
+        keys = dict((self.makekey(keyvalue), keyvalue) for keyvalue in keyvalues)
+        ret = {}
+        for key, value in cache.get_many(keys.keys()).iteritems():
+            if value is not None:
+                ret[keys[key]] = value
+        return ret
+
+    def set_many(self, mapping):
+        data = dict((self.makekey(keyvalue), value) for keyvalue, value in mapping.iteritems())
+        if self.timeout:
+            cache.set_many(data, self.timeout)
+        else:
+            cache.set_many(data)
+
+    def delete_many(self, keyvalues):
+        data = dict((self.makekey(keyvalue), None) for keyvalue in keyvalues)
+        cache.set_many(data, 1) # django.cacheのバグ対処
+
 class MySQLBase(KVSBase):
     """
     MySQL 基底 クラス
@@ -335,10 +388,10 @@ class MySQLObj(MySQLBase):
         self.instance.out(self._getkey(keyvalue))
 
     def _serialize(self, value):
-        return pickle.dumps(value)
+        return self._codec.encode(value)
 
     def _deserialize(self, value):
-        return pickle.loads(value)
+        return self._codec.decode(value)
 
 class MySQLObjMP(MySQLObj):
     """
@@ -385,8 +438,47 @@ class RedisBase(KVSBase):
         self._init_instance(set_name)
 
     def _init_instance(self, set_name=None):
-        redis_name = get_connection_name(key=self.key, default=set_name if set_name else self.SET_NAME)
+        self._set_name = set_name if set_name else self.SET_NAME
+        redis_name = get_connection_name(key=self.key, default=self._set_name)
         self._instance = client.get_redis_client(name=redis_name)
+        self._redis_name = redis_name
+        # 再配置中で、移動前の接続先が違う場合はその接続名 (reshard.py 参照)
+        self._migration_source = get_migration_source(self.key, redis_name)
+
+    def _migrate(self):
+        """
+        再配置中なら、最初のアクセス時に移動前の接続先からキーを移す
+        """
+        if self._migration_source:
+            migrate_key(self.key, self._migration_source, self._redis_name)
+            self._migration_source = None
+
+    def _group_keys(self, keyvalues):
+        """
+        keyvalueを接続先ごとにまとめる
+        水平分割時はキーごとに接続先が変わるので、接続先ごとに1回の通信で済むようにする
+        [(クライアント, [(keyvalue, キー), ...]), ...] を返す
+        """
+        pairs = [(keyvalue, self.makekey(keyvalue)) for keyvalue in keyvalues]
+        if not is_enable_horizontal_partitioning():
+            return [(self.instance, pairs)] if pairs else []
+
+        groups = {}
+        for keyvalue, key in pairs:
+            redis_name = get_connection_name(key=key, default=self._set_name)
+            source = get_migration_source(key, redis_name)
+            if source:
+                migrate_key(key, source, redis_name)
+            groups.setdefault(redis_name, []).append((keyvalue, key))
+        return [(client.get_redis_client(name=redis_name), group)
+                for redis_name, group in groups.iteritems()]
+
+    def delete_many(self, keyvalues):
+        """
+        接続先ごとに DEL でまとめて削除する
+        """
+        for instance, pairs in self._group_keys(keyvalues):
+            instance.delete_many([key for _keyvalue, key in pairs])
 
     def _getkey(self, keyvalue):
         """
@@ -394,6 +486,7 @@ class RedisBase(KVSBase):
         """
         if is_enable_horizontal_partitioning() and keyvalue:
             raise Error('cannot use keyvalue with horizontal')
+        self._migrate()
         return super(RedisBase, self)._getkey(keyvalue)
 
     def setkey(self, keyvalue):
@@ -404,7 +497,37 @@ class RedisBase(KVSBase):
             raise Error('cannot use setkey() with horizontal')
         super(RedisBase, self).setkey(keyvalue)
 
-class RedisStr(RedisBase):
+class RedisValueBase(RedisBase):
+    """
+    Redis 文字列値の基底クラス
+    MGET/MSET でまとめて取得・設定できる型だけが継承する
+    """
+    def get_many(self, keyvalues):
+        """
+        接続先ごとに MGET でまとめて取得する
+        """
+        ret = {}
+        for instance, pairs in self._group_keys(keyvalues):
+            values = instance.mget([key for _keyvalue, key in pairs])
+            for (keyvalue, _key), value in zip(pairs, values):
+                if value is not None:
+                    ret[keyvalue] = self._decode(value)
+        return ret
+
+    def set_many(self, mapping):
+        """
+        接続先ごとに MSET でまとめて設定する
+        """
+        for instance, pairs in self._group_keys(mapping.keys()):
+            instance.mset(dict((key, self._encode(mapping[keyvalue])) for keyvalue, key in pairs))
+
+    def _encode(self, value):
+        return value
+
+    def _decode(self, value):
+        return value
+
+class RedisStr(RedisValueBase):
     """
     Redis 文字列 クラス
     """
@@ -417,7 +540,7 @@ class RedisStr(RedisBase):
     def delete(self, keyvalue=None):
         self.instance.delete(self._getkey(keyvalue))
 
-class RedisObj(RedisBase):
+class RedisObj(RedisValueBase):
     """
     Redis オブジェクト クラス
     """
@@ -435,10 +558,16 @@ class RedisObj(RedisBase):
         self.instance.delete(self._getkey(keyvalue))
 
     def _serialize(self, value):
-        return pickle.dumps(value)
+        return self._codec.encode(value)
 
     def _deserialize(self, value):
-        return pickle.loads(value)
+        return self._codec.decode(value)
+
+    def _encode(self, value):
+        return self._serialize(value)
+
+    def _decode(self, value):
+        return self._deserialize(value)
 
 class RedisObjMP(RedisObj):
     """
@@ -459,7 +588,7 @@ class RedisObjMP(RedisObj):
     def _deserialize(self, value):
         return msgpack.loads(value)
 
-class RedisInt(RedisBase):
+class RedisInt(RedisValueBase):
     """
     Redis 整数 クラス
     """
@@ -475,6 +604,14 @@ class RedisInt(RedisBase):
     def delete(self, keyvalue=None):
         self.instance.delete(self._getkey(keyvalue))
 
+    def _encode(self, value):
+        if not isinstance(value, (int, long)):
+            raise TypeError("int or long argument required")
+        return value
+
+    def _decode(self, value):
+        return int(value)
+
 class RedisList(RedisBase):
     """
     Redis List クラス
@@ -497,6 +634,12 @@ class RedisList(RedisBase):
     def lset(self, idx, value, keyvalue=None):
         return self.instance.lset(self._getkey(keyvalue), idx, value)
 
+    def get_many(self, keyvalues):
+        raise Error('%s does not support get_many()' % self.__class__.__name__)
+
+    def set_many(self, mapping):
+        raise Error('%s does not support set_many()' % self.__class__.__name__)
+
 class RedisHash(RedisBase):
     """
     Redis Hash クラス
@@ -537,6 +680,12 @@ class RedisHash(RedisBase):
     def values(self, keyvalue=None):
         return self.instance.hvals(self._getkey(keyvalue))
 
+    def get_many(self, keyvalues):
+        raise Error('%s does not support get_many()' % self.__class__.__name__)
+
+    def set_many(self, mapping):
+        raise Error('%s does not support set_many()' % self.__class__.__name__)
+
 class DummyCache(KVSBase):
     """
     ダミー cache クラス
@@ -554,3 +703,12 @@ class DummyCache(KVSBase):
     def delete(self, keyvalue=None):
         pass
 
+    def get_many(self, keyvalues):
+        return {}
+
+    def set_many(self, mapping):
+        pass
+
+    def delete_many(self, keyvalues):
+        pass
+
@@ -2,13 +2,23 @@
 
 import threading
 import functools
+import time
 
 import redis
 
+## プーリングモード
+# semaphore: プロセス全体で1つのセマフォを使って同時実行数を制限する (従来の動作)
+# blocking: 接続名ごとのブロッキングコネクションプールを使う
+POOLING_MODE_SEMAPHORE = 'semaphore'
+POOLING_MODE_BLOCKING = 'blocking'
+
 ## グローバルパラメータ
 connection_pooling=True # コネクションプールを行うか
 connection_limit=1 # コネクションプールの際の1プロセスあたりの最大接続数
 use_common_pooling=False # gtoolkit.redis を使うか
+pooling_mode=POOLING_MODE_SEMAPHORE # プーリングモード
+pool_timeout=5 # blockingモードで空き接続を待つ秒数
+health_check_interval=30 # blockingモードでこの秒数使われていない接続はPINGで確認してから使う
 
 ## Djangoの設定を反映
 try:
@@ -18,6 +28,9 @@ try:
     use_common_pooling = getattr(settings,
                                  'USE_COMMON_REDIS_CONNECTION_POOLING',
                                  False)
+    pooling_mode = getattr(settings, 'REDIS_CONNECTION_POOLING_MODE', POOLING_MODE_SEMAPHORE)
+    pool_timeout = getattr(settings, 'REDIS_CONNECTION_POOL_TIMEOUT', 5)
+    health_check_interval = getattr(settings, 'REDIS_CONNECTION_HEALTH_CHECK_INTERVAL', 30)
 except ImportError:
     pass
 
@@ -56,14 +69,33 @@ def get_client(name="default", setting=None):
 
 
 def get_connection(setting):
+    """
+    REDIS_DATABASES の各設定で以下を指定するとblockingモードのプールに反映される
+    POOL_SIZE: 最大接続数 (省略時は REDIS_CONNECTION_LIMIT)
+    POOL_TIMEOUT: 空き接続を待つ秒数
+    HEALTH_CHECK_INTERVAL: PINGで確認するまでのアイドル秒数
+    """
     s = setting
     opts = {
         'host' : s['HOST'],
         'port' : int(s.get('PORT', DEFAULT_PORT)),
         'db'   : s.get('DB', DEFAULT_DB),
+        'mode' : pooling_mode,
+        'pool_size' : s.get('POOL_SIZE', connection_limit),
+        'pool_timeout' : s.get('POOL_TIMEOUT', pool_timeout),
+        'health_check_interval' : s.get('HEALTH_CHECK_INTERVAL', health_check_interval),
     }
     return RedisConnection(**opts)
 
+
+def get_pool_stats():
+    """
+    接続名ごとのプールの使用状況を返す (blockingモードのみ)
+    """
+    return dict((name, connection.con.stats.as_dict())
+                for name, connection in CONNECTION_POOL.items()
+                if isinstance(connection.con, MeteredBlockingConnectionPool))
+
 class RedisKVSError(Exception):
     pass
 
@@ -71,23 +103,146 @@ class RedisKVSError(Exception):
 class RedisConnectionError(RedisKVSError):
     pass
 
+class PoolStats(object):
+    """
+    コネクションプールの使用状況
+    """
+    def __init__(self, size):
+        self._lock = threading.Lock()
+        self.size = size
+        self.in_use = 0 # 使用中の接続数
+        self.max_in_use = 0 # 同時使用数の最大
+        self.checkouts = 0 # 接続の取得回数
+        self.waits = 0 # 空き接続を待った回数
+        self.wait_time = 0.0 # 空き接続を待った合計秒数
+        self.timeouts = 0 # 空き接続を待ってタイムアウトした回数
+        self.health_check_failures = 0 # PINGに失敗して再接続した回数
+
+    def checkout(self, waited):
+        with self._lock:
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            self.checkouts += 1
+            if waited > 0.001:
+                self.waits += 1
+                self.wait_time += waited
+
+    def checkin(self):
+        with self._lock:
+            self.in_use -= 1
+
+    def timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def health_check_failure(self):
+        with self._lock:
+            self.health_check_failures += 1
+
+    @property
+    def saturation(self):
+        """
+        使用中の接続数 / 最大接続数
+        """
+        return float(self.in_use) / self.size if self.size else 0.0
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'in_use': self.in_use,
+                'max_in_use': self.max_in_use,
+                'saturation': self.saturation,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'timeouts': self.timeouts,
+                'health_check_failures': self.health_check_failures,
+            }
+
+
+class MeteredBlockingConnectionPool(redis.BlockingConnectionPool):
+    """
+    使用状況を記録するブロッキングコネクションプール
+    最大接続数まで使用中の場合は timeout 秒まで空きを待つ
+    しばらく使われていなかった接続はPINGで確認し、切れていれば再接続する
+    """
+    def __init__(self, health_check_interval=None, **kwargs):
+        self.health_check_interval = health_check_interval
+        self.stats = PoolStats(kwargs.get('max_connections'))
+        super(MeteredBlockingConnectionPool, self).__init__(**kwargs)
+
+    def get_connection(self, command_name, *keys, **options):
+        start = time.time()
+        try:
+            connection = super(MeteredBlockingConnectionPool, self).get_connection(
+                command_name, *keys, **options)
+        except redis.ConnectionError:
+            self.stats.timeout()
+            raise
+        self.stats.checkout(time.time() - start)
+        self._check_health(connection)
+        return connection
+
+    def release(self, connection):
+        self.stats.checkin()
+        connection.last_used_at = time.time()
+        super(MeteredBlockingConnectionPool, self).release(connection)
+
+    def _check_health(self, connection):
+        last_used_at = getattr(connection, 'last_used_at', None)
+        if self.health_check_interval is None or last_used_at is None:
+            return
+        if time.time() - last_used_at < self.health_check_interval:
+            return
+
+        try:
+            connection.send_command('PING')
+            connection.read_response()
+        except (redis.ConnectionError, redis.TimeoutError):
+            # 次のコマンド送信時に再接続される
+            self.stats.health_check_failure()
+            connection.disconnect()
+
+
 class RedisConnection(object):
-    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, db=DEFAULT_DB):
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, db=DEFAULT_DB,
+                 mode=POOLING_MODE_SEMAPHORE, pool_size=None, pool_timeout=None,
+                 health_check_interval=None):
         global connection_limit
 
         self.host = host
         self.port = port
         self.db = db
-
-        self.con = redis.ConnectionPool(max_connections=connection_limit,
-                                        host=self.host,
-                                        port=self.port,
-                                        db=self.db,
-                                        )
+        self.mode = mode
+
+        if mode == POOLING_MODE_BLOCKING:
+            self.con = MeteredBlockingConnectionPool(
+                health_check_interval=health_check_interval,
+                max_connections=pool_size or connection_limit,
+                timeout=pool_timeout,
+                host=self.host,
+                port=self.port,
+                db=self.db,
+            )
+        else:
+            self.con = redis.ConnectionPool(max_connections=connection_limit,
+                                            host=self.host,
+                                            port=self.port,
+                                            db=self.db,
+                                            )
 
         if not self.con:
             raise RedisConnectionError
 
+    @property
+    def use_semaphore(self):
+        """
+        プロセス全体のセマフォで同時実行数を制限するか
+        blockingモードではプール自体が接続数を制限する
+        """
+        return connection_pooling and self.mode != POOLING_MODE_BLOCKING
+
 class RedisClient(object):
 
     class Error(RedisKVSError):
@@ -101,6 +256,7 @@ class RedisClient(object):
 
         self.setting = setting
 
+        self.connection = None
         if use_common_pooling and client is not None:
             self.client = client
         else:
@@ -110,10 +266,14 @@ class RedisClient(object):
         if not self.client:
             raise self.CannotGetRedisClient
 
-    def execute(self, f):
-        global connection_pooling
+    @property
+    def use_semaphore(self):
+        if self.connection is None:
+            return connection_pooling
+        return self.connection.use_semaphore
 
-        if connection_pooling:
+    def execute(self, f):
+        if self.use_semaphore:
             # プーリング制御を行う
             SEMA_POOL.acquire()
             try:
@@ -138,6 +298,24 @@ class RedisClient(object):
     def delete(self, key):
         self.execute(functools.partial(self.client.delete, key))
 
+    '''
+    MULTI KEY
+    '''
+    def mget(self, keys):
+        if not keys:
+            return []
+        return self.execute(functools.partial(self.client.mget, keys))
+
+    def mset(self, mapping):
+        if not mapping:
+            return
+        self.execute(functools.partial(self.client.mset, mapping))
+
+    def delete_many(self, keys):
+        if not keys:
+            return
+        self.execute(functools.partial(self.client.delete, *keys))
+
     '''
     INTEGER
     '''
@@ -239,12 +417,13 @@ class RedisClient(object):
     from contextlib import contextmanager
     @contextmanager
     def pipeline(self, *args, **kwargs):
-        if connection_pooling:
+        use_semaphore = self.use_semaphore
+        if use_semaphore:
             SEMA_POOL.acquire()
 
         try:
-            with self.client.pipeline() as pipe:
+            with self.client.pipeline(*args, **kwargs) as pipe:
                 yield pipe
         finally:
-            if connection_pooling:
+            if use_semaphore:
                 SEMA_POOL.release()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+#
+# Redis シャードの再配置
+#
+# 振り分け方式やノードを変更したときに、担当シャードが変わったキーだけを移動する
+# 移動は DUMP/RESTORE で行い、TTL も引き継ぐ
+# 期限切れ間近(PTTL が 0 以下で -1 以外)のキーは移動せず、移動元から削除する
+# Redis へのアクセスは RedisClient を通し、セマフォ・プールの接続数制限に従う
+#
+# 移動先に既にキーがある場合は上書きせず、移動先を正とする (移動後の振り分けで書き込まれた値)
+# 移動元は DUMP した値から変わっていない場合だけ削除する。変わっていれば残して conflicts に数える
+#
+# 稼働中の切り替え手順
+#   1. settings を新しい振り分けにし、KVS_HORIZONTAL_PARTITIONING_MIGRATING_FROM に変更前の振り分けを書いて
+#      全プロセスに反映する
+#      再配置中の KVS は、キーに初めてアクセスしたときに移動元から移動先へキーを移してから読み書きする
+#      (移動先を読み、無ければ移動元を読むのと同じ結果になり、削除や加算も移動先で行われる)
+#   2. 全プロセスへの反映が終わってから reshard() を実行する
+#      conflicts が 0 でなければ、もう一度実行する
+#   3. moved と conflicts が 0 になったら MIGRATING_FROM を削除して反映する
+#
+# MIGRATING_FROM を設定せずに reshard() を使う場合は、書き込みを止めてから実行すること
+# (移動中は古い振り分けでも新しい振り分けでも見つからないキーがある)
+#
+# >>> from kvs.horizontal import ModuloRouter, create_router
+# >>> from kvs.reshard import reshard
+# >>> old = ModuloRouter(4)
+# >>> new = create_router('ketama', nodes=['shard0', 'shard1', 'shard2', 'shard3', 'shard4'])
+# >>> reshard(old, new, dry_run=True)
+#
+
+import functools
+import logging
+
+import redis
+
+import client
+
+_logger = logging.getLogger('kvs.reshard')
+
+# SCAN 1回あたりの件数の目安
+DEFAULT_SCAN_COUNT = 1000
+
+# パイプラインにまとめるキー数
+DEFAULT_BATCH_SIZE = 100
+
+# DUMP と PTTL を同時点の値で返す
+# redis.Redis は PTTL の -1/-2/0 を None にしてしまうので、EVAL で生の値を受け取る
+_DUMP_WITH_PTTL = """
+return {redis.call('dump', KEYS[1]), redis.call('pttl', KEYS[1])}
+"""
+
+# PTTL: TTL無し
+_NO_TTL = -1
+
+# DUMP した値から変わっていなければ削除する
+_DELETE_IF_UNCHANGED = """
+if redis.call('dump', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class ReshardStats(object):
+    """
+    再配置の集計
+    """
+    def __init__(self):
+        self.scanned = 0
+        self.moved = 0
+        self.skipped = 0 # 移動中に消えた・期限切れになったキー
+        self.conflicts = 0 # DUMP 後に移動元が変更されたため削除しなかったキー
+        self.routes = {} # (移動元, 移動先) → 件数
+
+    def as_dict(self):
+        return {
+            'scanned': self.scanned,
+            'moved': self.moved,
+            'skipped': self.skipped,
+            'conflicts': self.conflicts,
+            'routes': dict(self.routes),
+        }
+
+
+def reshard(old_router, new_router, match='*', dry_run=False,
+            scan_count=DEFAULT_SCAN_COUNT, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    old_router の全ノードを SCAN し、new_router で担当が変わるキーを移動する
+    old_router で担当外のキー(移動済み・途中で中断したもの)は移動しない
+    dry_run=True の場合は件数だけ数える
+    """
+    stats = ReshardStats()
+    for source in old_router.nodes:
+        source_client = client.get_redis_client(name=source)
+        batch = []
+        for key in _scan_iter(source_client, match, scan_count):
+            stats.scanned += 1
+            if old_router.get_node(key) != source:
+                continue
+            destination = new_router.get_node(key)
+            if destination == source:
+                continue
+
+            route = (source, destination)
+            stats.routes[route] = stats.routes.get(route, 0) + 1
+            if dry_run:
+                continue
+
+            batch.append((key, destination))
+            if len(batch) >= batch_size:
+                _move(source_client, batch, stats)
+                batch = []
+        if batch and not dry_run:
+            _move(source_client, batch, stats)
+        _logger.info('reshard %s done. %s', source, stats.as_dict())
+    return stats
+
+
+def _scan_iter(redis_client, match, count):
+    """
+    SCAN を1回ずつ RedisClient.execute で実行する
+    """
+    cursor = '0'
+    while cursor != 0:
+        cursor, keys = redis_client.execute(functools.partial(
+            redis_client.client.scan, cursor=cursor, match=match, count=count))
+        for key in keys:
+            yield key
+
+
+def _move(source_client, batch, stats):
+    """
+    移動元から DUMP/PTTL をまとめて取得し、移動先ごとに RESTORE してから
+    移動元を変わっていなければ削除する
+    期限切れ間近のキーは RESTORE せずに移動元から削除する
+    """
+    with source_client.pipeline(transaction=False) as pipe:
+        for key, _destination in batch:
+            pipe.eval(_DUMP_WITH_PTTL, 1, key)
+        results = pipe.execute()
+
+    destinations = {}
+    dumped = []
+    expired = []
+    for (key, destination), (value, ttl) in zip(batch, results):
+        if value is None:
+            stats.skipped += 1
+            continue
+        ttl = _restore_ttl(ttl)
+        if ttl is None:
+            expired.append((key, value))
+            continue
+        destinations.setdefault(destination, []).append((key, value, ttl))
+        dumped.append((key, value))
+
+    for destination, items in destinations.iteritems():
+        destination_client = client.get_redis_client(name=destination)
+        with destination_client.pipeline(transaction=False) as pipe:
+            for key, value, ttl in items:
+                pipe.restore(key, ttl, value)
+            results = pipe.execute(raise_on_error=False)
+        for result in results:
+            if isinstance(result, Exception) and not _is_busy_key(result):
+                raise result
+
+    if not dumped and not expired:
+        return
+    with source_client.pipeline(transaction=False) as pipe:
+        for key, value in dumped + expired:
+            pipe.eval(_DELETE_IF_UNCHANGED, 1, key, value)
+        results = pipe.execute()
+    for deleted in results[:len(dumped)]:
+        if deleted:
+            stats.moved += 1
+        else:
+            stats.conflicts += 1
+    stats.skipped += len(expired)
+
+
+def migrate_key(key, source, destination):
+    """
+    1キーを source から destination へ移動する (再配置中のアクセス時用)
+    移動先に既にあれば移動先を正とする
+    期限切れ間近のキーは移動せずに移動元から削除する
+    移動したか移動先に既にあった場合 True
+    """
+    source_client = client.get_redis_client(name=source)
+    value, ttl = source_client.execute(functools.partial(
+        source_client.client.eval, _DUMP_WITH_PTTL, 1, key))
+    if value is None:
+        return False
+
+    ttl = _restore_ttl(ttl)
+    if ttl is not None:
+        destination_client = client.get_redis_client(name=destination)
+        try:
+            destination_client.execute(functools.partial(
+                destination_client.client.restore, key, ttl, value))
+        except redis.ResponseError, e:
+            if not _is_busy_key(e):
+                raise
+    source_client.execute(functools.partial(
+        source_client.client.eval, _DELETE_IF_UNCHANGED, 1, key, value))
+    return ttl is not None
+
+
+def _restore_ttl(ttl):
+    """
+    PTTL の値から RESTORE に渡す TTL を返す
+    TTL無し(-1)は 0 (無期限)、期限切れ間近(0 以下)は None (移動しない)
+    """
+    if ttl == _NO_TTL:
+        return 0
+    if ttl > 0:
+        return ttl
+    return None
+
+
+def _is_busy_key(e):
+    return isinstance(e, redis.ResponseError) and str(e).startswith('BUSYKEY')
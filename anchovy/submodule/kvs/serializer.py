@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+#
+# KVS 値のシリアライザ
+#
+# シリアライザ名を指定すると、先頭に1バイトのヘッダを付けて保存する
+#   下位3ビット: シリアライザID
+#   0x08: zlib圧縮
+#   0x10: lz4圧縮
+# ヘッダは 0x20 未満の値なので、従来の pickle (プロトコル0) の値とは先頭バイトで区別できる。
+# ヘッダの無い値は従来通り pickle.loads で読むので、設定を切り替えても既存の値はそのまま読める。
+#
+# 設定例
+# KVS_SERIALIZER = 'pickle'        # pickle / msgpack / marshal  (None なら従来形式)
+# KVS_COMPRESS = 'zlib'            # zlib / lz4  (None なら圧縮しない)
+# KVS_COMPRESS_THRESHOLD = 1024    # このバイト数以上の値だけ圧縮する
+#
+
+import cPickle as pickle
+import marshal
+import threading
+import zlib
+
+from django.conf import settings
+
+CAN_USE_MSGPACK = True
+try:
+    import msgpack
+except ImportError:
+    CAN_USE_MSGPACK = False
+
+CAN_USE_LZ4 = True
+try:
+    import lz4
+except ImportError:
+    CAN_USE_LZ4 = False
+
+# 圧縮フラグ
+FLAG_ZLIB = 0x08
+FLAG_LZ4 = 0x10
+
+SERIALIZER_ID_MASK = 0x07
+HEADER_MAX = 0x20
+
+DEFAULT_COMPRESS_THRESHOLD = 1024
+
+# zlib圧縮レベル
+ZLIB_LEVEL = 6
+
+
+class SerializerError(Exception):
+    pass
+
+
+class Serializer(object):
+    """
+    シリアライザ定義
+    """
+    def __init__(self, name, serializer_id, dumps, loads):
+        if not 0 < serializer_id <= SERIALIZER_ID_MASK:
+            raise SerializerError('Invalid serializer id (%s)' % serializer_id)
+        self.name = name
+        self.serializer_id = serializer_id
+        self.dumps = dumps
+        self.loads = loads
+
+
+# シリアライザ名 → Serializer
+_serializers = {}
+
+# シリアライザID → Serializer
+_serializer_ids = {}
+
+
+def register_serializer(name, serializer_id, dumps, loads):
+    """
+    シリアライザを登録する
+    IDは保存した値のヘッダに書かれるので、一度使ったIDは変更しないこと
+    """
+    serializer = Serializer(name, serializer_id, dumps, loads)
+    if serializer_id in _serializer_ids and _serializer_ids[serializer_id].name != name:
+        raise SerializerError('Serializer id (%d) is already used by %s' % (serializer_id, _serializer_ids[serializer_id].name))
+    _serializers[name] = serializer
+    _serializer_ids[serializer_id] = serializer
+    return serializer
+
+
+def get_serializer(name):
+    try:
+        return _serializers[name]
+    except KeyError:
+        raise SerializerError('Unknown serializer (%s)' % name)
+
+
+def _pickle_dumps(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+register_serializer('pickle', 1, _pickle_dumps, pickle.loads)
+register_serializer('marshal', 3, marshal.dumps, marshal.loads)
+if CAN_USE_MSGPACK:
+    register_serializer('msgpack', 2, msgpack.dumps, msgpack.loads)
+
+
+class Codec(object):
+    """
+    値のエンコード・デコード
+
+    serializer が None のときは従来形式 (pickle プロトコル0、ヘッダ無し) で保存する。
+    デコードはヘッダの有無を見て判断するので、どの設定でも両方の形式を読める。
+    """
+    def __init__(self, serializer=None, compress=None, threshold=DEFAULT_COMPRESS_THRESHOLD):
+        if compress and serializer is None:
+            # 圧縮にはヘッダが必要
+            serializer = 'pickle'
+        self.serializer = get_serializer(serializer) if serializer else None
+
+        self.compress_flag = 0
+        if compress == 'zlib':
+            self.compress_flag = FLAG_ZLIB
+        elif compress == 'lz4':
+            if not CAN_USE_LZ4:
+                raise SerializerError('Can not use lz4')
+            self.compress_flag = FLAG_LZ4
+        elif compress:
+            raise SerializerError('Unknown compress (%s)' % compress)
+        self.threshold = threshold
+
+    def encode(self, value):
+        if self.serializer is None:
+            return pickle.dumps(value)
+
+        header = self.serializer.serializer_id
+        s = self.serializer.dumps(value)
+        if self.compress_flag and len(s) >= self.threshold:
+            if self.compress_flag == FLAG_ZLIB:
+                compressed = zlib.compress(s, ZLIB_LEVEL)
+            else:
+                compressed = lz4.compress(s)
+            # 縮まなければ圧縮しない
+            if len(compressed) < len(s):
+                header |= self.compress_flag
+                s = compressed
+        return chr(header) + s
+
+    def decode(self, s):
+        if not s:
+            return pickle.loads(s)
+        header = ord(s[0])
+        if header >= HEADER_MAX:
+            # 従来形式
+            return pickle.loads(s)
+
+        serializer = _serializer_ids.get(header & SERIALIZER_ID_MASK)
+        if serializer is None:
+            raise SerializerError('Unknown serializer id (%d)' % (header & SERIALIZER_ID_MASK))
+        s = s[1:]
+        if header & FLAG_ZLIB:
+            s = zlib.decompress(s)
+        elif header & FLAG_LZ4:
+            if not CAN_USE_LZ4:
+                raise SerializerError('Can not use lz4')
+            s = lz4.decompress(s)
+        return serializer.loads(s)
+
+
+_codecs = {}
+_codecs_lock = threading.Lock()
+
+
+def get_codec(serializer=None, compress=None, threshold=None):
+    """
+    Codecを返す
+    引数が None の項目は settings の値を使う
+    """
+    if serializer is None:
+        serializer = getattr(settings, 'KVS_SERIALIZER', None)
+    if compress is None:
+        compress = getattr(settings, 'KVS_COMPRESS', None)
+    if threshold is None:
+        threshold = getattr(settings, 'KVS_COMPRESS_THRESHOLD', DEFAULT_COMPRESS_THRESHOLD)
+
+    key = (serializer, compress, threshold)
+    codec = _codecs.get(key)
+    if codec is None:
+        with _codecs_lock:
+            codec = _codecs.get(key)
+            if codec is None:
+                codec = Codec(serializer, compress, threshold)
+                _codecs[key] = codec
+    return codec
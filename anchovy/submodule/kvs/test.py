@@ -4,8 +4,8 @@
 # KVS テストコード
 #
 
-from kvs import DjangoCache, TTInt, TTStr, TTObj, DummyCache, TTObjMP, RedisObj, RedisObjMP
-from generic import KVS, AttributeKVS, ListKVS
+from kvs import DjangoCache, TTInt, TTStr, TTObj, DummyCache, TTObjMP, RedisObj, RedisObjMP, RedisHash, Error
+from generic import KVS, AttributeKVS, HashAttributeKVS, ListKVS
 
 # KVSクラス定義
 class TestDjangoCache(DjangoCache):
@@ -31,6 +31,9 @@ class TestRedisObj(RedisObj):
 class TestRedisObjMP(RedisObjMP):
     KEY_FORMAT = "%d"
     SET_NAME = 'test'
+class TestRedisHash(RedisHash):
+    KEY_FORMAT = "%d"
+    SET_NAME = 'test'
 class TestAttributeKVS(AttributeKVS):
     KVS_CLASS = "RedisObjMP"
 
@@ -42,7 +45,9 @@ class TestKVS(KVS):
 def test():
     test_kvs_all()
     test_kvs()
+    test_kvs_many()
     test_attrkvs()
+    test_hashattrkvs()
     test_listkvs()
 
 def test_kvs():
@@ -56,6 +61,30 @@ def test_kvs():
     print t.get() # 値取得
     t.delete() # 値削除
 
+def test_kvs_many():
+    """
+    複数キーの一括取得・設定・削除
+    """
+    print '=== start test of KVS get_many/set_many/delete_many'
+    for cls in (TestDjangoCache, TestRedisObj, TestRedisObjMP, TestDummy):
+        kvs = cls(0)
+        kvs.set_many({1: {"TEST": 1}, 2: {"TEST": 2}, 3: {"TEST": 3}})
+        print kvs.get_many([1, 2, 3, 4])
+        kvs.delete_many([1, 2, 3])
+        print kvs.get_many([1, 2, 3, 4])
+
+    t = TestKVS('ABC')
+    t.set_many({'A': 1, 'B': 2})
+    print t.get_many(['A', 'B', 'C'])
+    t.delete_many(['A', 'B'])
+    print t.get_many(['A', 'B', 'C'])
+
+    # Hash/List は MGET/MSET で上書きしてしまうので使えない
+    try:
+        TestRedisHash(0).set_many({1: {'a': 1}})
+    except Error, e:
+        print e
+
 def test_kvs_all():
     """
     KVSクラステストコード
@@ -146,6 +175,34 @@ def test_attrkvs():
     del d.aaa
     del d.bbb
 
+def test_hashattrkvs():
+    """
+    HashAttributeKVSのテスト
+    """
+    print '=== start test of HashAttributeKVS'
+
+    class Player(HashAttributeKVS):
+        ATTRIBUTES = {'aaa': 1, 'bbb': 2, 'ccc': None}
+
+    d = Player('123')
+    d.init_values() # キー 'Player::123' のハッシュに aaa, bbb, ccc をまとめて設定
+    print d.todict()
+
+    with Player('123') as x:
+        print 'x.aaa: %d' % x.aaa # HGETALL は最初の1回だけ
+        print 'x.bbb: %d' % x.bbb
+        x.bbb += 3
+        x.ccc = {'TEST': 1}
+        del x.aaa
+    # ここで HMSET/HDEL をまとめて送信
+
+    y = Player('123').load(['aaa', 'bbb'])
+    print 'y.aaa: %s' % y.aaa
+    print 'y.bbb: %d' % y.bbb
+    print y.todict()
+    y.deleteall()
+    print Player('123').todict()
+
 
 def test_listkvs():
     """